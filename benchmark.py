@@ -0,0 +1,252 @@
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import story_threads
+
+WORDS = ["hero", "villain", "ally", "mentor", "artifact", "secret", "journey", "betrayal", "castle", "storm", "letter", "oath", "map", "crown", "river", "duel"]
+
+
+### generate stories ###
+
+def generate_story(events, threads, depth=8, open_ratio=0.1, seed=0):
+	"""
+	Generate a synthetic story with valid story threads.
+
+	The events are distributed randomly over the threads. At most
+	`depth` threads are developed at the same time, a thread that has
+	used up its events makes room for the next one. The share of
+	threads given by `open_ratio` is never closed.
+
+	Args:
+		events: The number of events of the story.
+		threads: The number of threads of the story. It is reduced if
+			there are not enough events to open and close every
+			thread.
+		depth: The maximum number of threads that are developed at the
+			same time. The default is 8.
+		open_ratio: The share of threads that stay open. The default is
+			0.1.
+		seed: The seed of the random generator. The default is 0.
+
+	Return:
+		thread_list: The list of dictionaries that represent story
+			threads.
+	"""
+	rng = random.Random(seed)
+	threads = max(1, min(threads, events // 2))
+	open_threads = set(rng.sample(range(threads), round(threads * open_ratio)))
+	# every thread needs at least an opening and a closing
+	budgets = [2] * threads
+	for _ in range(events - 2 * threads):
+		budgets[rng.randrange(threads)] += 1
+
+	thread_list = []
+	names = {}
+	next_thread = 0
+	active = []
+	while next_thread < threads or active:
+		while next_thread < threads and len(active) < depth:
+			active.append(next_thread)
+			next_thread += 1
+		a = rng.randrange(len(active))
+		t = active[a]
+		budgets[t] -= 1
+		if t not in names:
+			names[t] = f"thread {t}: the {rng.choice(WORDS)} and the {rng.choice(WORDS)}"
+			event = story_threads.EVENT.OPENING.value
+			description = names[t]
+		elif budgets[t] == 0 and t not in open_threads:
+			event = story_threads.EVENT.CLOSING.value
+			description = f"the {rng.choice(WORDS)} wins ({len(thread_list)})"
+		else:
+			event = story_threads.EVENT.DEVELOPMENT.value
+			description = f"the {rng.choice(WORDS)} meets the {rng.choice(WORDS)} ({len(thread_list)})"
+		thread_list.append({names[t]: {"event": event, "description": description}})
+		if budgets[t] == 0:
+			active[a] = active[-1]
+			active.pop()
+	return thread_list
+
+
+### time operations ###
+
+def operation_args(story, path, **kwargs):
+	"""
+	Build the arguments of an operation like the command line would.
+
+	Args:
+		story: The name of the story.
+		path: The path to the story file.
+		**kwargs: The arguments of the operation.
+
+	Return:
+		args: The arguments of the operation.
+	"""
+	return argparse.Namespace(story=story, path=path, show_connections=False, **kwargs)
+
+def benchmark_operations(thread_list):
+	"""
+	List the operations to time on a story.
+
+	Every operation is a function of the story name, path and thread
+	list that changes or shows the stored story.
+
+	Args:
+		thread_list: The list of dictionaries that represent story
+			threads.
+
+	Return:
+		operations: A dictionary with the operation names as keys and
+			the operations as values.
+	"""
+	thread_index = story_threads.index_thread_positions(thread_list)
+	# a thread in the middle of the story
+	name = next(iter(thread_list[len(thread_list) // 2].keys()))
+	middle = thread_index[name][len(thread_index[name]) // 2]
+	# a development that can swap places with the event after it
+	developments = [i for i in thread_index[name] if thread_list[i][name]["event"] == story_threads.EVENT.DEVELOPMENT and i + 1 < len(thread_list) and name not in thread_list[i+1]]
+	run_py = str(Path(__file__).with_name("run.py"))
+
+	def cli(*arguments):
+		return lambda story, path, thread_list: subprocess.run([sys.executable, run_py, story, "-p", str(path), *arguments], stdout=subprocess.DEVNULL, check=True)
+
+	operations = {
+		"retrieve": lambda story, path, thread_list: story_threads.retrieve_storythreads(story, path),
+		"store": lambda story, path, thread_list: story_threads.store_storythreads(story, path, thread_list),
+		"add": lambda story, path, thread_list: story_threads.add_thread(operation_args(story, path, names=[name, "a benchmarked development"], indices=[middle + 1], close=False)),
+		"remove": lambda story, path, thread_list: story_threads.remove_thread(operation_args(story, path, name=name, development="", ending=False)),
+		"show": lambda story, path, thread_list: story_threads.show_threads(operation_args(story, path)),
+		"undo": lambda story, path, thread_list: story_threads.undo(operation_args(story, path)),
+		"cli show": cli("show"),
+		"cli add": cli("add", name, "a benchmarked development", "-i", str(middle + 1)),
+	}
+	if developments:
+		operations["change"] = lambda story, path, thread_list: story_threads.change_thread(operation_args(story, path, name=name, opening="", ending="", development=[str(developments[0]), str(developments[0] + 1)]))
+	return operations
+
+def time_operation(operation, thread_list, repeat):
+	"""
+	Time an operation on a freshly stored copy of a story.
+
+	Args:
+		operation: The operation to time (see benchmark_operations).
+		thread_list: The list of dictionaries that represent story
+			threads.
+		repeat: How often the operation is timed.
+
+	Return:
+		seconds: The fastest time of the operation.
+	"""
+	times = []
+	for _ in range(repeat):
+		with tempfile.TemporaryDirectory() as path:
+			story_threads.store_storythreads("benchmark", path, thread_list)
+			story_threads.cache_storythreads("benchmark", path, thread_list)
+			with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+				start = time.perf_counter()
+				operation("benchmark", path, thread_list)
+				times.append(time.perf_counter() - start)
+	return min(times)
+
+def run_benchmarks(sizes, threads_per_event=0.01, depth=8, open_ratio=0.1, repeat=3, max_seconds=10, operations=None, log=print):
+	"""
+	Time all operations on generated stories of the given sizes.
+
+	An operation that takes longer than `max_seconds` on a story is
+	skipped for all larger stories.
+
+	Args:
+		sizes: The numbers of events of the generated stories.
+		threads_per_event: The number of threads per event.
+		depth: The maximum number of threads developed at once.
+		open_ratio: The share of threads that stay open.
+		repeat: How often every operation is timed.
+		max_seconds: The time after which an operation is not timed on
+			larger stories anymore.
+		operations: The names of the operations to time. The default
+			is to time all of them (None).
+		log: The function to report progress with.
+
+	Return:
+		results: A dictionary with the operation names as keys and
+			dictionaries of the story sizes (as strings) and times in
+			seconds as values.
+	"""
+	results = {}
+	too_slow = set()
+	for size in sorted(sizes):
+		thread_list = generate_story(size, max(1, round(size * threads_per_event)), depth, open_ratio)
+		for name, operation in benchmark_operations(thread_list).items():
+			if (operations and name not in operations) or name in too_slow:
+				continue
+			seconds = time_operation(operation, thread_list, repeat)
+			results.setdefault(name, {})[str(size)] = seconds
+			log(f"{name:>10} {size:>8} events: {seconds:.6f} s")
+			if seconds > max_seconds:
+				too_slow.add(name)
+	return results
+
+def compare_results(results, baseline, threshold):
+	"""
+	Find the operations that became slower than in a baseline.
+
+	Args:
+		results: The results of run_benchmarks.
+		baseline: The results of a previous run to compare to.
+		threshold: The relative slowdown that counts as regression,
+			e.g. 0.25 for 25 %.
+
+	Return:
+		regressions: A list of (operation, size, baseline seconds,
+			seconds) tuples.
+	"""
+	regressions = []
+	for name, times in results.items():
+		for size, seconds in times.items():
+			previous = baseline.get(name, {}).get(size)
+			if previous is not None and seconds > previous * (1 + threshold):
+				regressions.append((name, size, previous, seconds))
+	return regressions
+
+
+### parse input and run benchmarks ###
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(prog="story-threads-benchmark", description="Time the story thread operations on generated stories")
+	parser.add_argument("-s", "--sizes", type=int, nargs="+", default=[10**2, 10**3, 10**4, 10**5, 10**6], help="the numbers of events of the generated stories")
+	parser.add_argument("-t", "--threads", type=float, default=0.01, help="the number of threads per event")
+	parser.add_argument("-d", "--depth", type=int, default=8, help="the maximum number of threads that are developed at the same time")
+	parser.add_argument("--open-ratio", type=float, default=0.1, help="the share of threads that stay open")
+	parser.add_argument("-r", "--repeat", type=int, default=3, help="how often every operation is timed")
+	parser.add_argument("-m", "--max-seconds", type=float, default=10, help="skip an operation on larger stories once it takes longer than this")
+	parser.add_argument("-O", "--operations", type=str, nargs="+", help="the operations to time (default: all)")
+	parser.add_argument("-o", "--output", type=str, help="the json file to store the results in")
+	parser.add_argument("-b", "--baseline", type=str, help="the json file with the results to compare to")
+	parser.add_argument("--threshold", type=float, default=0.25, help="the relative slowdown that counts as regression")
+	args = parser.parse_args(argv)
+
+	results = run_benchmarks(args.sizes, args.threads, args.depth, args.open_ratio, args.repeat, args.max_seconds, args.operations)
+	if args.output:
+		with open(args.output, "w") as f:
+			json.dump({"python": platform.python_version(), "results": results}, f, indent=1)
+	if args.baseline:
+		with open(args.baseline, "r") as f:
+			baseline = json.load(f)["results"]
+		regressions = compare_results(results, baseline, args.threshold)
+		for name, size, previous, seconds in regressions:
+			print(f"Regression: {name} on {size} events took {seconds:.6f} s instead of {previous:.6f} s")
+		if regressions:
+			return 1
+	return 0
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -0,0 +1,261 @@
+import argparse
+import contextlib
+import io
+import json
+import random
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+
+import story_threads
+import story_threads_reference
+
+
+### generate operations ###
+
+def random_operation(rng, thread_list):
+	"""
+	Generate a random operation that fits the current story.
+
+	Most operations are valid for the story, but some are not on
+	purpose (e.g. closing a closed thread), because errors have to be
+	the same as well.
+
+	Args:
+		rng: The random generator.
+		thread_list: The list of dictionaries that represent story
+			threads.
+
+	Return:
+		operation: A dictionary with the name of the operation ("add",
+			"remove", "change" or "undo") and its arguments.
+	"""
+	thread_index = {}
+	for i, el in enumerate(thread_list):
+		thread_index.setdefault(next(iter(el.keys())), []).append(i)
+	size = len(thread_list)
+	kind = rng.choice(["add", "add", "add", "develop", "develop", "remove", "change", "undo"] if thread_index else ["add"])
+	serial = rng.randrange(1000)
+
+	if kind == "add":
+		indices = sorted(rng.randint(0, size) for _ in range(rng.randint(1, 3)))
+		close = rng.random() < 0.5
+		names = [f"thread {serial}"] + [f"event {serial}.{i}" for i in range(len(indices) - (1 if close and rng.random() < 0.5 else 0))]
+		if len(names) > 1 and rng.random() < 0.3:
+			# a thread without opening description
+			names.pop(1)
+		return {"op": "add", "names": names, "indices": indices, "close": close}
+
+	name = rng.choice(sorted(thread_index))
+	positions = thread_index[name]
+	developments = [i for i in positions if thread_list[i][name]["event"] == "develop"]
+	if kind == "develop":
+		indices = sorted(rng.randint(positions[0] + 1, size) for _ in range(rng.randint(1, 2)))
+		close = rng.random() < 0.3
+		return {"op": "add", "names": [name] + [f"event {serial}.{i}" for i in range(len(indices))], "indices": indices, "close": close}
+	if kind == "remove":
+		choice = rng.random()
+		if choice < 0.4 or not developments:
+			return {"op": "remove", "name": name, "development": "", "ending": choice < 0.2}
+		selected = rng.sample(developments, rng.randint(1, len(developments)))
+		return {"op": "remove", "name": name, "development": [str(i) if rng.random() < 0.5 else thread_list[i][name]["description"] for i in selected], "ending": False}
+	if kind == "change":
+		event = rng.choice(["opening", "development", "ending"])
+		operation = {"op": "change", "name": name, "opening": "", "development": "", "ending": ""}
+		if event == "development" and developments:
+			selected = rng.choice(developments)
+			key = str(selected) if rng.random() < 0.5 else thread_list[selected][name]["description"]
+			operation["development"] = [key, str(rng.randint(positions[0], size - 1)) if rng.random() < 0.7 else f"event {serial}"]
+		elif event == "ending":
+			operation["ending"] = [str(rng.randint(positions[0], size - 1))]
+		else:
+			operation["opening"] = [str(rng.randint(0, positions[-1]))] if rng.random() < 0.7 else [f"event {serial}"]
+		return operation
+	return {"op": "undo"}
+
+def random_operations(seed, count):
+	"""
+	Generate a sequence of random operations.
+
+	The operations are generated along the reference implementation,
+	so that they fit the story they are applied to. Every operation
+	shows the story with or without all connections to the main story
+	thread at random ("show_connections"), so that both renderings are
+	compared.
+
+	Args:
+		seed: The seed of the random generator.
+		count: The number of operations.
+
+	Return:
+		operations: A list of operations (see random_operation).
+	"""
+	rng = random.Random(seed)
+	operations = []
+	with tempfile.TemporaryDirectory() as path:
+		for _ in range(count):
+			thread_list = story_threads_reference.retrieve_storythreads("differential", path)
+			operation = random_operation(rng, thread_list)
+			operation["show_connections"] = rng.random() < 0.5
+			if apply_operation(story_threads_reference, operation, path)[0] != "crash":
+				operations.append(operation)
+	return operations
+
+
+### run operations ###
+
+def apply_operation(module, operation, path):
+	"""
+	Apply an operation to the story of an implementation.
+
+	Args:
+		module: The implementation (e.g. story_threads).
+		operation: The operation (see random_operation).
+		path: The path to the story files.
+
+	Return:
+		outcome: "ok", the name of the raised ValueError or "crash" if
+			another exception was raised.
+		output: What the operation printed.
+	"""
+	arguments = {"show_connections": False, **{k: v for k, v in operation.items() if k != "op"}}
+	args = argparse.Namespace(story="differential", path=path, **arguments)
+	function = {"add": module.add_thread, "remove": module.remove_thread, "change": module.change_thread, "undo": module.undo}[operation["op"]]
+	output = io.StringIO()
+	outcome = "ok"
+	try:
+		with contextlib.redirect_stdout(output):
+			function(args)
+	except ValueError as e:
+		outcome = f"ValueError: {e}"
+	except Exception as e:
+		outcome = "crash"
+	return outcome, output.getvalue()
+
+def story_state(module, path, show_connections=False):
+	"""
+	Get the story threads and their rendering from an implementation.
+
+	Args:
+		module: The implementation (e.g. story_threads).
+		path: The path to the story files.
+		show_connections (Boolean): A flag to show all connections to
+			the main story thread. The default is False.
+
+	Return:
+		thread_list: The list of dictionaries that represent story
+			threads.
+		rendering: What show_threads prints.
+	"""
+	output = io.StringIO()
+	with contextlib.redirect_stdout(output):
+		module.show_threads(argparse.Namespace(story="differential", path=path, show_connections=show_connections))
+	return module.retrieve_storythreads("differential", path), output.getvalue()
+
+def find_difference(operations, optimized=story_threads, reference=story_threads_reference, jsonl=False):
+	"""
+	Run operations through two implementations and compare them.
+
+	After every operation, the outcome, the story threads (as json) and
+	the rendering have to be the same. Operations that crash the
+	reference are skipped for both implementations. An operation that
+	is rejected (with a ValueError) leaves the story and its undo cache
+	as they were, while the reference may have stored part of it (e.g.
+	the removal of the thread to change), so the story of the reference
+	is restored after it.
+
+	Args:
+		operations: The list of operations (see random_operation).
+		optimized: The implementation to check. The default is
+			story_threads.
+		reference: The implementation to check against. The default is
+			story_threads_reference.
+		jsonl (Boolean): A flag to store the story of the checked
+			implementation as jsonl. The default is json (False).
+
+	Return:
+		difference: None if the implementations behave the same, else
+			a dictionary with the step, the compared aspect and the
+			values of both implementations.
+	"""
+	with tempfile.TemporaryDirectory() as reference_path, tempfile.TemporaryDirectory() as optimized_path:
+		if jsonl:
+			Path(optimized_path, "differential.jsonl").touch()
+		for step, operation in enumerate(operations):
+			backup = Path(tempfile.mkdtemp())
+			shutil.copytree(reference_path, backup, dirs_exist_ok=True)
+			reference_outcome = apply_operation(reference, operation, reference_path)[0]
+			if reference_outcome != "ok":
+				shutil.rmtree(reference_path)
+				shutil.copytree(backup, reference_path)
+			shutil.rmtree(backup)
+			if reference_outcome == "crash":
+				continue
+			optimized_outcome = apply_operation(optimized, operation, optimized_path)[0]
+			show_connections = operation.get("show_connections", False)
+			reference_list, reference_rendering = story_state(reference, reference_path, show_connections)
+			optimized_list, optimized_rendering = story_state(optimized, optimized_path, show_connections)
+			for aspect, expected, result in [
+					("outcome", reference_outcome, optimized_outcome),
+					("thread_list", json.dumps(reference_list, ensure_ascii=False), json.dumps(optimized_list, ensure_ascii=False)),
+					("rendering", reference_rendering, optimized_rendering)]:
+				if expected != result:
+					return {"step": step, "aspect": aspect, "reference": expected, "optimized": result}
+	return None
+
+def shrink(operations, fails):
+	"""
+	Shrink a failing sequence of operations to a minimal one.
+
+	Chunks of operations are removed as long as the sequence still
+	fails, starting with halves down to single operations (like delta
+	debugging).
+
+	Args:
+		operations: The list of operations that fails.
+		fails: A function that returns True if a list of operations
+			still fails.
+
+	Return:
+		operations: A shortest found list of operations that fails.
+	"""
+	chunk = len(operations) // 2
+	while chunk >= 1:
+		start = 0
+		while start < len(operations):
+			candidate = operations[:start] + operations[start+chunk:]
+			if candidate and fails(candidate):
+				operations = candidate
+			else:
+				start += chunk
+		chunk //= 2
+	return operations
+
+
+### parse input and compare implementations ###
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(prog="story-threads-differential", description="Compare story_threads with its reference implementation on random operations")
+	parser.add_argument("-r", "--runs", type=int, default=100, help="the number of random operation sequences")
+	parser.add_argument("-n", "--operations", type=int, default=30, help="the number of operations per sequence")
+	parser.add_argument("-s", "--seed", type=int, default=0, help="the seed of the first sequence")
+	parser.add_argument("--jsonl", action="store_true", help="store the story of story_threads as jsonl")
+	args = parser.parse_args(argv)
+
+	failed = 0
+	for seed in range(args.seed, args.seed + args.runs):
+		operations = random_operations(seed, args.operations)
+		if find_difference(operations, jsonl=args.jsonl) is None:
+			continue
+		failed += 1
+		operations = shrink(operations, lambda candidate: find_difference(candidate, jsonl=args.jsonl) is not None)
+		difference = find_difference(operations, jsonl=args.jsonl)
+		print(f"Sequence {seed} differs in the {difference['aspect']} after step {difference['step']}:")
+		print(json.dumps(operations, indent=1, ensure_ascii=False))
+		print(f"reference:\n{difference['reference']}\noptimized:\n{difference['optimized']}")
+	print(f"{failed} of {args.runs} sequences differ.")
+	return 1 if failed else 0
+
+if __name__ == "__main__":
+	sys.exit(main())
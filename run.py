@@ -1,34 +1,170 @@
+import time
+start = time.perf_counter()
+
 import argparse
+import cProfile
+import sys
+import tracemalloc
 
 import story_threads
 
 ### parse input and call functions ###
 
-parser = argparse.ArgumentParser(prog = "story-threads", description = "Show all story threads in order")
+options = argparse.ArgumentParser(add_help=False)
+options.add_argument("-p", "--path", type=str, default="", help="the path to the story file")
+options.add_argument("-c", "--show_connections", action="store_true", help="show all connections to the main story thread")
+options.add_argument("--profile", action="store_true", help="print the time spent in each phase of the command to stderr")
+options.add_argument("--profile-dump", type=str, help="store the cProfile statistics of the command in the given file")
+options.add_argument("--trace-memory", action="store_true", help="print the peak memory and the largest allocations of the command to stderr")
+parser = argparse.ArgumentParser(prog = "story-threads", description = "Show all story threads in order (see story-threads --workspace -h for the commands on all stories in a path and on story files)", parents=[options])
 parser.add_argument("story", type=str, help="the story name (acts as file name to store the data threads)")
-parser.add_argument("-p", "--path", type=str, default="", help="the path to the story file")
-parser.add_argument("-c", "--show_connections", action="store_true", help="show all connections to the main story thread")
 subparsers = parser.add_subparsers(help="the program mode")
 parser_add = subparsers.add_parser("add", help="add a new story thread or add a new part to an existing story thread")
 parser_add.add_argument("names", type=str, nargs="+", help="the thread name (corresponds to the text of the first event) and the texts for the remaining events, if any")
 parser_add.add_argument("-i", "--indices", type=int, nargs="+", required=True, help="the indices of the events on which to open, develop and/or close the thread")
 parser_add.add_argument("-c", "--close", action="store_true", help="close the story thread with the last given index (if not set, every event after the opening is considered a development)")
+parser_add.add_argument("--chapter", type=int, help="the chapter of the events")
+parser_add.add_argument("--offset", type=int, help="the (word) offset of the events in the manuscript")
+parser_add.add_argument("--tag", type=str, nargs="+", help="the tags of the events (e.g. the point of view)")
 parser_add.set_defaults(func=story_threads.add_thread)
-parser_rm = subparsers.add_parser("remove", aliases=["rm"], help="remove a story thread")
-parser_rm.add_argument("name", type=str, help="the name of the thread to be removed")
-parser_rm.add_argument("-d", "--development", type=str, nargs="+", help="remove only the given thread development(s)")
+parser_rm = subparsers.add_parser("remove", aliases=["rm"], help="remove one or more story threads")
+parser_rm.add_argument("name", type=str, nargs="+", help="the name(s) of the thread(s) to be removed")
+parser_rm.add_argument("-d", "--development", type=str, nargs="+", help="remove only the given thread development(s) by index or (partial) description")
 parser_rm.add_argument("-e", "--ending", action="store_true", help="remove only the closing of the thread (i.e. open it again)")
 parser_rm.set_defaults(func=story_threads.remove_thread)
 parser_change = subparsers.add_parser("change", help="change the position of a story thread's opening and/or closing")
 parser_change.add_argument("name", type=str, help="the name of the thread to be changed")
 group = parser_change.add_mutually_exclusive_group(required=True)
 group.add_argument("-o", "--opening", type=str, default="", nargs="+", help="change the opening index and/or description of the thread")
-group.add_argument("-d", "--development", type=str, default="", nargs="+", help="change the thread development index and/or description")
+group.add_argument("-d", "--development", type=str, default="", nargs="+", help="change the index and/or description of the development given by its index or (partial) description")
 group.add_argument("-e", "--ending", type=str, default="", nargs="+", help="change the closing index and/or description of the thread")
 parser_change.set_defaults(func=story_threads.change_thread)
+parser_rename = subparsers.add_parser("rename", help="rename a story thread")
+parser_rename.add_argument("old", type=str, help="the current name of the thread")
+parser_rename.add_argument("new", type=str, help="the new name of the thread")
+parser_rename.add_argument("-o", "--opening", action="store_true", help="also rename the opening description if it equals the current name")
+parser_rename.set_defaults(func=story_threads.rename_thread)
+parser_move = subparsers.add_parser("move", aliases=["mv"], help="move a range of events of any threads to another position")
+parser_move.add_argument("-r", "--range", type=int, nargs=2, required=True, metavar=("FIRST", "LAST"), help="the indices of the first and the last event to move")
+parser_move.add_argument("-t", "--to", type=int, required=True, help="the index of the event in front of which the events are inserted")
+parser_move.set_defaults(func=story_threads.move_events)
+parser_meta = subparsers.add_parser("meta", help="set the chapter, offset or tags of events")
+parser_meta.add_argument("indices", type=int, nargs="+", help="the indices of the events")
+parser_meta.add_argument("--chapter", type=int, help="the chapter of the events")
+parser_meta.add_argument("--offset", type=int, help="the (word) offset of the events in the manuscript")
+parser_meta.add_argument("--tag", type=str, nargs="+", help="the tags to add to the events")
+parser_meta.add_argument("--untag", type=str, nargs="+", help="the tags to remove from the events")
+parser_meta.add_argument("--clear", action="store_true", help="remove all chapters, offsets and tags of the events first")
+parser_meta.set_defaults(func=story_threads.annotate_events)
+parser_search = subparsers.add_parser("search", help="search the story thread events by thread name or description, chapter or tags")
+parser_search.add_argument("query", type=str, nargs="*", help="the (partial) thread name or description to search for")
+parser_search.add_argument("-f", "--fuzzy", action="store_true", help="also match similar texts if no text contains the query")
+parser_search.add_argument("--chapter", type=int, help="only find the events of the given chapter")
+parser_search.add_argument("--tag", type=str, nargs="+", help="only find the events with all given tags")
+parser_search.set_defaults(func=story_threads.search_threads)
+parser_check = subparsers.add_parser("check", help="check the story for malformed or misordered events")
+parser_check.add_argument("-r", "--repair", action="store_true", help="repair the problems that can be repaired")
+parser_check.set_defaults(func=story_threads.check_story)
 parser_list = subparsers.add_parser("show", help="show all story threads")
+parser_list.add_argument("-w", "--watch", action="store_true", help="keep showing the story threads and update them whenever the story file changes")
+parser_list.add_argument("--interval", type=float, default=0.5, help="the seconds between checks for changes in watch mode")
+parser_list.add_argument("-a", "--at", type=str, help="show the story as it was after the given operation (see history), counted back from the last one if negative, or at the given time (e.g. 2024-05-01T12:00)")
+parser_list.add_argument("--only", type=str, help="only show the threads whose name contains the given text")
+parser_list.add_argument("--open-only", action="store_true", help="only show the threads that are still open")
+parser_list.add_argument("--touching", type=int, nargs=2, metavar=("FIRST", "LAST"), help="only show the threads that are open between the given event indices")
+parser_list.add_argument("--chapter", type=int, help="only show the events of the given chapter")
+parser_list.add_argument("--tag", type=str, nargs="+", help="only show the events with all given tags")
+parser_list.add_argument("--truncate", action="store_true", help="cut the lines at the width of the terminal")
+parser_list.add_argument("--fold", action="store_true", help="continue the lines that are wider than the terminal on the next lines")
+parser_list.add_argument("--columns", type=str, metavar="FIRST-LAST", help="only show the columns of the threads from FIRST to LAST (counted from 1, e.g. 10-40 or 10- up to the last column)")
+parser_list.add_argument("--width", type=int, help="the width of the lines to cut or fold (implies --truncate, the default is the width of the terminal)")
 parser_list.set_defaults(func=story_threads.show_threads)
+parser_show_thread = subparsers.add_parser("show-thread", help="show the events of one story thread and the threads open at each of them")
+parser_show_thread.add_argument("name", type=str, help="the name of the thread")
+parser_show_thread.set_defaults(func=story_threads.show_thread)
+parser_export = subparsers.add_parser("export", help="export the story threads as HTML page or SVG image")
+parser_export.add_argument("to", type=str, choices=["html", "svg"], help="the format to export the story threads to")
+parser_export.add_argument("output", type=str, help="the file to write")
+parser_export.set_defaults(func=story_threads.export_threads)
+parser_history = subparsers.add_parser("history", help="show the operations on the story")
+parser_history.set_defaults(func=story_threads.show_history)
 parser_undo = subparsers.add_parser("undo", help="undo the last action")
 parser_undo.set_defaults(func=story_threads.undo)
-args = parser.parse_args()
-args.func(args)
+parser_convert = subparsers.add_parser("convert", help="convert the story file to json (one object), jsonl (one event per line) or shards (a directory of segments)")
+parser_convert.add_argument("to", type=str, choices=["json", "jsonl", "shards"], help="the format to convert the story to")
+parser_convert.set_defaults(func=story_threads.convert_story)
+parser_import_manuscript = subparsers.add_parser("import-manuscript", help="replace the story by the thread events marked in manuscripts, e.g. [[open: thread | description]]")
+parser_import_manuscript.add_argument("manuscripts", type=str, nargs="+", help="the manuscript files in story order")
+parser_import_manuscript.set_defaults(func=story_threads.import_manuscript)
+parser_import = subparsers.add_parser("import", help="add the thread events of csv files (thread, event, description, position) or Markdown outlines (lines like '- develop: thread | description')")
+parser_import.add_argument("outlines", type=str, nargs="+", help="the csv files (with the suffix .csv) or outlines")
+parser_import.add_argument("-n", "--dry-run", action="store_true", help="only list the rejected rows and store nothing")
+parser_import.set_defaults(func=story_threads.import_outline)
+parser_stats = subparsers.add_parser("stats", help="show the numbers of events and threads")
+parser_stats.add_argument("--chapter", type=int, help="only count the events of the given chapter")
+parser_stats.add_argument("--tag", type=str, nargs="+", help="only count the events with all given tags")
+parser_stats.add_argument("--by", type=str, choices=["chapter", "tag"], help="show the numbers of every chapter or tag")
+parser_stats.set_defaults(func=story_threads.show_stats)
+
+# the commands on story files or all stories of a path take no story
+# name, they are chosen with a flag so that any story name can be used
+workspace_parser = argparse.ArgumentParser(prog = "story-threads --workspace", description = "Compare story files or work on all stories in a path", parents=[options])
+workspace_parser.add_argument("--workspace", action="store_true", help="run a command on story files or all stories in the path instead of on one story")
+workspace_subparsers = workspace_parser.add_subparsers(help="the program mode", required=True)
+parser_show_all = workspace_subparsers.add_parser("show-all", help="show the threads of all stories in the path")
+parser_show_all.set_defaults(func=story_threads.show_all)
+parser_stats_all = workspace_subparsers.add_parser("stats-all", help="show the numbers of all stories in the path")
+parser_stats_all.set_defaults(func=story_threads.stats_all)
+parser_check_all = workspace_subparsers.add_parser("check-all", help="check all stories in the path and list those with problems (exits with 1 if any story has problems)")
+parser_check_all.add_argument("-r", "--repair", action="store_true", help="repair the problems that can be repaired")
+parser_check_all.set_defaults(func=story_threads.check_all, fail_on_result=True)
+parser_search_all = workspace_subparsers.add_parser("search-all", help="search all stories in the path")
+parser_search_all.add_argument("query", type=str, nargs="+", help="the (partial) thread name or description to search for")
+parser_search_all.add_argument("-f", "--fuzzy", action="store_true", help="also match similar texts if no text contains the query")
+parser_search_all.set_defaults(func=story_threads.search_all)
+parser_diff = workspace_subparsers.add_parser("diff", help="show the structural changes between two story files")
+parser_diff.add_argument("old", type=str, help="the old story file (json or jsonl)")
+parser_diff.add_argument("new", type=str, help="the new story file (json or jsonl)")
+parser_diff.set_defaults(func=story_threads.diff_stories)
+parser_merge = workspace_subparsers.add_parser("merge", help="merge two story files changed from the same base file (exits with 1 on conflicts)")
+parser_merge.add_argument("base", type=str, help="the common base story file")
+parser_merge.add_argument("ours", type=str, help="our story file, which is replaced by the merged story unless an output is given")
+parser_merge.add_argument("theirs", type=str, help="their story file")
+parser_merge.add_argument("-o", "--output", type=str, help="the file to store the merged story in")
+parser_merge.set_defaults(func=story_threads.merge_stories, fail_on_result=True)
+for parser_all in [parser_show_all, parser_stats_all, parser_check_all, parser_search_all]:
+	parser_all.add_argument("-j", "--jobs", type=int, help="the number of processes (default: the number of CPUs)")
+
+# arguments after "--" are never options
+arguments = sys.argv[1:]
+if "--workspace" in arguments[:arguments.index("--") if "--" in arguments else len(arguments)]:
+	args = workspace_parser.parse_args()
+	args.story = None
+else:
+	args = parser.parse_args()
+story_threads.PHASE_TIMES["setup"] = time.perf_counter() - start
+
+profiler = cProfile.Profile() if args.profile_dump else None
+if args.trace_memory:
+	tracemalloc.start()
+if profiler:
+	profiler.enable()
+result = None
+try:
+	result = args.func(args)
+finally:
+	if profiler:
+		profiler.disable()
+		profiler.dump_stats(args.profile_dump)
+	if args.trace_memory:
+		snapshot = tracemalloc.take_snapshot()
+		print(f"memory: peak {tracemalloc.get_traced_memory()[1] / 2**20:.2f} MiB", file=sys.stderr)
+		for statistic in snapshot.statistics("lineno")[:5]:
+			print(f"  {statistic}", file=sys.stderr)
+		tracemalloc.stop()
+	if args.profile:
+		print(story_threads.format_phase_times(time.perf_counter() - start), file=sys.stderr)
+
+# e.g. the conflicts of a merge
+if getattr(args, "fail_on_result", False) and result:
+	sys.exit(1)
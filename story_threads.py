@@ -1,7 +1,82 @@
 import argparse
+import bisect
+import contextlib
+import datetime
+import gc
+import hashlib
+import io
 import json
+import marshal
+import os
+import re
+import shutil
+import sys
+import time
+import zlib
 from pathlib import Path
 from enum import Enum
+# concurrent.futures, csv, html and mmap are imported by the functions
+# that use them, as they slow down the start of every other command
+
+
+### profile phases ###
+
+# the time spent in each phase of the commands since the last reset
+PHASE_TIMES = {}
+# the phases that are currently timed with the time their current
+# share started
+PHASE_STACK = []
+
+@contextlib.contextmanager
+def profile_phase(phase):
+	"""
+	Time a phase of a command (e.g. load, validate, edit, cache, store,
+	index or render).
+
+	Nested phases pause the phases around them, so every moment is
+	counted for exactly one phase and the times add up. The time is
+	added to PHASE_TIMES. Can also be used as a decorator.
+
+	Args:
+		phase: The name of the phase.
+	"""
+	start = time.perf_counter()
+	if PHASE_STACK:
+		outer = PHASE_STACK[-1]
+		PHASE_TIMES[outer[0]] = PHASE_TIMES.get(outer[0], 0) + start - outer[1]
+	PHASE_STACK.append([phase, start])
+	try:
+		yield
+	finally:
+		end = time.perf_counter()
+		phase, start = PHASE_STACK.pop()
+		PHASE_TIMES[phase] = PHASE_TIMES.get(phase, 0) + end - start
+		if PHASE_STACK:
+			PHASE_STACK[-1][1] = end
+
+def reset_phase_times():
+	"""
+	Forget the times of all phases.
+	"""
+	PHASE_TIMES.clear()
+
+def format_phase_times(total=None):
+	"""
+	Summarize the time spent in each phase in one line.
+
+	Args:
+		total: The total time of the command in seconds. If given, the
+			time outside of the phases is shown as "other". The default
+			is to only show the phases (None).
+
+	Return:
+		String: The phases with their times in milliseconds.
+	"""
+	phases = dict(PHASE_TIMES)
+	if total is not None:
+		phases["other"] = max(0, total - sum(phases.values()))
+		phases["total"] = total
+	return "profile: " + " | ".join(f"{phase} {seconds * 1000:.2f} ms" for phase, seconds in phases.items())
 
 
 ### helper functions ###
@@ -14,6 +89,36 @@ class EVENT(str, Enum):
 	CLOSING = "close"
 	DEVELOPMENT = "develop"
 
+# the members are hashed by their names, so the values are added for
+# the events loaded from json
+EVENT_TYPES = frozenset(EVENT) | frozenset(event.value for event in EVENT)
+
+def story_file(story, path):
+	"""
+	Find the file of a story.
+
+	A story is stored either as a json file (with the list indices as
+	keys), as a jsonl file (with one event per line in story order) or
+	as a directory of segments (see store_shards). If several exist,
+	the directory is used before the jsonl file.
+
+	Args:
+		story: The name of the story that corresponds to the file name.
+		path: The path to the story file.
+
+	Return:
+		storythread_file: The path of the story directory or the jsonl
+			file if it exists, else the path of the json file.
+	"""
+	storythread_file = Path(path, story + ".shards")
+	if storythread_file.is_dir():
+		return storythread_file
+	storythread_file = Path(path, story + ".jsonl")
+	if storythread_file.exists():
+		return storythread_file
+	return Path(path, story + ".json")
+
+@profile_phase("load")
 def retrieve_storythreads(story, path):
 	"""
 	Load the story threads from the json file if it exists.
@@ -21,7 +126,13 @@ def retrieve_storythreads(story, path):
 	The story threads are dictionaries (to be able to identify them by
 	name) stored in a list (to order them by index). To load them from
 	a json file, the outer dictionary with the list indices as keys is
-	converted back to the list of dictionaries.
+	converted back to the list of dictionaries. A jsonl file and the
+	segments of a sharded story already hold the events in order (see
+	story_file). If the file (or the manifest of the segments) did not
+	change since it was last parsed, the parsed story threads are
+	loaded from a cache instead (see retrieve_parsed_story). The
+	segments of a sharded story are cached one by one (see
+	retrieve_segment).
 
 	Args:
 		story: The name of the story that corresponds to the json file
@@ -33,524 +144,5511 @@ def retrieve_storythreads(story, path):
 			threads.
 	"""
 	# the threadlist is a list of dictionaries, stored as a json file
-	storythread_file = Path(path, story + ".json")
+	storythread_file = story_file(story, path)
+	if storythread_file.suffix == ".shards":
+		try:
+			return retrieve_shards(storythread_file, retrieve_manifest(storythread_file))
+		except (json.decoder.JSONDecodeError, UnicodeDecodeError):
+			return []
+	try:
+		stat = storythread_file.stat()
+	except FileNotFoundError:
+		return []
+	thread_list = retrieve_parsed_story(story, path, storythread_file, stat)
+	if thread_list is not None:
+		return thread_list
 	thread_list = []
+	with open(storythread_file, "rb") as f:
+		content = f.read()
 	try:
-		with open(storythread_file, "r") as f:
-			thread_dict = json.load(f)
-		sorted_keys = [int(k) for k in thread_dict.keys()]
-		sorted_keys.sort()
-		thread_list = [thread_dict[str(k)] for k in sorted_keys]
-	except (FileNotFoundError, json.decoder.JSONDecodeError):
+		thread_list = parse_story(content, storythread_file.suffix == ".jsonl")
+	except (json.decoder.JSONDecodeError, UnicodeDecodeError):
 		pass
+	store_parsed_story(story, path, story_fingerprint(stat, content), thread_list)
 	return thread_list
 
-def store_storythreads(story, path, thread_list):
+def iter_storythreads(story, path):
 	"""
-	Store the story threads as a json file.
+	Load the story threads one by one.
 
-	The story threads are dictionaries (to be able to identify them by
-	name) stored in a list (to order them by index). To store them as
-	a json file, the list is converted to a dictionary with the indices
-	as keys.
+	The events of a jsonl file are parsed line by line as they are
+	needed and those of a json file larger than STREAM_STORY_BYTES are
+	streamed (see stream_json_story). Other stories are loaded as a
+	whole (see retrieve_storythreads).
 
 	Args:
-		story: The name of the story that corresponds to the json file
-			name.
-		path: The path to the json file.
-		thread_list: The list of dictionaries that represent story
-			threads.
+		story: The name of the story that corresponds to the file name.
+		path: The path to the story file.
+
+	Yield:
+		event: The next dictionary that represents a story thread
+			event.
 	"""
-	storythread_file = Path(path, story + ".json")
-	storythread_file.parent.mkdir(parents=True, exist_ok=True)
-	#json.dumps(vars(new_StoryThread))
-	with open(storythread_file, "w") as f:
-		json.dump({i: el for i, el in enumerate(thread_list)}, f, ensure_ascii=False)
+	storythread_file = story_file(story, path)
+	if storythread_file.suffix != ".jsonl":
+		if streams_story(story, path):
+			yield from stream_json_story(storythread_file)
+		else:
+			yield from retrieve_storythreads(story, path)
+		return
+	try:
+		with open(storythread_file, "rb") as f:
+			for line in f:
+				if line.strip():
+					yield json.loads(line)
+	except FileNotFoundError:
+		pass
 
-def thread_is_closed(thread_list, thread_id):
+# json stories larger than this are streamed instead of being loaded as
+# a whole by show, stats and check
+STREAM_STORY_BYTES = 2**26
+# how many characters of a json story are read at once when it is
+# streamed
+STREAM_CHUNK_SIZE = 2**20
+JSON_DECODER = json.JSONDecoder()
+
+def stream_json_story(storythread_file):
 	"""
-	Find out if a given thread has been closed.
+	Parse the events of a json story one by one.
 
-	A non-existing thread is not closed.
+	The file is read in chunks and every key and event is decoded as
+	soon as it is complete, so only the current chunk is kept in
+	memory. The events are yielded in the order of their keys: as
+	stored by store_storythreads, the keys are ascending from 0 and
+	every event is yielded right away. Any other event is kept until
+	the events in front of it have been yielded (or the file ends), so
+	out of order keys only cost memory.
 
 	Args:
-		thread_list: The list of dictionaries that represent story
-			threads.
-		thread_id: The id/name of the thread to check.
+		storythread_file: The path to the json file.
+
+	Raises:
+		JSONDecodeError: If the file is not a json object.
+
+	Yield:
+		event: The next dictionary that represents a story thread
+			event.
+	"""
+	with open(storythread_file, "r", encoding="utf-8") as f:
+		buffer = ""
+		position = 0
+		end_of_file = False
+
+		def read():
+			nonlocal buffer, position, end_of_file
+			chunk = f.read(STREAM_CHUNK_SIZE)
+			end_of_file = not chunk
+			buffer = buffer[position:] + chunk
+			position = 0
+
+		def next_character():
+			nonlocal position
+			while True:
+				while position < len(buffer) and buffer[position].isspace():
+					position += 1
+				if position < len(buffer) or end_of_file:
+					return buffer[position:position+1]
+				read()
+
+		def decode():
+			# a value that ends with the buffer may go on in the file
+			nonlocal position
+			next_character()
+			while True:
+				try:
+					value, end = JSON_DECODER.raw_decode(buffer, position)
+					if end < len(buffer) or end_of_file:
+						position = end
+						return value
+				except json.decoder.JSONDecodeError:
+					if end_of_file:
+						raise
+				read()
+
+		def expect(characters):
+			nonlocal position
+			character = next_character()
+			if not character or character not in characters:
+				raise json.decoder.JSONDecodeError(f"Expecting one of '{characters}'", buffer, position)
+			position += 1
+			return character
+
+		expect("{")
+		pending = {}
+		expected = 0
+		if next_character() == "}":
+			position += 1
+		else:
+			while True:
+				key = decode()
+				if not isinstance(key, str):
+					raise json.decoder.JSONDecodeError("Expecting property name enclosed in double quotes", buffer, position)
+				expect(":")
+				pending[int(key)] = decode()
+				while expected in pending:
+					yield pending.pop(expected)
+					expected += 1
+				if expect(",}") == "}":
+					break
+		if next_character():
+			raise json.decoder.JSONDecodeError("Extra data", buffer, position)
+		for key in sorted(pending):
+			yield pending[key]
+
+def streams_story(story, path):
+	"""
+	Find out whether a story is read event by event instead of as a
+	whole (see iter_storythreads).
+
+	Args:
+		story: The name of the story that corresponds to the file name.
+		path: The path to the story file.
 
 	Return:
-		Boolean: True, if the thread exists and has been closed, else
-			False
+		streamed (Boolean): True for a jsonl story and a json story
+			larger than STREAM_STORY_BYTES, else False.
 	"""
-	if thread_id not in [next(iter(el.keys())) for el in thread_list]:
-		return False
-	thread_ids = [next(iter(el.keys())) for el in thread_list]
-	index_last_entry = len(thread_ids) - 1 - list(reversed(thread_ids)).index(thread_id)
-	if thread_list[index_last_entry][thread_id]["event"] == EVENT.CLOSING:
+	storythread_file = story_file(story, path)
+	if storythread_file.suffix == ".jsonl":
 		return True
-	return False
+	try:
+		return storythread_file.suffix == ".json" and storythread_file.stat().st_size > STREAM_STORY_BYTES
+	except FileNotFoundError:
+		return False
 
-def thread_events_are_new(thread_list, thread_id, descriptions):
+# encodes the events of a jsonl story
+JSONL_ENCODER = json.JSONEncoder(ensure_ascii=False)
+# the thread name and event at the start of the lines of a jsonl story
+JSONL_EVENT = re.compile(rb'^\{\s*("(?:[^"\\]|\\.)*")\s*:\s*\{\s*"event"\s*:\s*"(\w+)"', re.MULTILINE)
+
+def scan_storythreads(story, path):
 	"""
-	Check if the event descriptions are different from those of a given
-	thread.
+	Count the events of a story and find its closed threads without
+	parsing the events.
+
+	The thread names and events are matched at the start of each line
+	of a jsonl file, which is read line by line. If a line does not
+	match (e.g. because the event type is not the first key), only that
+	line is parsed. A large json story is streamed (see
+	iter_storythreads).
 
 	Args:
-		thread_list: The list of dictionaries that represent story
-			threads.
-		thread_id: The id/name of the thread to check.
-		descriptions: The list of descriptions to check against the
-			given thread's descriptions.
+		story: The name of the story that corresponds to the file name.
+		path: The path to the story file.
 
 	Return:
-		Boolean: True, if the descriptions differ, else False
+		size: The number of events of the story.
+		closed_threads: The set of the threads whose last event closes
+			them.
 	"""
-	# gather all elements of the thread
-	thread_descriptions = set()
-	for el in thread_list:
-		name = next(iter(el.keys()))
-		if name == thread_id:
-			thread_descriptions.add(el[name]["description"])
+	storythread_file = story_file(story, path)
+	if storythread_file.suffix == ".jsonl":
+		size = 0
+		last_events = {}
+		# the thread names as they are encoded in the lines
+		names = {}
+		try:
+			with open(storythread_file, "rb") as f:
+				for line in f:
+					if not line.strip():
+						continue
+					match = JSONL_EVENT.match(line)
+					if match:
+						if match.group(1) not in names:
+							names[match.group(1)] = json.loads(match.group(1))
+						last_events[names[match.group(1)]] = match.group(2).decode()
+					else:
+						el = json.loads(line)
+						name = next(iter(el.keys()))
+						last_events[name] = el[name]["event"]
+					size += 1
+			return size, {name for name, event in last_events.items() if event == EVENT.CLOSING}
+		except FileNotFoundError:
+			return 0, set()
+		except (json.decoder.JSONDecodeError, UnicodeDecodeError):
+			# like retrieve_storythreads, a broken story has no events
+			pass
+	size = 0
+	last_events = {}
+	for el in (iter_storythreads(story, path) if storythread_file.suffix == ".json" else retrieve_storythreads(story, path)):
+		last_events[next(iter(el.keys()))] = next(iter(el.values()))["event"]
+		size += 1
+	return size, {name for name, event in last_events.items() if event == EVENT.CLOSING}
 
-	# check if the given description(s) already exist(s)
-	return thread_descriptions.isdisjoint(descriptions)
+# the version of the format of the parsed story cache
+PARSED_STORY_VERSION = 3
+# how many appended versions the parsed story cache keeps before it is
+# stored as a whole again
+PARSED_STORY_APPENDS = 100
+# files changed this shortly before their fingerprint was taken may have
+# changed again without a new modification time
+RACY_NANOSECONDS = 2 * 10**9
+# story files are hashed in blocks of this size, so that appending to a
+# file only hashes its last block again
+FINGERPRINT_BLOCK_BYTES = 2**20
 
+def story_version_file(story, path):
+	"""
+	Find the file that changes with every version of a story.
 
-### display threads ###
+	Args:
+		story: The name of the story that corresponds to the file name.
+		path: The path to the story file.
 
-class STATE(str, Enum):
+	Return:
+		version_file: The story file or, of a sharded story, its
+			manifest (see story_file).
 	"""
-	Define the elements of the story thread representation.
+	storythread_file = story_file(story, path)
+	if storythread_file.suffix == ".shards":
+		return Path(storythread_file, SHARD_MANIFEST)
+	return storythread_file
+
+def block_digests(blocks):
 	"""
-	OPEN = "│  "
-	OPENING = "├─ "
-	CLOSING = "┘  "
-	CLOSED = "   "
-	CLOSINGNEIGHBOR = "───"
-	OPENINGNEIGHBOR = "── "
-	MERGENEIGHBOR = "├──"
-	NOTCLOSED = "┊  "
-#└─
-#─┤
+	Hash the blocks of a story file.
 
-def show_threads(args):
+	Args:
+		blocks: An iterable of the blocks of the file as bytes.
+
+	Return:
+		digests: The list of the hashes of the blocks.
 	"""
-	Show a story's threads.
+	return [hashlib.blake2b(block, digest_size=16).hexdigest() for block in blocks]
 
-	Prints the story threads stored in the json file.
+def story_fingerprint(stat, content):
+	"""
+	Identify a version of a story file.
 
 	Args:
-		args: The arguments passed to the program by the user.
+		stat: The stat result of the story file.
+		content: The content of the story file as bytes.
+
+	Return:
+		fingerprint: A dictionary with the modification time ("mtime")
+			in nanoseconds, the "size" and the hashes of the blocks
+			("blocks", see FINGERPRINT_BLOCK_BYTES) of the file and the
+			time the fingerprint was taken ("written").
 	"""
-	thread_list = retrieve_storythreads(args.story, args.path)
-	if thread_list == []:
-		print("There is no story thread to show yet.")
-		return
-	spacing = len(str(len(thread_list)*2)) # max length of line numbers
-	print(f"{(spacing) * ' '} {args.story}")
-	print(f"{(spacing) * ' '} │")
-	open_list = []
-	for t, current_thread in enumerate(thread_list):
-		current_thread_name = next(iter(current_thread.keys()))
-		spacing_offset = (spacing - len(str(t))) * ' '
-		# add an opening thread to the list of open threads
-		if not current_thread_name in open_list:
-			open_list.append(current_thread_name)
-		# traverse the list in reverse to handle right neighbor states
-		neighbor_is_opening = False
-		neighbor_is_closing = False
-		line = ""
-		for i, thread in enumerate(reversed(open_list)):
-			# if the thread is the currently opened, developed or closed
-			# thread
-			if thread == current_thread_name:
-				if current_thread[current_thread_name]["event"] == EVENT.OPENING:
-					if not current_thread_name == current_thread[current_thread_name]["description"]:
-						if thread_is_closed(thread_list, current_thread_name):
-							line = current_thread_name + ": " + current_thread[current_thread_name]["description"] + line
-						else:
-							line = "\033[1m" + current_thread_name + "\033[0m: " + current_thread[current_thread_name]["description"] + line
-					else:
-						line = current_thread[current_thread_name]["description"] + line
-					neighbor_is_opening = True
-				else:
-					if current_thread[current_thread_name]["event"] == EVENT.DEVELOPMENT:
-						current_state = STATE.OPEN
-					else:
-						current_state = STATE.CLOSING
-						neighbor_is_closing = True
-					desc_len = len(current_thread[current_thread_name]["description"]) + 1
-					#print(desc_len, line, len(line), line[desc_len:])
-					if desc_len <= len(current_state):
-						line = current_state + line
-					elif desc_len >= len(line):
-						line = f"{current_state[0]}{current_thread[current_thread_name]['description']}"
-					else:
-						line = f"{current_state[0]}{current_thread[current_thread_name]['description']}{line[desc_len:]}"
-			# if the thread has been closed
-			elif thread is None:
-				if neighbor_is_closing or neighbor_is_opening:
-					if neighbor_is_opening and list(reversed(open_list))[i-1] == current_thread_name:
-						line = STATE.OPENINGNEIGHBOR + line
-					else:
-						line = STATE.CLOSINGNEIGHBOR + line
-				else:
-					line = STATE.CLOSED + line
-			# if the thread is open
-			else:
-				if neighbor_is_opening:
-					if list(reversed(open_list))[i-1] is None:
-						line = STATE.MERGENEIGHBOR + line
-					else:
-						line = STATE.OPENING + line
-					if not args.show_connections:
-						neighbor_is_opening = False
-				elif neighbor_is_closing:
-					line = STATE.MERGENEIGHBOR + line
-					if not args.show_connections:
-						neighbor_is_closing = False
-				else:
-					line = STATE.OPEN + line
+	content = memoryview(content)
+	blocks = block_digests(content[i:i+FINGERPRINT_BLOCK_BYTES] for i in range(0, len(content), FINGERPRINT_BLOCK_BYTES))
+	return {"mtime": stat.st_mtime_ns, "size": stat.st_size, "blocks": blocks, "written": time.time_ns()}
 
-		# add main story thread
-		if neighbor_is_opening:
-			if len(open_list) >= 1 or open_list[1] is None:
-				line = STATE.MERGENEIGHBOR + line
-			else:
-				line = STATE.OPENING + line
-		elif neighbor_is_closing:
-			line = STATE.MERGENEIGHBOR + line
-		else:
-			line = STATE.OPEN + line
+def file_block_digests(version_file, start=0):
+	"""
+	Hash the blocks of a story file without loading it as a whole.
 
-		# add the line number
-		line = f"{spacing_offset}{t} " + line
-		print(line)
+	Args:
+		version_file: The story file (see story_version_file).
+		start: The position of the first block to hash, a multiple of
+			FINGERPRINT_BLOCK_BYTES. The default is the start of the file
+			(0).
 
-		# remove a closing thread from the list of open threads
-		if current_thread[current_thread_name]["event"] == EVENT.CLOSING:
-			open_list[open_list.index(current_thread_name)] = None
+	Return:
+		digests: The list of the hashes of the blocks from the start.
+	"""
+	with open(version_file, "rb") as f:
+		f.seek(start)
+		return block_digests(iter(lambda: f.read(FINGERPRINT_BLOCK_BYTES), b""))
 
-	# indicate open threads
-	line = f"{(spacing) * ' '} {STATE.NOTCLOSED}"
-	for thread in open_list:
-		if thread is not None:
-			line = line + STATE.NOTCLOSED
-		else:
-			line = line + STATE.CLOSED
-	print(line)
+def file_fingerprint(version_file, stat, fingerprint=None):
+	"""
+	Identify a version of a story file by reading it.
 
-	print(f"Number of threads: {len(set([next(iter(key)) for key in thread_list]))} + 1 (main thread)")
-	print(f"Number of open threads: {len(open_list) - open_list.count(None)} + 1 (main thread)")
+	If the fingerprint of an earlier version is given that the file
+	only appends to, the blocks before its last block are not read
+	again.
 
-# more sophisticated sample (with new threads claiming empty columns):
-#
-#story (main thread)
-#│
-#├─ thread a (e.g. main thread first book)
-#│  ├─ thread b
-#│  │  ├─ thread c
-#│  │  │  ├─ thread d
-#│  ├──┘  │  │
-#│  ├─ thread b2
-#│  │  ├──┘  │
-#├──┴──┘     │   (probably don't allow two to end at the same time)
-#┊           ┊
+	Args:
+		version_file: The story file (see story_version_file).
+		stat: The stat result of the story file.
+		fingerprint: The fingerprint of the version of the story file
+			before the append. The default is to hash the whole file
+			(None).
 
+	Return:
+		fingerprint: The fingerprint of the story file (see
+			story_fingerprint).
+	"""
+	blocks = []
+	start = 0
+	if fingerprint is not None and fingerprint.get("blocks") is not None and fingerprint["size"] <= stat.st_size:
+		start = fingerprint["size"] // FINGERPRINT_BLOCK_BYTES * FINGERPRINT_BLOCK_BYTES
+		blocks = fingerprint["blocks"][:start // FINGERPRINT_BLOCK_BYTES]
+	return {"mtime": stat.st_mtime_ns, "size": stat.st_size, "blocks": blocks + file_block_digests(version_file, start), "written": time.time_ns()}
 
-def undo(args):
+def fingerprint_matches(version_file, stat, fingerprint):
 	"""
-	Undo the last action
+	Find out whether a story file is the version of a fingerprint.
 
-	This is done by loading the cached thread_list from file.
+	The modification time and size of the file are compared first. If
+	only they differ or if the file changed shortly before the
+	fingerprint was taken (so that its modification time may not have
+	changed with a later write), the hashes of its content are compared.
+	As the fingerprint is usually taken right after the file is written,
+	it is refreshed in place like the index of git if the hashes match
+	once the file has not changed for RACY_NANOSECONDS: any later write
+	changes the modification time, so the caller can store the
+	fingerprint again to skip the hashes next time (see
+	fingerprint_written).
 
 	Args:
-		args: The arguments passed to the program by the user.
-	"""
-	thread_list = retrieve_storythreads(f".{args.story}", args.path)
-	store_storythreads(args.story, args.path, thread_list)
+		version_file: The story file (see story_version_file).
+		stat: The stat result of the story file.
+		fingerprint: The fingerprint of a version of the story file (see
+			story_fingerprint).
 
-	# show state
-	show_threads(args)
+	Return:
+		matches (Boolean): True if the file is the version of the
+			fingerprint, else False.
+	"""
+	if not isinstance(fingerprint, dict) or fingerprint.get("size") != stat.st_size:
+		return False
+	if fingerprint["mtime"] == stat.st_mtime_ns and stat.st_mtime_ns < fingerprint["written"] - RACY_NANOSECONDS:
+		return True
+	checked = time.time_ns()
+	if file_block_digests(version_file) != fingerprint.get("blocks"):
+		return False
+	if stat.st_mtime_ns < checked - RACY_NANOSECONDS:
+		fingerprint["mtime"] = stat.st_mtime_ns
+		fingerprint["written"] = checked
+	return True
 
+def fingerprint_written(fingerprint):
+	"""
+	Find the time a fingerprint was taken, e.g. to find out whether
+	fingerprint_matches refreshed it.
 
-### manipulate threads (add, remove and change) ###
+	Args:
+		fingerprint: The fingerprint of a version of the story file (see
+			story_fingerprint) or anything else read from a cache.
 
-def add_thread(args, nocache=False):
+	Return:
+		written: The time the fingerprint was taken or None if it is no
+			fingerprint.
 	"""
-	Add a story thread or parts of a story thread.
+	return fingerprint.get("written") if isinstance(fingerprint, dict) else None
 
-	If the name of the story thread does not exist yet: Add the story
-	thread to the json at the given index.
-	The first of the names acts as id and opening descriptions, if one
-	less index than name is given.
-	If only the opening or the opening and a development (or
-	developments) are given, the story thread is left open. If a closing
-	flag is given and the thread is open, the last event closes the
-	thread.
-	If the name of the story thread exists and the closing flag is not
-	set: Develop the respective story thread and store it in the json.
-	If the name of the story thread exists and the close flag is set:
-	Develop the respective story thread if more than one event is given
-	and close the story thread with the last event. Then, store it in
-	the json.
+def same_version(fingerprint, other):
+	"""
+	Find out whether two fingerprints identify the same version of a
+	story file, even if one of them was refreshed since (see
+	fingerprint_matches).
 
 	Args:
-		args: The arguments passed to the program by the user.
-		nocache (Boolean): A flag to determine whether the current
-			thread will be cached before changes are applied. The
-			default is to cache the thread (False).
+		fingerprint: The fingerprint of a version of the story file (see
+			story_fingerprint).
+		other: Another fingerprint.
 
-	Raises:
-		ValueError: If
-			- no name is given for the thread (checked by argparse)
-			- no indices are given for the thread (checked by argparse)
-			- the thread contains events with the given descriptions
-			- descriptions are missing for opening or developments
-			- the order of opening, developments, closing is wrong
-	"""
-	if not args.names:
-		raise ValueError("You need to pass at least one event name to act as identifier for the story thread")
-	if not args.indices:
-		raise ValueError("You need to pass indices to add something")
-	if args.close and not all(args.indices[-1] >= args.indices[i+1] for i in range(len(args.indices) - 1)):
-		raise ValueError("The story thread must close after it opens or develops")
-
-	# load the threads
-	thread_list = retrieve_storythreads(args.story, args.path)
-	events = args.names.copy()
-	thread_id = args.names[0]
-	thread_is_new = thread_id not in [next(iter(el.keys())) for el in thread_list]
+	Return:
+		same (Boolean): True if both fingerprints have the same size and
+			hashes, else False.
+	"""
+	return isinstance(fingerprint, dict) and isinstance(other, dict) and fingerprint.get("blocks") is not None and fingerprint.get("size") == other.get("size") and fingerprint["blocks"] == other.get("blocks")
 
-	# remove id if the first name may be the id
-	if thread_is_new:
-		if len(args.names) + 1 == len(args.indices) and args.close:
-			pass
-		elif len(args.names) == len(args.indices) + 1:
-			events.pop(0)
-		elif len(args.names) == len(args.indices) and not args.close:
-			pass
-		elif len(args.names) == len(args.indices) and args.close:
-			# only unclear state, first could be id or ending could have
-			# no description
-			pass
-			#events.pop(0)
-		else:
-			raise ValueError("Missing description. Every event except of the closing of a story thread needs a description")
-	else:
-		events.pop(0)
+def fingerprint_extends(version_file, stat, fingerprint):
+	"""
+	Find out whether a story file is the version of a fingerprint with
+	lines appended to it.
+
+	The blocks of the file up to the size of the version are hashed
+	again (see fingerprint_matches), so this costs reading that part of
+	the file.
+
+	Args:
+		version_file: The story file (see story_version_file).
+		stat: The stat result of the story file.
+		fingerprint: The fingerprint of a version of the story file (see
+			story_fingerprint).
 
-	#assert len(events) <= len(args.indices)
+	Return:
+		extends (Boolean): True if the file starts with the version of
+			the fingerprint and the version ends with a new line, else
+			False.
+	"""
+	if not isinstance(fingerprint, dict) or fingerprint.get("blocks") is None or fingerprint.get("size", stat.st_size + 1) > stat.st_size:
+		return False
+	size = fingerprint["size"]
+	digests = []
+	block = b"\n"
+	with open(version_file, "rb") as f:
+		for i in range(0, size, FINGERPRINT_BLOCK_BYTES):
+			block = f.read(min(FINGERPRINT_BLOCK_BYTES, size - i))
+			digests.append(hashlib.blake2b(block, digest_size=16).hexdigest())
+	return block.endswith(b"\n") and digests == fingerprint["blocks"]
 
-	if thread_is_new and not all(args.indices[0] <= args.indices[i+1] for i in range(len(args.indices) - 1)):
-		raise ValueError("The story thread must open before it can develop or close")
-	if not thread_events_are_new(thread_list, thread_id, events):
-		raise ValueError("The story thread already contains events with these descriptions")
-	if args.close and thread_is_closed(thread_list, thread_id):
-		raise ValueError("Cannot close a closed thread")
+def retrieve_parsed_story(story, path, storythread_file, stat):
+	"""
+	Load the parsed story threads from the hidden cache file.
 
-	if not nocache:
-		store_storythreads(f".{args.story}", args.path, thread_list)
+	The cache is only used if the story file did not change since the
+	cache was written (see fingerprint_matches). Events appended to the
+	story are appended to the cache along with the fingerprint of the
+	version before them (see append_parsed_story), so they are only
+	added if the cache is of that version. After PARSED_STORY_APPENDS
+	appends, the cache is stored as a whole again.
 
-	# create a new thread
-	shift_indices = 0
-	for i, index in enumerate(args.indices):
-		description = ""
-		# closings can be without description
-		try:
-			description = events.pop(0)
-		except IndexError:
-			pass
-		current_event = EVENT.DEVELOPMENT
-		# if the thread is new, add an opening
-		if thread_id not in [next(iter(el.keys())) for el in thread_list]:
-			current_event = EVENT.OPENING
-		# if the thread is to be closed, close it
-		elif i == len(args.indices)-1 and args.close and not thread_is_closed(thread_list, thread_id):
-			current_event = EVENT.CLOSING
-		# add the thread event
-		thread_list.insert(int(index)+shift_indices, {thread_id: {"event": current_event, "description": description}})
-		# because a thread has been added, in order to keep the
-		# indices correct, increment the index
-		shift_indices += 1
-
-	# store changes
-	store_storythreads(args.story, args.path, thread_list)
+	Args:
+		story: The name of the story that corresponds to the json file
+			name.
+		path: The path to the json file.
+		storythread_file: The story file (see story_version_file).
+		stat: The stat result of the story file.
 
-	# show changes
-	show_threads(args)
+	Return:
+		thread_list: The list of dictionaries that represent story
+			threads or None if there is no up to date cache.
+	"""
+	try:
+		with open(Path(path, f".{story}.parsed"), "rb") as f:
+			content = f.read()
+		# the garbage collector would traverse all new events several
+		# times while they are loaded
+		gc_was_enabled = gc.isenabled()
+		gc.disable()
+		try:
+			records = parsed_story_records(content)
+			version, fingerprint, thread_list = next(records)
+			if version != PARSED_STORY_VERSION:
+				return None
+			appends = 0
+			for previous, appended, events in records:
+				if not same_version(previous, fingerprint):
+					return None
+				fingerprint = appended
+				thread_list.extend(events)
+				appends += 1
+		finally:
+			if gc_was_enabled:
+				gc.enable()
+	except (FileNotFoundError, EOFError, ValueError, TypeError, StopIteration):
+		return None
+	written = fingerprint_written(fingerprint)
+	if not fingerprint_matches(storythread_file, stat, fingerprint):
+		return None
+	if appends > PARSED_STORY_APPENDS or fingerprint_written(fingerprint) != written:
+		store_parsed_story(story, path, fingerprint, thread_list)
+	return thread_list
 
-def remove_thread(args, noshow=False, nocache=False):
+def parsed_story_records(content):
 	"""
-	Remove a story thread or parts of a story thread.
+	Split the parsed story cache into its records.
 
-	If only the name of the story thread is given: Remove the whole
-	story thread from the json. If the ending or the development is
-	given but not the opening, remove the respective parts from the
-	story thread.
+	Every record is a marshal dump after its length as 8 bytes.
 
 	Args:
-		args: The arguments passed to the program by the user.
-		noshow (Boolean): A flag to show or not show the threads. The
-			default is to show them (False).
-		nocache (Boolean): A flag to determine whether the current
-			thread will be cached before changes are applied. The
-			default is to cache the thread (False).
+		content: The content of the cache file as bytes.
 
 	Raises:
-		ValueError: If
-			- the given story thread does not exist
-			- the thread is to be opened but is already open
+		EOFError: If the cache ends within a record.
+
+	Yield:
+		record: The next record as tuple.
 	"""
-	thread_list = retrieve_storythreads(args.story, args.path)
-	thread_ids = [next(iter(el.keys())) for el in thread_list]
+	content = memoryview(content)
+	position = 0
+	while position < len(content):
+		length = int.from_bytes(content[position:position+8], "little")
+		position += 8
+		if position + length > len(content):
+			raise EOFError("The parsed story cache is cut off")
+		yield marshal.loads(content[position:position+length])
+		position += length
 
-	if args.name not in thread_ids:
-		raise ValueError("The story thread with the given name does not exist and cannot be removed")
-	if args.ending and not thread_is_closed(thread_list, args.name):
-		raise ValueError("The story thread is already open")
-
-	if not nocache:
-		store_storythreads(f".{args.story}", args.path, thread_list)
-
-	if args.ending:
-		# remove only closing (i.e. open again)
-		thread_list.pop(len(thread_ids) - 1 - list(reversed(thread_ids)).index(args.name))
-	if args.development:
-		# remove only specified developments
-		indices = []
-		descriptions = []
-		for el in args.development:
-			try:
-				indices.append(int(el))
-			except ValueError:
-				descriptions.append(el)
-		for i,t in enumerate(thread_list):
-			key = next(iter(t.keys()))
-			if t[key]["event"] == EVENT.DEVELOPMENT and t[key]["description"] in descriptions:
-				indices.append(i)
-		removed = 0
-		indices.sort()
-		for i in indices:
-			if thread_ids[i] == args.name:
-				if thread_list[i-removed][next(iter(thread_list[i-removed].keys()))]["event"] == "develop":
-					thread_list.pop(i-removed)
-					removed += 1
-				else:
-					print(f"Did not remove thread development at index {i} as it is not a development.")
-			else:
-				print(f"Did not remove thread development at index {i} as it belongs to a different thread.")
-		if removed == 0:
-			print(f"There was nothing to remove.")
-	if not args.ending and not args.development:
-		# remove whole thread
-		while(args.name in thread_ids):
-			thread_list.pop(thread_ids.index(args.name))
-			thread_ids.remove(args.name)
-	store_storythreads(args.story, args.path, thread_list)
+def parsed_story_record(record):
+	"""
+	Encode a record of the parsed story cache (see
+	parsed_story_records).
 
-	# show changes
-	if not noshow:
-		show_threads(args)
+	Args:
+		record: The record as tuple.
 
-def change_thread(args):
+	Return:
+		content: The record as bytes.
 	"""
-	Change a story thread's opening, development and/or closing indices.
+	content = marshal.dumps(record)
+	return len(content).to_bytes(8, "little") + content
 
-	Move the indices of the story thread events by removing and adding
-	them to the indices provided by the user and storing the changes in
-	the json.
-	Note: Currently, only one event can be changed at a time.
+def store_parsed_story(story, path, fingerprint, thread_list):
+	"""
+	Cache the parsed story threads in a hidden file.
 
-	Args:
-		args: The arguments passed to the program by the user.
+	The cache is a marshal dump of the thread list along with the
+	fingerprint of the story file it was parsed from.
 
-	Raises:
-		ValueError: If
-			- the given story thread does not exist
-			- no thread event to change is given
-			- more than one index or description is given per event
-			- the development to be changed does not exist
-			- the order of opening, developments, closing is wrong
+	Args:
+		story: The name of the story that corresponds to the json file
+			name.
+		path: The path to the json file.
+		fingerprint: The fingerprint of the story file (see
+			story_fingerprint).
+		thread_list: The list of dictionaries that represent story
+			threads.
 	"""
-	if not args.opening and not args.ending and not args.development:
-		ValueError("No thread event specified for change")
-	if len(args.opening) > 2 or len(args.ending) > 2 or len(args.development) > 3:
-		ValueError("You can only change one index and description per event")
+	try:
+		with open(Path(path, f".{story}.parsed"), "wb") as f:
+			f.write(parsed_story_record((PARSED_STORY_VERSION, fingerprint, thread_list)))
+	except (OSError, ValueError):
+		# the cache is optional, e.g. for read only story paths or
+		# events that cannot be marshalled
+		pass
 
-	thread_list = retrieve_storythreads(args.story, args.path)
-	thread_ids = [next(iter(el.keys())) for el in thread_list]
+def append_parsed_story(story, path, previous, fingerprint, events):
+	"""
+	Add appended events to the parsed story cache.
 
-	if args.name not in thread_ids:
-		raise ValueError("The story thread with the given name does not exist and cannot be changed")
-	if args.ending and not thread_is_closed(thread_list, args.name):
-		raise ValueError("The story thread is not closed. The ending cannot be changed.")
+	Args:
+		story: The name of the story that corresponds to the json file
+			name.
+		path: The path to the json file.
+		previous: The fingerprint of the story file before the events
+			were appended.
+		fingerprint: The fingerprint of the story file with the events
+			(see story_fingerprint).
+		events: The list of dictionaries that represent the appended
+			story threads.
+	"""
+	try:
+		with open(Path(path, f".{story}.parsed"), "ab") as f:
+			f.write(parsed_story_record((previous, fingerprint, events)))
+	except (OSError, ValueError):
+		pass
 
-	store_storythreads(f".{args.story}", args.path, thread_list) # cache
+def store_storythreads(story, path, thread_list, cache=False, appended_from=None, operation="store", warn=True, previous_list=None):
+	"""
+	Store the story threads as a json file.
 
-	# get the current thread
-	dev_index = -1
-	current_indices = []
-	current_descriptions = []
-	current_close = False
-	for i,el in enumerate(thread_list):
-		name = next(iter(el.keys()))
-		if name == args.name:
-			current_indices.append(i)
-			try:
-				current_descriptions.append(el[name]["description"])
-			except IndexError:
-				pass
-			if args.development and el[name]["event"] == EVENT.DEVELOPMENT and (str(i) == args.development[0] or el[name]["description"] == args.development[0]):
-				dev_index = len(current_indices) - 1
-			if el[name]["event"] == EVENT.CLOSING:
-				current_close = True
+	The story threads are dictionaries (to be able to identify them by
+	name) stored in a list (to order them by index). To store them as
+	a json file, the list is converted to a dictionary with the indices
+	as keys. If the story is a jsonl file (see story_file), every event
+	is stored on its own line instead, and events that were only
+	appended to the story are appended to the file. Of a sharded story,
+	only the changed segments are stored (see store_shards).
+	Unless the threads are cached, the operation is added to the history
+	of the story (see record_history) and the search index of the story
+	is updated along with it. A sharded story is not cached or indexed
+	as a whole, as that would cost as much as storing all segments: the
+	stored segments are cached one by one (see store_shards) and the
+	stored index is updated when it is needed next (see
+	retrieve_search_index). Events appended to a jsonl file are only
+	hashed and cached on their own if the history knows the version of
+	the file before them (see file_fingerprint and append_parsed_story)
+	and they are added to the stored index when it is needed next.
 
-	# apply changes
-	if args.opening:
-		for el in args.opening:
-			try:
-				current_indices[0] = int(el)
-			except ValueError:
-				current_descriptions[0] = el
-		if not all(current_indices[0] <= i for i in current_indices[1:]):
-			raise ValueError("The story thread must open before it can develop or close")
-	if args.development:
-		if dev_index < 0:
-			raise ValueError(f"The given development index or description does not match a known development.")
-		for el in args.development:
-			try:
-				current_indices[dev_index] = int(el)
-			except ValueError:
-				current_descriptions[dev_index] = el
-		if current_indices[0] > current_indices[dev_index]:
-			raise ValueError(f"The story thread cannot develop before it opens.")
-	if args.ending:
-		for el in args.ending:
+	Args:
+		story: The name of the story that corresponds to the json file
+			name.
+		path: The path to the json file.
+		thread_list: The list of dictionaries that represent story
+			threads.
+		cache (Boolean): A flag to mark the threads as the undo cache
+			of the story. The default is to store the story itself
+			(False).
+		appended_from: The index of the first new event if the stored
+			story holds exactly the events before it. The default is to
+			store the whole story (None).
+		operation: The name of the operation for the history. The
+			default is "store".
+		warn (Boolean): A flag to warn the user about any problem of the
+			stored story (see story_problems). The default is to warn
+			(True).
+		previous_list: The story threads as they are stored so far,
+			e.g. as loaded by a FileStore. The default is to load them
+			for the history (None).
+	"""
+	if not cache:
+		with profile_phase("history"):
+			if previous_list is None:
+				previous_list = retrieve_storythreads(story, path)
+			head = record_history(story, path, previous_list, thread_list, operation)
+	with profile_phase("cache" if cache else "store"):
+		storythread_file = story_file(story, path)
+		storythread_file.parent.mkdir(parents=True, exist_ok=True)
+		sharded = storythread_file.suffix == ".shards"
+		appended = False
+		if sharded:
+			content = store_shards(storythread_file, thread_list, *(shared_events(previous_list, thread_list) if previous_list is not None else ()))
+			storythread_file = Path(storythread_file, SHARD_MANIFEST)
+		elif storythread_file.suffix == ".jsonl":
+			content = None
+			if appended_from is not None and storythread_file.exists():
+				with open(storythread_file, "r+b") as f:
+					# a file edited by hand may not end with a new line
+					end = f.seek(0, os.SEEK_END)
+					if end:
+						f.seek(end - 1)
+						if f.read(1) != b"\n":
+							f.write(b"\n")
+					f.write(encode_jsonl(thread_list[appended_from:]))
+				appended = True
+			else:
+				content = encode_jsonl(thread_list)
+				with open(storythread_file, "wb") as f:
+					f.write(content)
+		else:
+			# json.dump encodes piece by piece in python, encoding the
+			# whole story at once is much faster
+			content = json.dumps({i: el for i, el in enumerate(thread_list)}, ensure_ascii=False).encode("utf-8")
+			with open(storythread_file, "wb") as f:
+				f.write(content)
+		# the next command can skip parsing the story
+		if not cache:
+			# the version of the story file before the operation if it
+			# was the recorded one
+			previous = head["story"] if appended else None
+			if content is None:
+				fingerprint = file_fingerprint(storythread_file, storythread_file.stat(), previous)
+			else:
+				fingerprint = story_fingerprint(storythread_file.stat(), content)
+			if previous is not None:
+				append_parsed_story(story, path, previous, fingerprint, thread_list[appended_from:])
+			elif not sharded:
+				store_parsed_story(story, path, fingerprint, thread_list)
+			head["story"] = fingerprint
+			store_history_head(story, path, head)
+	if not cache and warn:
+		for problem in story_problems(thread_list):
+			print("Warning: " + format_problem(*problem))
+	if not cache and not sharded and not appended:
+		with profile_phase("index"):
+			search_index = build_search_index(thread_list, read_search_index(story, path))
+			search_index["story"] = fingerprint
+			store_search_index(story, path, search_index)
+
+def parse_story(content, jsonl=False):
+	"""
+	Parse the content of a story file.
+
+	Args:
+		content: The content of a story file as bytes.
+		jsonl (Boolean): A flag to parse the content as jsonl. The
+			default is json (False).
+
+	Raises:
+		JSONDecodeError: If the content is not valid json or jsonl.
+
+	Return:
+		thread_list: The list of dictionaries that represent story
+			threads.
+	"""
+	if jsonl:
+		# parsing all lines at once as a list is much faster than
+		# parsing them one by one
+		return json.loads(b"[" + b",".join(line for line in content.splitlines() if line.strip()) + b"]")
+	thread_dict = json.loads(content)
+	sorted_keys = [int(k) for k in thread_dict.keys()]
+	sorted_keys.sort()
+	return [thread_dict[str(k)] for k in sorted_keys]
+
+def encode_jsonl(thread_list):
+	"""
+	Encode story threads as lines of json.
+
+	Args:
+		thread_list: The list of dictionaries that represent story
+			threads.
+
+	Return:
+		content: The events as bytes, one per line.
+	"""
+	return "".join(JSONL_ENCODER.encode(el) + "\n" for el in thread_list).encode("utf-8")
+
+def cache_storythreads(story, path, thread_list, stored=False):
+	"""
+	Cache the story threads to be able to undo the next change.
+
+	The cache is a hidden json file next to the story file. The cache
+	of a sharded story is sharded as well, so that a change only writes
+	the changed segments of the cache. If the cached threads are the
+	stored story, its segments (see copy_shards) or its jsonl file are
+	copied instead of encoding the threads again.
+
+	Args:
+		story: The name of the story that corresponds to the json file
+			name.
+		path: The path to the json file.
+		thread_list: The list of dictionaries that represent story
+			threads.
+		stored (Boolean): A flag to mark the threads as the story as it
+			is stored. The default is False.
+	"""
+	storythread_file = story_file(story, path)
+	if storythread_file.suffix == ".shards":
+		if stored and Path(storythread_file, SHARD_MANIFEST).exists():
+			copy_shards(storythread_file, Path(path, f".{story}.shards"))
+			return
+		Path(path, f".{story}.shards").mkdir(exist_ok=True)
+	elif storythread_file.suffix == ".jsonl" and stored:
+		shutil.copyfile(storythread_file, Path(path, f".{story}.jsonl"))
+		return
+	store_storythreads(f".{story}", path, thread_list, cache=True)
+
+def shared_events(old_list, new_list):
+	"""
+	Count the events at the start and at the end that two versions of a
+	story share.
+
+	The events are compared a block at a time, as comparing lists skips
+	the events that are the same dictionaries in memory.
+
+	Args:
+		old_list: The old list of dictionaries that represent story
+			threads.
+		new_list: The new list of dictionaries that represent story
+			threads.
+
+	Return:
+		prefix: The number of equal events at the start.
+		suffix: The number of equal events at the end, not counting
+			those at the start.
+	"""
+	size = min(len(old_list), len(new_list))
+	prefix = 0
+	while prefix + 1024 <= size and old_list[prefix:prefix + 1024] == new_list[prefix:prefix + 1024]:
+		prefix += 1024
+	while prefix < size and old_list[prefix] == new_list[prefix]:
+		prefix += 1
+	suffix = 0
+	while suffix + 1024 <= size - prefix and old_list[len(old_list) - suffix - 1024:len(old_list) - suffix] == new_list[len(new_list) - suffix - 1024:len(new_list) - suffix]:
+		suffix += 1024
+	while suffix < size - prefix and old_list[-1 - suffix] == new_list[-1 - suffix]:
+		suffix += 1
+	return prefix, suffix
+
+def index_thread_positions(thread_list):
+	"""
+	Map every story thread to the positions of its events.
+
+	Args:
+		thread_list: The list of dictionaries that represent story
+			threads.
+
+	Return:
+		thread_index: A dictionary with the thread ids as keys and the
+			ascending list indices of their events as values.
+	"""
+	thread_index = {}
+	for i, el in enumerate(thread_list):
+		thread_index.setdefault(next(iter(el.keys())), []).append(i)
+	return thread_index
+
+def thread_is_closed(thread_list, thread_id):
+	"""
+	Find out if a given thread has been closed.
+
+	A non-existing thread is not closed.
+
+	Args:
+		thread_list: The list of dictionaries that represent story
+			threads.
+		thread_id: The id/name of the thread to check.
+
+	Return:
+		Boolean: True, if the thread exists and has been closed, else
+			False
+	"""
+	if thread_id not in [next(iter(el.keys())) for el in thread_list]:
+		return False
+	thread_ids = [next(iter(el.keys())) for el in thread_list]
+	index_last_entry = len(thread_ids) - 1 - list(reversed(thread_ids)).index(thread_id)
+	if thread_list[index_last_entry][thread_id]["event"] == EVENT.CLOSING:
+		return True
+	return False
+
+def thread_events_are_new(thread_list, thread_id, descriptions):
+	"""
+	Check if the event descriptions are different from those of a given
+	thread.
+
+	Args:
+		thread_list: The list of dictionaries that represent story
+			threads.
+		thread_id: The id/name of the thread to check.
+		descriptions: The list of descriptions to check against the
+			given thread's descriptions.
+
+	Return:
+		Boolean: True, if the descriptions differ, else False
+	"""
+	# gather all elements of the thread
+	thread_descriptions = set()
+	for el in thread_list:
+		name = next(iter(el.keys()))
+		if name == thread_id:
+			thread_descriptions.add(el[name]["description"])
+
+	# check if the given description(s) already exist(s)
+	return thread_descriptions.isdisjoint(descriptions)
+
+def is_event_type(event):
+	"""
+	Check if a value is one of the events of the story thread.
+
+	Args:
+		event: The value to check.
+
+	Return:
+		Boolean: True, if the value is an event (see EVENT), else False
+	"""
+	return isinstance(event, str) and event in EVENT_TYPES
+
+def next_thread_state(state, event):
+	"""
+	Advance the state of a story thread by one of its events.
+
+	A story thread has to open before it can develop or close and
+	cannot continue after it has been closed.
+
+	Args:
+		state: The dictionary that tracks whether the thread has been
+			opened and closed so far or None if the thread has no
+			events yet.
+		event: The event of the thread (see EVENT).
+
+	Return:
+		state: The dictionary that tracks the thread after the event.
+		problem: A description of how the event breaks the order of
+			the thread or None if it does not.
+	"""
+	problem = None
+	if state is None:
+		state = {"opened": False, "closed": False}
+		if event == EVENT.DEVELOPMENT:
+			problem = "develops before it opens"
+		elif event == EVENT.CLOSING:
+			problem = "closes before it opens"
+	elif event == EVENT.OPENING:
+		problem = "opens twice" if state["opened"] else "opens after it develops or closes"
+	elif state["closed"]:
+		problem = "closes twice" if event == EVENT.CLOSING else "develops after it closes"
+	if event == EVENT.OPENING:
+		state["opened"] = True
+	elif event == EVENT.CLOSING:
+		state["closed"] = True
+	return state, problem
+
+@profile_phase("validate")
+def thread_order_violations(thread_list, thread_ids=None):
+	"""
+	Find the events that break the order of their story thread.
+
+	The story is checked in a single pass that keeps track of whether
+	each thread has been opened and closed so far.
+
+	Args:
+		thread_list: The list of dictionaries that represent story
+			threads.
+		thread_ids: The ids/names of the threads to check. The default
+			is to check all threads (None).
+
+	Return:
+		violations: A list of (index, thread id, problem) tuples in the
+			order of the story.
+	"""
+	violations = []
+	thread_states = {}
+	for i, el in enumerate(thread_list):
+		name = next(iter(el.keys()))
+		if thread_ids is not None and name not in thread_ids:
+			continue
+		thread_states[name], problem = next_thread_state(thread_states.get(name), el[name]["event"])
+		if problem is not None:
+			violations.append((i, name, problem))
+	return violations
+
+# the optional fields of an event besides its type and description
+METADATA_FIELDS = ("chapter", "tags", "offset")
+
+def event_metadata(event):
+	"""
+	Get the metadata of a story thread event.
+
+	Args:
+		event: The dictionary of the event type and description (the
+			value of an entry of the thread list).
+
+	Return:
+		metadata: A dictionary with the metadata fields (see
+			METADATA_FIELDS) that the event has.
+	"""
+	return {field: event[field] for field in METADATA_FIELDS if field in event}
+
+def metadata_problem(event):
+	"""
+	Check if the metadata of a story thread event is malformed.
+
+	The chapter and the (word) offset are numbers from 0 on and the
+	tags a list of names.
+
+	Args:
+		event: The dictionary of the event type and description (the
+			value of an entry of the thread list).
+
+	Return:
+		problem: A tuple of the malformed field and what is wrong with
+			it or None if the metadata is well-formed.
+	"""
+	for field in ["chapter", "offset"]:
+		if field in event and (type(event[field]) is not int or event[field] < 0):
+			return field, f"has no valid {field}"
+	if "tags" in event and (not isinstance(event["tags"], list) or not all(isinstance(tag, str) and tag for tag in event["tags"])):
+		return "tags", "has no valid tags"
+	return None
+
+def event_format_problem(el):
+	"""
+	Check if a story thread event is malformed.
+
+	Args:
+		el: The entry of the thread list to check.
+
+	Return:
+		problem: A description of what is wrong with the event or None
+			if it is well-formed.
+	"""
+	if not isinstance(el, dict) or len(el) != 1:
+		return "is not a single story thread event"
+	name = next(iter(el.keys()))
+	if not isinstance(el[name], dict) or not is_event_type(el[name].get("event")):
+		return "has no valid event type"
+	if not isinstance(el[name].get("description"), str):
+		return "has no valid description"
+	problem = metadata_problem(el[name])
+	if problem is not None:
+		return problem[1]
+	return None
+
+@profile_phase("validate")
+def story_problems(thread_list):
+	"""
+	Find everything that breaks the rules for story threads.
+
+	Besides the order of the thread events (see next_thread_state),
+	every event has to be well-formed and the descriptions of a thread
+	must not repeat. The story is checked in a single pass.
+
+	Args:
+		thread_list: The list of dictionaries that represent story
+			threads.
+
+	Return:
+		problems: A list of (index, thread id, problem) tuples in the
+			order of the story. The thread id of an event that is not
+			even a single story thread event is None.
+	"""
+	problems = []
+	thread_states = {}
+	thread_descriptions = {}
+	for i, el in enumerate(thread_list):
+		problem = event_format_problem(el)
+		if problem is None:
+			name = next(iter(el))
+		else:
+			name = next(iter(el)) if isinstance(el, dict) and len(el) == 1 else None
+			problems.append((i, name, problem))
+			if name is None or not isinstance(el[name], dict) or not is_event_type(el[name].get("event")):
+				continue
+		event = el[name]
+		thread_states[name], problem = next_thread_state(thread_states.get(name), event["event"])
+		if problem is not None:
+			problems.append((i, name, problem))
+		description = event.get("description")
+		if description and isinstance(description, str):
+			descriptions = thread_descriptions.setdefault(name, set())
+			known = len(descriptions)
+			descriptions.add(description)
+			if len(descriptions) == known:
+				problems.append((i, name, "repeats a description"))
+	return problems
+
+def repair_storythreads(thread_list):
+	"""
+	Repair the rules for story threads as far as possible.
+
+	- Events without a valid description get an empty description.
+	- Events that cannot be interpreted are removed.
+	- The first event of a thread becomes its opening and any later
+	  opening becomes a development.
+	- A thread closes with its last closing. Earlier closings become
+	  developments or are removed if they have no description.
+	- A closing that is followed by other events of its thread is
+	  moved behind the last of them.
+	- Malformed metadata fields are removed.
+	Repeated descriptions are not repaired.
+
+	Args:
+		thread_list: The list of dictionaries that represent story
+			threads.
+
+	Return:
+		thread_list: The repaired list of dictionaries that represent
+			story threads.
+		repairs: A list of (index, thread id, repair) tuples that
+			describe the repairs by the index of the event in the given
+			list.
+	"""
+	repairs = []
+	events = []
+	# gather the interpretable events and where each thread starts
+	# and ends
+	first = {}
+	last = {}
+	last_closing = {}
+	for i, el in enumerate(thread_list):
+		if not isinstance(el, dict) or len(el) != 1:
+			repairs.append((i, None, "removed the malformed event"))
+			continue
+		name = next(iter(el.keys()))
+		if not isinstance(el[name], dict) or not is_event_type(el[name].get("event")):
+			repairs.append((i, name, "removed the event without a valid event type"))
+			continue
+		event = EVENT(el[name]["event"])
+		description = el[name].get("description")
+		if not isinstance(description, str):
+			repairs.append((i, name, "set the missing description to an empty one"))
+			description = "" if description is None else str(description)
+		metadata = event_metadata(el[name])
+		problem = metadata_problem(metadata)
+		while problem is not None:
+			repairs.append((i, name, f"removed the invalid {problem[0]}"))
+			del metadata[problem[0]]
+			problem = metadata_problem(metadata)
+		events.append((i, name, event, description, metadata))
+		first.setdefault(name, i)
+		last[name] = i
+		if event == EVENT.CLOSING and i != first[name]:
+			last_closing[name] = i
+
+	repaired_list = []
+	moved_closings = {}
+	for i, name, event, description, metadata in events:
+		if i == first[name]:
+			if event != EVENT.OPENING:
+				repairs.append((i, name, f"turned the first event ({event.value}) into the opening"))
+				event = EVENT.OPENING
+				description = description or name
+		elif event == EVENT.OPENING:
+			repairs.append((i, name, "turned the repeated opening into a development"))
+			event = EVENT.DEVELOPMENT
+		elif event == EVENT.CLOSING and i != last_closing[name]:
+			if description:
+				repairs.append((i, name, "turned the early closing into a development"))
+				event = EVENT.DEVELOPMENT
+			else:
+				repairs.append((i, name, "removed the early closing"))
+				continue
+		elif event == EVENT.CLOSING and i < last[name]:
+			repairs.append((i, name, f"moved the closing behind the last event of the thread at index {last[name]}"))
+			moved_closings[name] = {name: {"event": event.value, "description": description, **metadata}}
+			continue
+		repaired_list.append({name: {"event": event.value, "description": description, **metadata}})
+		if i == last[name] and name in moved_closings:
+			repaired_list.append(moved_closings.pop(name))
+	return repaired_list, sorted(repairs, key=lambda repair: repair[0])
+
+def format_problem(index, thread_id, problem):
+	"""
+	Describe a problem of a story thread event for the user.
+
+	Args:
+		index: The index of the event.
+		thread_id: The id/name of the thread of the event or None.
+		problem: The description of the problem.
+
+	Return:
+		String: The description of the event and the problem.
+	"""
+	if thread_id is None:
+		return f"{index}: The event {problem}"
+	return f"{index}: {thread_id} {problem}"
+
+
+### sharded stories ###
+
+SHARD_MANIFEST = "manifest.json"
+# a segment ends after an event if the lowest bits of the hash of its
+# line are 0, but not before it has the minimum size, so that segments
+# are about 768 events long
+SHARD_CHUNK_MASK = 0x1FF
+SHARD_MIN_EVENTS = 256
+SHARD_MAX_EVENTS = 4096
+
+def store_shards(directory, thread_list, prefix=0, suffix=0):
+	"""
+	Store the story threads as segments of a sharded story.
+
+	A sharded story is a directory with a manifest of the segments and
+	one jsonl file per segment that holds a contiguous range of events.
+	The segment boundaries only depend on the events around them (like
+	the chunks of the history, see store_snapshot), so that segments
+	grow and shrink with the story and split or merge on their own.
+	The segment files are named by the hash of their content, so only
+	the segments with changed events and the manifest are written. The
+	events of the new segments are cached as they are parsed (see
+	retrieve_segment). Segments that are not used anymore are removed
+	along with their caches. The segments in front of and after the
+	changed events are kept without encoding their events again.
+
+	Args:
+		directory: The path of the story directory.
+		thread_list: The list of dictionaries that represent story
+			threads.
+		prefix: The number of events at the start of the story that did
+			not change since it was stored. The default is to encode all
+			events (0).
+		suffix: The number of events at the end of the story that did
+			not change since it was stored (see shared_events). The
+			default is 0.
+
+	Return:
+		content: The content of the manifest as bytes.
+	"""
+	directory = Path(directory)
+	directory.mkdir(parents=True, exist_ok=True)
+	segments = []
+
+	def store_segment(lines, threads, events):
+		content = b"".join(lines)
+		name = hashlib.blake2b(content, digest_size=16).hexdigest() + ".jsonl"
+		segment_file = Path(directory, name)
+		if not segment_file.exists():
+			with open(segment_file, "wb") as f:
+				f.write(content)
+			store_parsed_segment(directory, name, story_fingerprint(segment_file.stat(), content), events)
+		segments.append({"file": name, "size": len(lines), "threads": list(threads)})
+
+	stored = retrieve_manifest(directory) if prefix or suffix else {"size": 0, "segments": []}
+	start = 0
+	# the last segment may end with the story instead of at a boundary,
+	# so it is only kept along with the end of the story
+	for segment in stored["segments"][:-1]:
+		if start + segment["size"] > prefix or not Path(directory, segment["file"]).exists():
+			break
+		segments.append(segment)
+		start += segment["size"]
+	# the segments that start in the unchanged end of the story, by
+	# their start in the new story
+	stored_starts = {}
+	stored_start = 0
+	for k, segment in enumerate(stored["segments"]):
+		if stored_start >= stored["size"] - suffix:
+			stored_starts[stored_start + len(thread_list) - stored["size"]] = k
+		stored_start += segment["size"]
+
+	lines = []
+	threads = {}
+	for i, el in enumerate(thread_list[start:], start):
+		if not lines and i in stored_starts and all(Path(directory, segment["file"]).exists() for segment in stored["segments"][stored_starts[i]:]):
+			# the segments from here on are the same as before
+			segments.extend(stored["segments"][stored_starts[i]:])
+			break
+		line = (JSONL_ENCODER.encode(el) + "\n").encode("utf-8")
+		lines.append(line)
+		threads[next(iter(el.keys()))] = None
+		if len(lines) >= SHARD_MAX_EVENTS or (len(lines) >= SHARD_MIN_EVENTS and zlib.crc32(line) & SHARD_CHUNK_MASK == 0):
+			store_segment(lines, threads, thread_list[start:i+1])
+			lines = []
+			threads = {}
+			start = i + 1
+	if lines:
+		store_segment(lines, threads, thread_list[start:])
+
+	content = json.dumps({"version": 1, "size": len(thread_list), "segments": segments}, ensure_ascii=False).encode("utf-8")
+	store_manifest(directory, content, segments)
+	return content
+
+def store_manifest(directory, content, segments):
+	"""
+	Replace the manifest of a sharded story and remove the segments
+	that it does not list anymore along with their caches.
+
+	Args:
+		directory: The path of the story directory.
+		content: The content of the manifest as bytes.
+		segments: The segments that the manifest lists.
+	"""
+	# replace the manifest at once, so that it never lists missing
+	# segments
+	manifest_file = Path(directory, SHARD_MANIFEST)
+	with open(manifest_file.with_suffix(".tmp"), "wb") as f:
+		f.write(content)
+	os.replace(manifest_file.with_suffix(".tmp"), manifest_file)
+
+	used = {segment["file"] for segment in segments}
+	for segment_file in directory.glob("*.jsonl"):
+		if segment_file.name not in used:
+			segment_file.unlink()
+			Path(segment_cache_path(directory), segment_file.name).unlink(missing_ok=True)
+
+def copy_shards(source, directory):
+	"""
+	Copy a sharded story.
+
+	As the segments are named by their content, only the segments that
+	the copy does not have yet are copied.
+
+	Args:
+		source: The path of the story directory to copy.
+		directory: The path of the copy.
+	"""
+	directory = Path(directory)
+	directory.mkdir(parents=True, exist_ok=True)
+	with open(Path(source, SHARD_MANIFEST), "rb") as f:
+		content = f.read()
+	segments = json.loads(content)["segments"]
+	for segment in segments:
+		if not Path(directory, segment["file"]).exists():
+			shutil.copyfile(Path(source, segment["file"]), Path(directory, segment["file"]))
+	store_manifest(directory, content, segments)
+
+def segment_cache_path(directory):
+	"""
+	Get the hidden directory with the parsed segments of a sharded
+	story.
+
+	Args:
+		directory: The path of the story directory.
+
+	Return:
+		cache: The path of the directory next to the story directory.
+	"""
+	directory = Path(directory)
+	return Path(directory.parent, f".{directory.stem}.segments")
+
+def retrieve_segment(directory, name):
+	"""
+	Load the events of a segment of a sharded story.
+
+	Like the parsed story (see retrieve_parsed_story), the parsed
+	events of every segment are cached in a hidden file that is used as
+	long as the segment file did not change.
+
+	Args:
+		directory: The path of the story directory.
+		name: The file name of the segment.
+
+	Return:
+		events: The list of dictionaries that represent the story
+			threads of the segment.
+	"""
+	segment_file = Path(directory, name)
+	stat = segment_file.stat()
+	try:
+		with open(Path(segment_cache_path(directory), name), "rb") as f:
+			version, fingerprint, events = marshal.loads(f.read())
+		written = fingerprint_written(fingerprint)
+		if version == PARSED_STORY_VERSION and fingerprint_matches(segment_file, stat, fingerprint):
+			if fingerprint_written(fingerprint) != written:
+				store_parsed_segment(directory, name, fingerprint, events)
+			return events
+	except (FileNotFoundError, EOFError, ValueError, TypeError):
+		pass
+	with open(segment_file, "rb") as f:
+		content = f.read()
+	events = parse_story(content, jsonl=True)
+	store_parsed_segment(directory, name, story_fingerprint(stat, content), events)
+	return events
+
+def store_parsed_segment(directory, name, fingerprint, events):
+	"""
+	Cache the parsed events of a segment of a sharded story (see
+	retrieve_segment).
+
+	Args:
+		directory: The path of the story directory.
+		name: The file name of the segment.
+		fingerprint: The fingerprint of the segment file (see
+			story_fingerprint).
+		events: The list of dictionaries that represent the story
+			threads of the segment.
+	"""
+	try:
+		cache = segment_cache_path(directory)
+		cache.mkdir(exist_ok=True)
+		with open(Path(cache, name), "wb") as f:
+			f.write(marshal.dumps((PARSED_STORY_VERSION, fingerprint, events)))
+	except (OSError, ValueError):
+		# the cache is optional, like the parsed story cache
+		pass
+
+def retrieve_manifest(directory):
+	"""
+	Load the manifest of a sharded story (see store_shards).
+
+	Args:
+		directory: The path of the story directory.
+
+	Return:
+		manifest: The manifest with the number of events and the list of
+			segments, each with its file, number of events and threads.
+	"""
+	try:
+		with open(Path(directory, SHARD_MANIFEST), "rb") as f:
+			return json.loads(f.read())
+	except FileNotFoundError:
+		return {"version": 1, "size": 0, "segments": []}
+
+def retrieve_shards(directory, manifest, segments=None):
+	"""
+	Load the events of the segments of a sharded story (see
+	retrieve_segment).
+
+	Args:
+		directory: The path of the story directory.
+		manifest: The manifest of the story (see retrieve_manifest).
+		segments: The positions of the segments to load in the list of
+			segments. The default is to load all segments (None).
+
+	Return:
+		thread_list: The list of dictionaries that represent the story
+			threads of the segments in story order.
+	"""
+	if segments is None:
+		segments = range(len(manifest["segments"]))
+	thread_list = []
+	# the garbage collector would traverse all new events several times
+	# while they are loaded
+	gc_was_enabled = gc.isenabled()
+	gc.disable()
+	try:
+		for segment in segments:
+			thread_list.extend(retrieve_segment(directory, manifest["segments"][segment]["file"]))
+	finally:
+		if gc_was_enabled:
+			gc.enable()
+	return thread_list
+
+def retrieve_story_range(story, path, first, last):
+	"""
+	Load a range of events of a story (see retrieve_story_events).
+
+	Args:
+		story: The name of the story that corresponds to the file name.
+		path: The path to the story file.
+		first: The index of the first event.
+		last: The index of the last event.
+
+	Return:
+		thread_list: The list of dictionaries that represent the story
+			threads from the first to the last index.
+	"""
+	return retrieve_story_events(story, path, range(max(first, 0), last + 1))
+
+def retrieve_story_events(story, path, positions):
+	"""
+	Load the events at some indices of a story.
+
+	Of a sharded story, only the segments with events at the indices
+	are loaded. Other stories are loaded as a whole.
+
+	Args:
+		story: The name of the story that corresponds to the file name.
+		path: The path to the story file.
+		positions: The ascending list indices of the events. Indices
+			after the end of the story are skipped.
+
+	Return:
+		thread_list: The list of dictionaries that represent the story
+			threads at the indices.
+	"""
+	storythread_file = story_file(story, path)
+	if storythread_file.suffix != ".shards":
+		thread_list = retrieve_storythreads(story, path)
+		return [thread_list[i] for i in positions if i < len(thread_list)]
+	manifest = retrieve_manifest(storythread_file)
+	events = []
+	start = 0
+	k = 0
+	for segment in manifest["segments"]:
+		end = start + segment["size"]
+		if k < len(positions) and positions[k] < end:
+			segment_list = retrieve_segment(storythread_file, segment["file"])
+			while k < len(positions) and positions[k] < end:
+				events.append(segment_list[positions[k] - start])
+				k += 1
+		start = end
+	return events
+
+def retrieve_story_thread(story, path, thread_id):
+	"""
+	Load the events of a single story thread.
+
+	Of a sharded story, only the segments with events of the thread
+	are loaded. Other stories are loaded as a whole.
+
+	Args:
+		story: The name of the story that corresponds to the file name.
+		path: The path to the story file.
+		thread_id: The id/name of the thread.
+
+	Return:
+		events: A list of (index, event) tuples of the events of the
+			thread, where the event is the dictionary with the event type
+			and the description.
+	"""
+	storythread_file = story_file(story, path)
+	if storythread_file.suffix != ".shards":
+		return [(i, el[thread_id]) for i, el in enumerate(retrieve_storythreads(story, path)) if thread_id in el]
+	manifest = retrieve_manifest(storythread_file)
+	events = []
+	start = 0
+	for segment in manifest["segments"]:
+		if thread_id in segment["threads"]:
+			for j, el in enumerate(retrieve_segment(storythread_file, segment["file"])):
+				if thread_id in el:
+					events.append((start + j, el[thread_id]))
+		start += segment["size"]
+	return events
+
+
+### history ###
+
+# every how many operations the whole story is stored in the history
+HISTORY_SNAPSHOT_INTERVAL = 16
+# an event ends a chunk of a snapshot if the lowest bits of the hash of
+# its line are 0, so that chunks are 16 events long on average
+HISTORY_CHUNK_MASK = 0xF
+HISTORY_MAX_CHUNK = 64
+# longer changed ranges of a story are aligned by their unique events
+# only (see anchor_sequences)
+HISTORY_ALIGN_EVENTS = 2000
+
+def history_path(story, path):
+	"""
+	Get the hidden directory with the history of a story.
+
+	The directory holds the log of the operations (log.jsonl), the
+	number of the last operation and the fingerprint of the story file
+	after it (head.json) and the content addressed chunks of the
+	snapshots (objects).
+
+	Args:
+		story: The name of the story that corresponds to the file name.
+		path: The path to the story file.
+
+	Return:
+		history: The path of the history directory.
+	"""
+	return Path(path, f".{story}.history")
+
+def store_history_object(history, content):
+	"""
+	Store content in the history by its hash.
+
+	Content that is already stored is not written again.
+
+	Args:
+		history: The path of the history directory.
+		content: The content as bytes.
+
+	Return:
+		digest: The sha256 hash of the content as hex string.
+	"""
+	digest = hashlib.sha256(content).hexdigest()
+	object_file = Path(history, "objects", digest[:2], digest[2:])
+	if not object_file.exists():
+		object_file.parent.mkdir(parents=True, exist_ok=True)
+		with open(object_file, "wb") as f:
+			f.write(content)
+	return digest
+
+def retrieve_history_object(history, digest):
+	"""
+	Load content from the history by its hash.
+
+	Args:
+		history: The path of the history directory.
+		digest: The sha256 hash of the content as hex string.
+
+	Return:
+		content: The content as bytes.
+	"""
+	with open(Path(history, "objects", digest[:2], digest[2:]), "rb") as f:
+		return f.read()
+
+def store_snapshot(history, thread_list):
+	"""
+	Store the whole story in the history.
+
+	The events are split into chunks where the hash of an event line
+	has its lowest bits unset. As the chunk boundaries only depend on
+	the events, an edit only changes the chunks around it and all other
+	chunks are shared with earlier snapshots (see store_history_object).
+
+	Args:
+		history: The path of the history directory.
+		thread_list: The list of dictionaries that represent story
+			threads.
+
+	Return:
+		digest: The hash of the list of chunk hashes.
+	"""
+	chunks = []
+	chunk = []
+	for el in thread_list:
+		line = (JSONL_ENCODER.encode(el) + "\n").encode("utf-8")
+		chunk.append(line)
+		if zlib.crc32(line) & HISTORY_CHUNK_MASK == 0 or len(chunk) >= HISTORY_MAX_CHUNK:
+			chunks.append(store_history_object(history, b"".join(chunk)))
+			chunk = []
+	if chunk:
+		chunks.append(store_history_object(history, b"".join(chunk)))
+	return store_history_object(history, json.dumps(chunks).encode("utf-8"))
+
+def retrieve_snapshot(history, digest):
+	"""
+	Load a whole story from the history (see store_snapshot).
+
+	Args:
+		history: The path of the history directory.
+		digest: The hash of the list of chunk hashes.
+
+	Return:
+		thread_list: The list of dictionaries that represent story
+			threads.
+	"""
+	thread_list = []
+	for chunk in json.loads(retrieve_history_object(history, digest)):
+		thread_list.extend(parse_story(retrieve_history_object(history, chunk), jsonl=True))
+	return thread_list
+
+def story_delta(old_list, new_list):
+	"""
+	Find the operations that turn one version of a story into another.
+
+	The common start and end of both versions are compared directly,
+	only the events in between are aligned (see match_sequences). Long
+	ranges in between, e.g. after an import, are aligned by the events
+	that occur once in both versions (see anchor_sequences), which
+	takes O(n log n) instead of O(n d) for d differences.
+
+	Args:
+		old_list: The old list of dictionaries that represent story
+			threads.
+		new_list: The new list of dictionaries that represent story
+			threads.
+
+	Return:
+		delta: A list of ["copy", start, length] operations that copy
+			events of the old version and ["insert", events] operations
+			that insert new events (see apply_delta).
+	"""
+	prefix, suffix = shared_events(old_list, new_list)
+	old_middle = [JSONL_ENCODER.encode(el) for el in old_list[prefix:len(old_list) - suffix]]
+	new_middle = [JSONL_ENCODER.encode(el) for el in new_list[prefix:len(new_list) - suffix]]
+	align = anchor_sequences if max(len(old_middle), len(new_middle)) > HISTORY_ALIGN_EVENTS else match_sequences
+	matches = [(prefix + i, prefix + j, 1) for i, j in align(old_middle, new_middle)]
+	# the common start and end are copied at once
+	matches = [(0, 0, prefix)] + matches + [(len(old_list) - suffix, len(new_list) - suffix, suffix)]
+
+	delta = []
+	j = 0
+	for old_index, new_index, length in matches:
+		if not length:
+			continue
+		if new_index > j:
+			delta.append(["insert", new_list[j:new_index]])
+		if delta and delta[-1][0] == "copy" and delta[-1][1] + delta[-1][2] == old_index and new_index == j:
+			delta[-1][2] += length
+		else:
+			delta.append(["copy", old_index, length])
+		j = new_index + length
+	if j < len(new_list):
+		delta.append(["insert", new_list[j:]])
+	return delta
+
+def anchor_sequences(a, b):
+	"""
+	Align two sequences by their elements that occur once in each.
+
+	Of the unique elements of both sequences, the longest run that is
+	in the same order in both is matched (like patience diff). Other
+	elements are not matched, so the alignment may not be the longest
+	one.
+
+	Args:
+		a: The first sequence of hashable elements.
+		b: The second sequence of hashable elements.
+
+	Return:
+		matches: The ascending list of (index in a, index in b) pairs
+			of equal elements.
+	"""
+	counts = {}
+	for el in a:
+		counts[el] = counts.get(el, 0) + 1
+	positions = {el: i for i, el in enumerate(a) if counts[el] == 1}
+	for el in b:
+		counts[el] = counts.get(el, 0) + 2
+	pairs = [(positions[el], j) for j, el in enumerate(b) if counts[el] == 3]
+
+	# the longest increasing run of positions in a (patience sorting)
+	tails = []
+	tail_pairs = []
+	previous = []
+	for k, (i, j) in enumerate(pairs):
+		pile = bisect.bisect_left(tails, i)
+		previous.append(tail_pairs[pile - 1] if pile else None)
+		if pile == len(tails):
+			tails.append(i)
+			tail_pairs.append(k)
+		else:
+			tails[pile] = i
+			tail_pairs[pile] = k
+	matches = []
+	k = tail_pairs[-1] if tail_pairs else None
+	while k is not None:
+		matches.append(pairs[k])
+		k = previous[k]
+	return matches[::-1]
+
+def apply_delta(old_list, delta):
+	"""
+	Apply the operations of a delta to a version of a story.
+
+	Args:
+		old_list: The list of dictionaries that represent story threads.
+		delta: The operations (see story_delta).
+
+	Raises:
+		ValueError: If the delta copies events that the version does not
+			have, i.e. it was found for another version.
+
+	Return:
+		new_list: The new list of dictionaries that represent story
+			threads.
+	"""
+	new_list = []
+	for operation in delta:
+		if operation[0] == "copy":
+			if operation[1] + operation[2] > len(old_list):
+				raise ValueError(f"The history of the story is broken: an operation copies the events {operation[1]} to {operation[1] + operation[2] - 1} of a version with {len(old_list)} events")
+			new_list.extend(old_list[operation[1]:operation[1] + operation[2]])
+		else:
+			new_list.extend(operation[1])
+	return new_list
+
+def record_history(story, path, previous_list, thread_list, operation):
+	"""
+	Add an operation to the history of a story.
+
+	Every HISTORY_SNAPSHOT_INTERVAL operations, the whole story is
+	stored (see store_snapshot), otherwise only the delta to the
+	previous version (see story_delta). The first operation on a story
+	without history also stores the previous version as operation 0.
+	The head of the history keeps the fingerprint of the story file
+	after the last operation (see store_history_head). If the story
+	file is not that version anymore (e.g. because it was edited by
+	hand), the delta would apply to another version than the recorded
+	one, so the whole story is stored instead.
+
+	Args:
+		story: The name of the story that corresponds to the file name.
+		path: The path to the story file.
+		previous_list: The list of dictionaries that represent the
+			story threads before the operation.
+		thread_list: The list of dictionaries that represent the story
+			threads after the operation.
+		operation: The name of the operation (e.g. "add").
+
+	Return:
+		head: The head of the history to store along with the
+			fingerprint of the stored story (see store_history_head),
+			with the fingerprint of the story file before the operation
+			if it is the recorded version (else None).
+	"""
+	history = history_path(story, path)
+	history.mkdir(parents=True, exist_ok=True)
+	head = retrieve_history_head(story, path)
+	entries = []
+	if head is None:
+		head = {"n": 0, "since_snapshot": 0, "story": None}
+		entries.append({"n": 0, "time": time.time(), "operation": "initial", "size": len(previous_list), "snapshot": store_snapshot(history, previous_list)})
+		recorded = True
+	else:
+		version_file = story_version_file(story, path)
+		try:
+			recorded = fingerprint_matches(version_file, version_file.stat(), head.get("story"))
+		except FileNotFoundError:
+			recorded = False
+	head["n"] += 1
+	head["since_snapshot"] += 1
+	entry = {"n": head["n"], "time": time.time(), "operation": operation, "size": len(thread_list)}
+	if head["since_snapshot"] >= HISTORY_SNAPSHOT_INTERVAL or not recorded:
+		entry["snapshot"] = store_snapshot(history, thread_list)
+		head["since_snapshot"] = 0
+	else:
+		entry["delta"] = story_delta(previous_list, thread_list)
+	entries.append(entry)
+	with open(Path(history, "log.jsonl"), "ab") as f:
+		f.write(encode_jsonl(entries))
+	# until the story is stored, the story file is not the recorded
+	# version
+	previous = head["story"] if recorded else None
+	head["story"] = None
+	store_history_head(story, path, head)
+	head["story"] = previous
+	return head
+
+def retrieve_history_head(story, path):
+	"""
+	Load the head of the history of a story (see store_history_head).
+
+	Args:
+		story: The name of the story that corresponds to the file name.
+		path: The path to the story file.
+
+	Return:
+		head: The head of the history or None if there is no history.
+	"""
+	try:
+		with open(Path(history_path(story, path), "head.json"), "r") as f:
+			return json.load(f)
+	except (FileNotFoundError, json.decoder.JSONDecodeError):
+		return None
+
+def history_version(story, path):
+	"""
+	Identify the stored version of a story by its history.
+
+	Args:
+		story: The name of the story that corresponds to the file name.
+		path: The path to the story file.
+
+	Return:
+		n: The number of the last operation of the history if the story
+			file is the version after it (see record_history), else None
+			(e.g. if the story file was edited by hand since).
+	"""
+	head = retrieve_history_head(story, path)
+	if head is None:
+		return None
+	version_file = story_version_file(story, path)
+	written = fingerprint_written(head.get("story"))
+	try:
+		if fingerprint_matches(version_file, version_file.stat(), head.get("story")):
+			if fingerprint_written(head["story"]) != written:
+				store_history_head(story, path, head)
+			return head["n"]
+	except FileNotFoundError:
+		pass
+	return None
+
+def store_history_head(story, path, head):
+	"""
+	Store the head of the history of a story.
+
+	Args:
+		story: The name of the story that corresponds to the file name.
+		path: The path to the story file.
+		head: A dictionary with the number of the last operation ("n"),
+			the number of operations since the last snapshot
+			("since_snapshot") and the fingerprint of the story file
+			after the last operation ("story", see story_fingerprint) or
+			None if it is not known.
+	"""
+	with open(Path(history_path(story, path), "head.json"), "w") as f:
+		json.dump(head, f)
+
+def retrieve_history(story, path):
+	"""
+	Load the log of the operations on a story.
+
+	Args:
+		story: The name of the story that corresponds to the file name.
+		path: The path to the story file.
+
+	Return:
+		entries: The list of operations as dictionaries with their
+			number ("n"), unix time ("time"), name ("operation"), the
+			number of events after it ("size") and either a "snapshot"
+			or a "delta".
+	"""
+	try:
+		with open(Path(history_path(story, path), "log.jsonl"), "rb") as f:
+			return parse_story(f.read(), jsonl=True)
+	except FileNotFoundError:
+		return []
+
+def history_storythreads(story, path, at):
+	"""
+	Rebuild the story threads as they were after an operation.
+
+	The story is loaded from the nearest snapshot before the operation
+	and the deltas after it are applied.
+
+	Args:
+		story: The name of the story that corresponds to the file name.
+		path: The path to the story file.
+		at: The number of the operation, counted back from the last one
+			if negative, or a datetime for the last operation at or
+			before it.
+
+	Raises:
+		ValueError: If there is no such operation.
+
+	Return:
+		thread_list: The list of dictionaries that represent story
+			threads.
+	"""
+	entries = retrieve_history(story, path)
+	if isinstance(at, datetime.datetime):
+		timestamp = at.timestamp()
+		target = max((i for i, entry in enumerate(entries) if entry["time"] <= timestamp), default=None)
+	else:
+		number = entries[-1]["n"] + at if entries and at < 0 else at
+		target = next((i for i, entry in enumerate(entries) if entry["n"] == number), None)
+	if target is None:
+		raise ValueError("There is no such operation in the history of the story")
+	start = target
+	while "snapshot" not in entries[start]:
+		start -= 1
+	history = history_path(story, path)
+	thread_list = retrieve_snapshot(history, entries[start]["snapshot"])
+	for entry in entries[start + 1:target + 1]:
+		thread_list = retrieve_snapshot(history, entry["snapshot"]) if "snapshot" in entry else apply_delta(thread_list, entry["delta"])
+	return thread_list
+
+def parse_history_point(text):
+	"""
+	Parse an operation number or a time (see history_storythreads).
+
+	Args:
+		text: An integer or an ISO time like 2024-05-01T12:00.
+
+	Raises:
+		ValueError: If the text is neither.
+
+	Return:
+		at: The operation number or the datetime.
+	"""
+	try:
+		return int(text)
+	except ValueError:
+		return datetime.datetime.fromisoformat(text)
+
+def show_history(args):
+	"""
+	Show the operations on a story.
+
+	Args:
+		args: The arguments passed to the program by the user.
+
+	Return:
+		entries: The list of operations (see retrieve_history).
+	"""
+	entries = retrieve_history(args.story, args.path)
+	if not entries:
+		print("There is no history of this story yet.")
+		return entries
+	spacing = len(str(entries[-1]["n"]))
+	for entry in entries:
+		when = datetime.datetime.fromtimestamp(entry["time"]).isoformat(sep=" ", timespec="seconds")
+		print(f"{(spacing - len(str(entry['n']))) * ' '}{entry['n']} {when} {entry['operation']} ({entry['size']} events)")
+	return entries
+
+
+### search threads ###
+
+def text_trigrams(text):
+	"""
+	Split a text into its lower case trigrams.
+
+	Args:
+		text: The text to split.
+
+	Return:
+		trigrams: The set of all three character substrings of the
+			text.
+	"""
+	text = text.lower()
+	return {text[i:i+3] for i in range(len(text) - 2)}
+
+def texts_of_event(event):
+	"""
+	Get the searchable texts of an event.
+
+	Args:
+		event: The dictionary that represents the story thread event.
+
+	Return:
+		texts: The set of the thread name and the event description.
+	"""
+	name = next(iter(event.keys()))
+	return {name, event[name].get("description", "")}
+
+# the keys of the search index besides the texts and their positions
+SEARCH_INDEX_KEYS = ("intervals", "open", "chapters", "tags")
+
+def build_search_index(thread_list, search_index=None, first=0):
+	"""
+	Build the search index over the thread names and descriptions.
+
+	The index contains every distinct text of the story once, the
+	texts that contain each trigram and the positions at which each
+	text is used as thread name (even positions) or description (odd
+	positions). So it also indexes the events of every thread, and an
+	interval tree of the threads tells which threads are open at an
+	event (see build_interval_tree). The positions of the events of
+	every chapter and tag are indexed as well (see metadata_positions),
+	and the threads that are still open at the end of the story.
+	If a previous index is given, it
+	is updated: only the trigrams of new texts are added and those of
+	texts that are not used anymore are removed. If the previous index
+	is of the events before the first new event, only the new events
+	are added to it.
+
+	Args:
+		thread_list: The list of dictionaries that represent story
+			threads.
+		search_index: A previous search index of the story to update.
+			The default is to build a new one (None).
+		first: The index of the first event that is not in the previous
+			index if the events before it did not change. The default is
+			to index all events (0).
+
+	Return:
+		search_index: The search index of the story.
+	"""
+	if search_index is None or not first and search_index["texts"].count(None) > len(search_index["texts"]) // 2:
+		search_index = {"size": 0, "texts": [], "trigrams": {}, "hits": []}
+	texts = search_index["texts"]
+	trigrams = search_index["trigrams"]
+	text_ids = {text: i for i, text in enumerate(texts) if text is not None}
+	if first:
+		hits = search_index["hits"]
+		# the spans of the threads in the order of their openings
+		spans = {span[2]: span for span in sorted(interval_tree_intervals(search_index["intervals"]))}
+		chapters = search_index["chapters"]
+		tags = search_index["tags"]
+		open_before = set(search_index["open"])
+	else:
+		hits = [[] for _ in texts]
+		spans = {}
+		chapters = {}
+		tags = {}
+	# the threads with events from the first event
+	changed = set()
+
+	def text_id(text):
+		if text not in text_ids:
+			text_ids[text] = len(texts)
+			texts.append(text)
+			hits.append([])
+			for trigram in text_trigrams(text):
+				trigrams.setdefault(trigram, []).append(text_ids[text])
+		return text_ids[text]
+
+	for i in range(first, len(thread_list)):
+		el = thread_list[i]
+		name = next(iter(el.keys()))
+		event = el[name]
+		changed.add(name)
+		hits[text_id(name)].append(2*i)
+		hits[text_id(event.get("description", ""))].append(2*i + 1)
+		if name in spans:
+			spans[name][1] = i
+		else:
+			spans[name] = [i, i, name]
+		if "chapter" in event:
+			chapters.setdefault(str(event["chapter"]), []).append(i)
+		for tag in event.get("tags", ()):
+			tags.setdefault(tag, []).append(i)
+
+	# forget the texts that are not used anymore
+	for i, text in enumerate(texts if not first else ()):
+		if text is not None and not hits[i]:
+			for trigram in text_trigrams(text):
+				trigrams[trigram].remove(i)
+				if not trigrams[trigram]:
+					del trigrams[trigram]
+			texts[i] = None
+	search_index["size"] = len(thread_list)
+	search_index["hits"] = hits
+	# the version of the story file is set when the index is stored
+	search_index.pop("story", None)
+
+	# the events from the opening to the closing of every thread (or to
+	# the end of the story if it stays open)
+	open_threads = []
+	for span in spans.values():
+		if span[2] in changed and thread_list[span[1]][span[2]]["event"] != EVENT.CLOSING or span[2] not in changed and span[2] in open_before:
+			span[1] = len(thread_list) - 1
+			open_threads.append(span[2])
+	search_index["intervals"] = build_interval_tree(list(spans.values()))
+	search_index["open"] = open_threads
+	search_index["chapters"] = chapters
+	search_index["tags"] = tags
+	return search_index
+
+def build_interval_tree(intervals):
+	"""
+	Build a centered interval tree.
+
+	Every node holds the intervals that contain its center, sorted by
+	their first and by their last position, and the trees of the
+	intervals left and right of the center. So the intervals that
+	contain a position are found in O(log n + number of intervals)
+	(see stab_interval_tree).
+
+	Args:
+		intervals: A list of [first, last, name] lists.
+
+	Return:
+		tree: The root node as [center, by first, by last (descending),
+			left tree, right tree] list or None if there are no
+			intervals.
+	"""
+	if not intervals:
+		return None
+	# the median of the bounds lies in at least one interval
+	center = sorted(bound for interval in intervals for bound in interval[:2])[len(intervals)]
+	left = [interval for interval in intervals if interval[1] < center]
+	right = [interval for interval in intervals if interval[0] > center]
+	here = [interval for interval in intervals if interval[0] <= center <= interval[1]]
+	return [center, sorted(here), sorted(here, key=lambda interval: -interval[1]), build_interval_tree(left), build_interval_tree(right)]
+
+def interval_tree_intervals(tree):
+	"""
+	List the intervals of an interval tree.
+
+	Args:
+		tree: The interval tree (see build_interval_tree).
+
+	Return:
+		intervals: The list of [first, last, name] lists.
+	"""
+	intervals = []
+	nodes = [tree]
+	while nodes:
+		node = nodes.pop()
+		if node is not None:
+			intervals.extend(node[1])
+			nodes.extend(node[3:])
+	return intervals
+
+def stab_interval_tree(tree, position):
+	"""
+	Find the intervals of an interval tree that contain a position.
+
+	Args:
+		tree: The interval tree (see build_interval_tree).
+		position: The position to look up.
+
+	Yield:
+		name: The name of the next interval that contains the position.
+	"""
+	while tree is not None:
+		center, by_first, by_last, left, right = tree
+		if position < center:
+			for first, last, name in by_first:
+				if first > position:
+					break
+				yield name
+			tree = left
+		elif position > center:
+			for first, last, name in by_last:
+				if last < position:
+					break
+				yield name
+			tree = right
+		else:
+			for first, last, name in by_first:
+				yield name
+			return
+
+def read_search_index(story, path):
+	"""
+	Load the search index of a story from its hidden index file as it
+	was stored, even if the story changed since.
+
+	Args:
+		story: The name of the story that corresponds to the json file
+			name.
+		path: The path to the json file.
+
+	Return:
+		search_index: The stored search index of the story or None if
+			there is no index.
+	"""
+	try:
+		with open(Path(path, f".{story}.index.json"), "r") as f:
+			return json.load(f)
+	except (FileNotFoundError, json.decoder.JSONDecodeError):
+		return None
+
+def retrieve_search_index(story, path, thread_list=None):
+	"""
+	Load the search index of a story from its hidden index file.
+
+	Like the parsed story cache, the index is keyed on the version of
+	the story file it was built for (see fingerprint_matches). If the
+	story file changed since (e.g. because it was edited by hand), the
+	index is updated from the story threads (see build_search_index)
+	and stored again. If events were only appended to a jsonl file
+	since (see fingerprint_extends), only they are added to the index.
+
+	Args:
+		story: The name of the story that corresponds to the json file
+			name.
+		path: The path to the json file.
+		thread_list: The list of dictionaries that represent story
+			threads. The default is to load them if the index has to be
+			updated (None).
+
+	Return:
+		search_index: The search index of the story.
+	"""
+	search_index = read_search_index(story, path)
+	version_file = story_version_file(story, path)
+	try:
+		stat = version_file.stat()
+	except FileNotFoundError:
+		stat = None
+	# the first event that is not in the index
+	first = 0
+	if search_index is not None and stat is not None and all(key in search_index for key in SEARCH_INDEX_KEYS):
+		written = fingerprint_written(search_index.get("story"))
+		if fingerprint_matches(version_file, stat, search_index.get("story")):
+			if fingerprint_written(search_index["story"]) != written:
+				try:
+					store_search_index(story, path, search_index)
+				except OSError:
+					# the refreshed fingerprint only saves hashing the
+					# story file next time
+					pass
+			return search_index
+		if version_file.suffix == ".jsonl" and fingerprint_extends(version_file, stat, search_index.get("story")):
+			first = search_index["size"]
+	if thread_list is None:
+		thread_list = retrieve_storythreads(story, path)
+	search_index = build_search_index(thread_list, search_index, first if first <= len(thread_list) else 0)
+	if stat is not None:
+		search_index["story"] = file_fingerprint(version_file, stat)
+		try:
+			store_search_index(story, path, search_index)
+		except OSError:
+			# the index is optional, e.g. for read only story paths
+			pass
+	return search_index
+
+def store_search_index(story, path, search_index):
+	"""
+	Store the search index of a story as a hidden json file.
+
+	Args:
+		story: The name of the story that corresponds to the json file
+			name.
+		path: The path to the json file.
+		search_index: The search index of the story.
+	"""
+	with open(Path(path, f".{story}.index.json"), "w") as f:
+		f.write(json.dumps(search_index, ensure_ascii=False, separators=(",", ":")))
+
+def matching_texts(search_index, query):
+	"""
+	Find the texts of the search index that contain a query.
+
+	The candidate texts are those that contain all trigrams of the
+	query.
+
+	Args:
+		search_index: The search index of the story.
+		query: The (case insensitive) text to search for.
+
+	Return:
+		matches: The ids of the matching texts.
+	"""
+	texts = search_index["texts"]
+	query = query.lower()
+	query_trigrams = text_trigrams(query)
+	if query_trigrams:
+		# start with the rarest trigram and stop narrowing down the
+		# candidates once they are cheaper to check directly
+		postings = sorted((search_index["trigrams"].get(trigram, []) for trigram in query_trigrams), key=len)
+		candidates = set(postings[0])
+		for posting in postings[1:]:
+			if len(candidates) <= 64:
+				break
+			candidates.intersection_update(posting)
+	else:
+		candidates = range(len(texts))
+	return [i for i in candidates if texts[i] is not None and query in texts[i].lower()]
+
+def search_events(thread_list, search_index, query, descriptions_only=False, fuzzy=False):
+	"""
+	Find the events whose thread name or description contains a query.
+
+	The candidate texts are those that contain all trigrams of the
+	query. If the search is fuzzy and no text contains the query, the
+	texts that share at least a third of their trigrams with the query
+	are matched instead.
+
+	Args:
+		thread_list: The list of dictionaries that represent story
+			threads.
+		search_index: The search index of the story.
+		query: The (case insensitive) text to search for.
+		descriptions_only (Boolean): A flag to only search the event
+			descriptions. The default is to also search the thread
+			names (False).
+		fuzzy (Boolean): A flag to allow similar texts if no text
+			contains the query. The default is to only allow exact
+			matches (False).
+
+	Return:
+		positions: The ascending list indices of the matching events.
+	"""
+	texts = search_index["texts"]
+	query = query.lower()
+	query_trigrams = text_trigrams(query)
+	matches = matching_texts(search_index, query)
+
+	if not matches and fuzzy and query_trigrams:
+		shared = {}
+		for trigram in query_trigrams:
+			for i in search_index["trigrams"].get(trigram, ()):
+				shared[i] = shared.get(i, 0) + 1
+		for i, count in shared.items():
+			if count / (len(query_trigrams) + len(text_trigrams(texts[i])) - count) >= 1/3:
+				matches.append(i)
+
+	positions = set()
+	for i in matches:
+		for hit in search_index["hits"][i]:
+			if hit % 2 or not descriptions_only:
+				positions.add(hit // 2)
+	# skip the hits of an outdated index
+	matched_texts = {texts[i] for i in matches}
+	return [i for i in sorted(positions) if i < len(thread_list) and not texts_of_event(thread_list[i]).isdisjoint(matched_texts)]
+
+def metadata_positions(thread_list, search_index, chapter=None, tags=()):
+	"""
+	Find the events of a chapter and/or with tags.
+
+	The events are looked up in the chapter and tag indexes of the
+	search index. An index that does not fit the story is built again.
+
+	Args:
+		thread_list: The list of dictionaries that represent story
+			threads.
+		search_index: The search index of the story.
+		chapter: The chapter of the events. The default is any chapter
+			(None).
+		tags: The tags that the events must all have. The default is
+			any tags (()).
+
+	Return:
+		positions: The ascending list indices of the events or None if
+			neither a chapter nor tags are given.
+	"""
+	def lookup(search_index):
+		candidates = []
+		if chapter is not None:
+			candidates.append(search_index["chapters"].get(str(chapter), []))
+		for tag in tags:
+			candidates.append(search_index["tags"].get(tag, []))
+		if not candidates:
+			return None
+		candidates.sort(key=len)
+		positions = set(candidates[0])
+		for candidate in candidates[1:]:
+			positions.intersection_update(candidate)
+		return sorted(positions)
+
+	def fits(i):
+		event = next(iter(thread_list[i].values()))
+		return (chapter is None or event.get("chapter") == chapter) and set(tags).issubset(event.get("tags", ()))
+
+	positions = lookup(search_index)
+	if positions is None:
+		return None
+	if search_index["size"] != len(thread_list) or not all(i < len(thread_list) and fits(i) for i in positions):
+		# the index of another version of the story
+		positions = lookup(build_search_index(thread_list))
+	return [i for i in positions if fits(i)]
+
+def indexed_thread_positions(thread_list, search_index, thread_id):
+	"""
+	Look up the events of a thread in the search index.
+
+	Every position is checked against the story, so that the index of
+	another version of the story is noticed.
+
+	Args:
+		thread_list: The list of dictionaries that represent story
+			threads.
+		search_index: The search index of the story.
+		thread_id: The id/name of the thread.
+
+	Return:
+		positions: The ascending list indices of the events of the
+			thread (empty if there is no such thread) or None if the
+			index does not fit the story.
+	"""
+	texts = search_index["texts"]
+	for i in matching_texts(search_index, thread_id):
+		if texts[i] == thread_id:
+			positions = [hit // 2 for hit in search_index["hits"][i] if hit % 2 == 0]
+			if all(position < len(thread_list) and thread_id in thread_list[position] for position in positions):
+				return positions
+			return None
+	return []
+
+def resolve_descriptions(thread_list, search_index, thread_ids, descriptions):
+	"""
+	Complete partial descriptions of developments of the given threads.
+
+	Indices and descriptions that match a development of the threads
+	are kept as they are. Any other description is looked up in the
+	search index and replaced by the description of the only
+	development of the threads that contains it.
+
+	Args:
+		thread_list: The list of dictionaries that represent story
+			threads.
+		search_index: A function that returns the search index of the
+			story. It is only called if a description is looked up.
+		thread_ids: The ids/names of the threads whose developments
+			are matched.
+		descriptions: The indices and (partial) descriptions to
+			resolve.
+
+	Return:
+		resolved: The indices and completed descriptions.
+
+	Raises:
+		ValueError: If a partial description matches several
+			developments of the threads.
+	"""
+	resolved = []
+	for description in descriptions:
+		try:
+			int(description)
+		except ValueError:
+			matches = []
+			for i in search_events(thread_list, search_index(), description, descriptions_only=True):
+				name = next(iter(thread_list[i].keys()))
+				if name in thread_ids and thread_list[i][name]["event"] == EVENT.DEVELOPMENT:
+					matches.append(thread_list[i][name]["description"])
+			if len(matches) > 1 and description not in matches:
+				raise ValueError(f"The description '{description}' matches several developments: " + ", ".join(f"'{m}'" for m in matches))
+			if len(matches) == 1:
+				description = matches[0]
+		resolved.append(description)
+	return resolved
+
+def search_threads(args):
+	"""
+	Search the story for events by thread name or description.
+
+	Prints the matching events with their indices and metadata. The
+	events can also be found by their chapter and tags only.
+
+	Args:
+		args: The arguments passed to the program by the user.
+
+	Return:
+		positions: The sorted indices of the matching events.
+
+	Raises:
+		ValueError: If neither a query nor a chapter or tag is given.
+	"""
+	query = " ".join(args.query)
+	chapter = getattr(args, "chapter", None)
+	tags = getattr(args, "tag", None) or ()
+	if not query and chapter is None and not tags:
+		raise ValueError("You need to pass a query, a chapter or a tag to search for")
+	threads = StoryThreads(args.story, FileStore(args.story, args.path))
+	events = threads.query(query, args.fuzzy, chapter, tags)
+	if not events:
+		print("No story thread event matches the search.")
+		return
+	spacing = len(str(events[-1][0]))
+	for i, name, event, description in events:
+		print(f"{(spacing - len(str(i))) * ' '}{i} {name} ({event}): {description}" + format_metadata(threads.thread_list[i][name]))
+	return [event[0] for event in events]
+
+def format_metadata(event):
+	"""
+	Describe the metadata of a story thread event.
+
+	Args:
+		event: The dictionary of the event type and description (the
+			value of an entry of the thread list).
+
+	Return:
+		text: The metadata in brackets, e.g. " [chapter 3, offset 1200,
+			#pov-anna]", or "" if the event has none.
+	"""
+	parts = []
+	if "chapter" in event:
+		parts.append(f"chapter {event['chapter']}")
+	if "offset" in event:
+		parts.append(f"offset {event['offset']}")
+	parts.extend(f"#{tag}" for tag in event.get("tags", ()))
+	return f" [{', '.join(parts)}]" if parts else ""
+
+
+### display threads ###
+
+class STATE(str, Enum):
+	"""
+	Define the elements of the story thread representation.
+	"""
+	OPEN = "│  "
+	OPENING = "├─ "
+	CLOSING = "┘  "
+	CLOSED = "   "
+	CLOSINGNEIGHBOR = "───"
+	OPENINGNEIGHBOR = "── "
+	MERGENEIGHBOR = "├──"
+	NOTCLOSED = "┊  "
+#└─
+#─┤
+
+# the terminal control sequences (like bold text) that take no space
+ANSI_SEQUENCE = re.compile("\033\\[[0-9;]*[A-Za-z]")
+
+class ThreadGrid:
+	"""
+	Lay out a story's threads as a grid of rows and columns.
+
+	The main thread is the first column and every thread gets its own
+	column from its first event on, in the order in which the threads
+	start. A column is kept after its thread closed. Every event is a
+	row, which the writers of the text (see render_threads), HTML (see
+	write_html) and SVG (see write_svg) representations turn into their
+	output.
+	The cells of the columns that are open (│) or closed (blank) are
+	kept as one string. The cells of a row are pieces of it or runs of
+	the same cell (see slice_pieces), so a row costs O(1) string
+	operations instead of one per column, and only the part of a row
+	that is shown is ever put together.
+
+	Args:
+		thread_list: The list of dictionaries that represent story
+			threads.
+		show_connections (Boolean): A flag to show all connections to
+			the main story thread. The default is to only show the
+			connection to the nearest thread (False).
+		size: The number of events. The default is the length of the
+			thread list (None).
+		closed_threads: The set of threads whose last event closes
+			them. The default is to find them in the thread list (None).
+		positions: The indices of the events in the story, e.g. if only
+			the events of some threads are laid out. The default is
+			their index in the thread list (None).
+		window: The first and the last column of the threads to show
+			(counted from 1, the last may be None for all columns up to
+			the end). The default is to show all columns (None).
+
+	Attributes:
+		size: The number of events.
+		window: The columns to show.
+		columns: The thread of every column (None if it closed) after
+			the rows that have been laid out.
+		threads: The number of threads in the rows that have been laid
+			out.
+	"""
+	def __init__(self, thread_list, show_connections=False, size=None, closed_threads=None, positions=None, window=None):
+		if size is None:
+			size = len(thread_list)
+		if closed_threads is None:
+			# the threads whose last event closes them
+			closed_threads = set()
+			for el in thread_list:
+				name = next(iter(el.keys()))
+				if el[name]["event"] == EVENT.CLOSING:
+					closed_threads.add(name)
+				else:
+					closed_threads.discard(name)
+		self.thread_list = thread_list
+		self.show_connections = show_connections
+		self.size = size
+		self.closed_threads = closed_threads
+		self.positions = positions
+		self.window = window
+		self.columns = []
+		self.threads = 0
+
+	def rows(self):
+		"""
+		Lay out the events one after the other.
+
+		Yield:
+			row: A dictionary with
+				- "index": the index of the event in the story
+				- "name", "event" and "description" of the event
+				- "column": the column of the thread of the event (the
+				  main thread is column 0)
+				- "join": the column of the thread the event is connected
+				  to or None if it is not connected (a development)
+				- "main": the cell of the main thread
+				- "left": the cells of the columns between the main
+				  thread and the thread as pieces (see slice_pieces)
+				- "cells": the open and closed cells of all columns (the
+				  cells right of the thread follow its description)
+				- "bold" (Boolean): a flag to highlight the thread name
+				  of an opening of a thread that stays open
+			Every cell is three characters wide.
+		"""
+		width = len(STATE.OPEN)
+		columns = self.columns
+		column_of = {}
+		thread_ids = set()
+		# the columns whose connections are put together
+		first_column, last_column = (0, sys.maxsize) if self.window is None else (self.window[0] - 1, self.window[1] or sys.maxsize)
+		# the open and closed cells of all columns
+		cells = ""
+		for t, current_thread in enumerate(self.thread_list):
+			name = next(iter(current_thread.keys()))
+			event = current_thread[name]["event"]
+			description = current_thread[name]["description"]
+			if name not in thread_ids:
+				thread_ids.add(name)
+				self.threads = len(thread_ids)
+			# add an opening thread to the columns of open threads
+			if name not in column_of:
+				column_of[name] = len(columns)
+				columns.append(name)
+				cells += STATE.OPEN
+			c = column_of[name]
+			opening = event == EVENT.OPENING
+			closing = event == EVENT.CLOSING
+
+			# connect the event to the nearest open thread on the left
+			# (or to all of them) or the main thread
+			join = None
+			if opening or closing:
+				if self.show_connections:
+					# only the connections in the window are put together
+					low = min(first_column, c)
+					high = max(low, min(last_column, c))
+					connected = []
+					for j in range(high - 1, low - 1, -1):
+						if columns[j] is None:
+							connected.append(STATE.OPENINGNEIGHBOR if opening and j == c - 1 else STATE.CLOSINGNEIGHBOR)
+						elif opening and columns[j+1] is not None:
+							connected.append(STATE.OPENING)
+						else:
+							connected.append(STATE.MERGENEIGHBOR)
+					join = -1
+					left = [(" ", 0, low * width), ("".join(reversed(connected)), 0, (high - low) * width), (" ", 0, (c - high) * width)]
+				else:
+					join = cells.rfind(STATE.OPEN, 0, c * width) // width
+					k = join + 1
+					left = []
+					if join >= 0:
+						if opening and columns[k] is not None:
+							connector = STATE.OPENING
+						else:
+							connector = STATE.MERGENEIGHBOR
+						left = [(cells, 0, join * width), (connector, 0, width)]
+					if opening and k < c:
+						left += [(STATE.CLOSINGNEIGHBOR, 0, (c - 1 - k) * width), (STATE.OPENINGNEIGHBOR, 0, width)]
+					else:
+						left.append((STATE.CLOSINGNEIGHBOR, 0, (c - k) * width))
+				# the main thread
+				main = STATE.MERGENEIGHBOR if join < 0 else STATE.OPEN
+				join += 1
+			else:
+				main = STATE.OPEN
+				left = [(cells, 0, c * width)]
+
+			yield {
+				"index": t if self.positions is None else self.positions[t],
+				"name": name,
+				"event": event,
+				"description": description,
+				"column": c + 1,
+				"join": join,
+				"main": main,
+				"left": left,
+				"cells": cells,
+				"bold": opening and name != description and name not in self.closed_threads,
+			}
+
+			# remove a closing thread from the columns of open threads
+			if closing:
+				columns[c] = None
+				del column_of[name]
+				cells = cells[:c * width] + STATE.CLOSED + cells[(c + 1) * width:]
+
+	def count_columns(self):
+		"""
+		Count the columns of the threads without laying them out.
+
+		Return:
+			count: The number of columns (without the main thread).
+		"""
+		count = 0
+		open_threads = set()
+		for el in self.thread_list:
+			name = next(iter(el.keys()))
+			if name not in open_threads:
+				open_threads.add(name)
+				count += 1
+			if el[name]["event"] == EVENT.CLOSING:
+				open_threads.discard(name)
+		return count
+
+def slice_pieces(pieces, start, stop):
+	"""
+	Put together a part of a line that is given as pieces.
+
+	Only the characters of the part are copied, however long the line
+	is.
+
+	Args:
+		pieces: A list of (text, offset, length) tuples. A piece is the
+			text from the offset on, repeated as long as needed to fill
+			its length (e.g. a run of the same cell).
+		start: The index of the first character of the part in the
+			line.
+		stop: The index after the last character of the part.
+
+	Return:
+		text: The part of the line.
+	"""
+	parts = []
+	for text, offset, length in pieces:
+		if stop <= 0:
+			break
+		if start < length:
+			first = max(start, 0) + offset
+			last = min(stop, length) + offset
+			if last > len(text):
+				first, last = first % len(text), first % len(text) + last - first
+				text = text * (last // len(text) + 1)
+			parts.append(text[first:last])
+		start -= length
+		stop -= length
+	return "".join(parts)
+
+def event_text(row):
+	"""
+	Build the text of a row of a thread grid from the thread on.
+
+	The description of an event is written over the cells on its right
+	if it does not fit in its cell. The thread name of an opening is
+	highlighted (see ThreadGrid.rows) by the writer.
+
+	Args:
+		row: The row (see ThreadGrid.rows).
+
+	Return:
+		name: The thread name of an opening that is shown in front of
+			its description or "".
+		text: The text of the event.
+		rest: The index of the first cell character (see
+			ThreadGrid.rows) that follows the text or None if no cell
+			follows it.
+	"""
+	description = row["description"]
+	right = row["column"] * len(STATE.OPEN)
+	if row["event"] == EVENT.OPENING:
+		if row["name"] != description:
+			return row["name"], ": " + description, right
+		return "", description, right
+	current_state = STATE.OPEN if row["event"] == EVENT.DEVELOPMENT else STATE.CLOSING
+	desc_len = len(description) + 1
+	if desc_len <= len(current_state):
+		return "", current_state, right
+	elif desc_len >= len(row["cells"]) - right:
+		return "", f"{current_state[0]}{description}", None
+	return "", f"{current_state[0]}{description}", right + desc_len
+
+def grid_lines(story, grid, width=None, fold=False):
+	"""
+	Build the text lines of a thread grid.
+
+	Only the columns of the window of the grid are shown. If a width
+	is given, the lines are cut to it, or folded onto as many lines as
+	needed. A cut line is put together from the visible part of its
+	pieces only, so it costs as much as the width and not as the
+	number of columns.
+
+	Args:
+		story: The name of the story.
+		grid: The ThreadGrid of the story.
+		width: The number of characters of a line. The default is no
+			limit (None).
+		fold (Boolean): A flag to continue the lines that are wider than
+			the width on the next lines instead of cutting them. The
+			default is False.
+
+	Yield:
+		line: A tuple of the text in front of the highlighted thread
+			name, the highlighted thread name (or "") and the text
+			behind it.
+	"""
+	if grid.size == 0:
+		yield "There is no story thread to show yet.", "", ""
+		return
+	spacing = len(str((grid.size if not grid.positions else grid.positions[-1] + 1)*2)) # max length of line numbers
+	cell = len(STATE.OPEN)
+	start = 0 if grid.window is None else (grid.window[0] - 1) * cell
+	stop = sys.maxsize if grid.window is None or grid.window[1] is None else grid.window[1] * cell
+
+	# the parts of a line of the given length that are shown
+	available = sys.maxsize if width is None else max(width - spacing - 1 - cell, 1)
+
+	def segments(length):
+		end = min(stop, length)
+		if not fold:
+			return [(start, min(end, start + available))]
+		return [(first, min(end, first + available)) for first in range(start, max(end, start + 1), available)]
+
+	for line in [f"{(spacing) * ' '} {story}", f"{(spacing) * ' '} │"]:
+		yield line if width is None or fold else line[:width], "", ""
+	continued = (spacing + 1) * " " + STATE.OPEN
+	for row in grid.rows():
+		name, text, rest = event_text(row)
+		cells = row["cells"]
+		prefix = f"{(spacing - len(str(row['index']))) * ' '}{row['index']} " + row["main"]
+		left = (row["column"] - 1) * cell
+		after = [(text, 0, len(text))]
+		if rest is not None:
+			after.append((cells, rest, len(cells) - rest))
+		length = left + len(name) + len(text) + (len(cells) - rest if rest is not None else 0)
+		for n, (first, last) in enumerate(segments(length)):
+			before = (prefix if n == 0 else continued) + slice_pieces(row["left"], first, last)
+			highlighted = name[max(first - left, 0):max(last - left, 0)]
+			behind = slice_pieces(after, first - left - len(name), last - left - len(name))
+			if row["bold"] and highlighted:
+				yield before, highlighted, behind
+			else:
+				yield before + highlighted + behind, "", ""
+
+	# indicate open threads
+	prefix = f"{(spacing) * ' '} {STATE.NOTCLOSED}"
+	columns = grid.columns[start // cell:min(stop // cell, len(grid.columns))]
+	open_cells = "".join(STATE.NOTCLOSED if thread is not None else STATE.CLOSED for thread in columns)
+	for n, (first, last) in enumerate(segments(len(grid.columns) * cell)):
+		line = (prefix if n == 0 else (spacing + 1) * " " + STATE.NOTCLOSED) + open_cells[first - start:last - start]
+		yield line if width is None or fold else line[:width], "", ""
+
+	yield f"Number of threads: {grid.threads} + 1 (main thread)", "", ""
+	yield f"Number of open threads: {len(grid.columns) - grid.columns.count(None)} + 1 (main thread)", "", ""
+
+def render_threads(story, thread_list, show_connections=False, size=None, closed_threads=None, positions=None, window=None, width=None, fold=False):
+	"""
+	Render a story's threads line by line.
+
+	The lines are generated one after the other, so that they can be
+	printed before the whole story is rendered. If the number of events
+	and the closed threads are given (see scan_storythreads), the
+	events can be any iterable, e.g. an iter_storythreads generator.
+
+	Args:
+		story: The name of the story.
+		thread_list: The list of dictionaries that represent story
+			threads.
+		show_connections (Boolean): A flag to show all connections to
+			the main story thread. The default is to only show the
+			connection to the nearest thread (False).
+		size: The number of events. The default is the length of the
+			thread list (None).
+		closed_threads: The set of threads whose last event closes
+			them. The default is to find them in the thread list (None).
+		positions: The indices of the events in the story (see
+			ThreadGrid). The default is None.
+		window: The first and the last column of the threads to show
+			(see ThreadGrid). The default is all columns (None).
+		width: The number of characters of a line (see grid_lines). The
+			default is no limit (None).
+		fold (Boolean): A flag to fold the lines that are wider than the
+			width instead of cutting them. The default is False.
+
+	Yield:
+		line: The next line of the representation of the story threads
+			(without line break).
+	"""
+	if width is not None and not fold:
+		# the columns that fit into the width at most
+		first, last = window or (1, None)
+		fitting = first + width // len(STATE.OPEN)
+		window = (first, fitting if last is None else min(last, fitting))
+	grid = ThreadGrid(thread_list, show_connections, size, closed_threads, positions, window)
+	for before, name, after in grid_lines(story, grid, width, fold):
+		if name:
+			yield before + "\033[1m" + name + "\033[0m" + after
+		else:
+			yield before + after
+
+# the height of a row of the HTML representation in pixels
+HTML_ROW_HEIGHT = 18
+HTML_PAGE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>{title}</title>
+<style>
+body {{ margin: 0; font-family: monospace; }}
+#threads {{ position: relative; }}
+#rows {{ position: absolute; margin: 0; line-height: {row_height}px; font-size: 14px; }}
+</style>
+</head>
+<body>
+<div id="threads"><pre id="rows"></pre></div>
+<script>
+const rows = [
+"""
+# only the rows in view are put into the page, so that large stories do
+# not need a node per row
+HTML_SCRIPT = """];
+const rowHeight = {row_height};
+const threads = document.getElementById("threads");
+const view = document.getElementById("rows");
+threads.style.height = rows.length * rowHeight + "px";
+function escape(text) {{
+	return text.replace(/&/g, "&amp;").replace(/</g, "&lt;").replace(/>/g, "&gt;");
+}}
+function draw() {{
+	const first = Math.max(0, Math.floor(window.scrollY / rowHeight) - 20);
+	const last = Math.min(rows.length, first + Math.ceil(window.innerHeight / rowHeight) + 40);
+	let html = "";
+	for (let i = first; i < last; i++) {{
+		const row = rows[i];
+		html += escape(row[0]) + (row[1] ? "<b>" + escape(row[1]) + "</b>" : "") + escape(row[2]) + "\\n";
+	}}
+	view.style.top = first * rowHeight + "px";
+	view.innerHTML = html;
+}}
+window.addEventListener("scroll", draw);
+window.addEventListener("resize", draw);
+draw();
+</script>
+</body>
+</html>
+"""
+
+def write_html(story, grid, f):
+	"""
+	Write the HTML representation of a thread grid.
+
+	The page holds the lines of the text representation (see
+	grid_lines) as data and only shows the rows in view, so that it
+	can be opened for stories with many events. The lines are written
+	one after the other.
+
+	Args:
+		story: The name of the story.
+		grid: The ThreadGrid of the story.
+		f: The text file to write to.
+	"""
+	import html
+	f.write(HTML_PAGE.format(title=html.escape(story), row_height=HTML_ROW_HEIGHT))
+	for line in grid_lines(story, grid):
+		# the data must not end the script
+		f.write(JSONL_ENCODER.encode(line).replace("</", "<\\/") + ",\n")
+	f.write(HTML_SCRIPT.format(row_height=HTML_ROW_HEIGHT))
+
+# the size of a cell of the SVG representation in pixels
+SVG_CELL_WIDTH = 16
+SVG_CELL_HEIGHT = 20
+
+def write_svg(story, grid, f):
+	"""
+	Write the SVG representation of a thread grid.
+
+	Every thread is a vertical line from its opening to its closing
+	(dashed up to the end if it stays open), every event a dot with its
+	description and every opening and closing a horizontal connection
+	to the thread it joins. The elements are written one after the
+	other.
+
+	Args:
+		story: The name of the story.
+		grid: The ThreadGrid of the story.
+		f: The text file to write to.
+	"""
+	import html
+	def x(column):
+		return SVG_CELL_WIDTH * (column + 1)
+
+	def y(index):
+		return SVG_CELL_HEIGHT * (index + 2)
+
+	bottom = y(grid.size)
+	# the labels of the last column need room as well
+	width = x(grid.count_columns()) + 40 * SVG_CELL_WIDTH
+	f.write(f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{bottom + SVG_CELL_HEIGHT}" font-family="monospace" font-size="12">\n')
+	f.write(f'<text x="{x(0) - 4}" y="{SVG_CELL_HEIGHT}">{html.escape(story)}</text>\n')
+	f.write(f'<line x1="{x(0)}" y1="{SVG_CELL_HEIGHT + 4}" x2="{x(0)}" y2="{bottom}" stroke="black"/>\n')
+	opened = {}
+	for row in grid.rows():
+		column = row["column"]
+		top = y(row["index"])
+		if column and (row["event"] == EVENT.OPENING or column not in opened):
+			opened[column] = top
+		if column and row["event"] == EVENT.CLOSING:
+			f.write(f'<line x1="{x(column)}" y1="{opened.pop(column)}" x2="{x(column)}" y2="{top}" stroke="black"/>\n')
+		if row["join"] is not None:
+			f.write(f'<line x1="{x(row["join"])}" y1="{top}" x2="{x(column)}" y2="{top}" stroke="black"/>\n')
+		f.write(f'<circle cx="{x(column)}" cy="{top}" r="3"/>\n')
+		if row["event"] == EVENT.OPENING and row["name"] != row["description"]:
+			label = f'<tspan font-weight="bold">{html.escape(row["name"])}</tspan>: ' if row["bold"] else f'{html.escape(row["name"])}: '
+		else:
+			label = ""
+		f.write(f'<text x="{x(column) + 6}" y="{top + 4}">{label}{html.escape(row["description"])}</text>\n')
+	for column, top in opened.items():
+		f.write(f'<line x1="{x(column)}" y1="{top}" x2="{x(column)}" y2="{bottom}" stroke="black" stroke-dasharray="4"/>\n')
+	f.write("</svg>\n")
+
+def export_threads(args):
+	"""
+	Export a story's threads as HTML or SVG file.
+
+	The representation is written to the file while the story is laid
+	out (see write_html and write_svg).
+
+	Args:
+		args: The arguments passed to the program by the user.
+	"""
+	thread_list = retrieve_storythreads(args.story, args.path)
+	grid = ThreadGrid(thread_list, args.show_connections)
+	writer = {"html": write_html, "svg": write_svg}[args.to]
+	with profile_phase("render"), open(args.output, "w", encoding="utf-8") as f:
+		writer(args.story, grid, f)
+	print(f"Exported {args.story} to {args.output}.")
+
+def select_threads(thread_list, search_index, only=None, open_only=False, touching=None):
+	"""
+	Select the events of the threads that fit all given filters.
+
+	The threads and the positions of their events are looked up in the
+	search index (the positions at which a text is used as thread
+	name), so only the names of the story and the events of the
+	selected threads are visited. An index that does not fit the story
+	is built again.
+
+	Args:
+		thread_list: The list of dictionaries that represent story
+			threads or None if the index is known to fit the story (see
+			retrieve_search_index), so that the story is not needed.
+		search_index: The search index of the story.
+		only: A (case insensitive) part of the names of the threads to
+			select. The default is to select threads of any name (None).
+		open_only (Boolean): A flag to only select the threads that are
+			still open at the end of the story. The default is False.
+		touching: The indices of the first and the last event of a
+			range. If given, only the threads that are open in the range
+			are selected. The default is None.
+
+	Return:
+		positions: The ascending list indices of the events of the
+			selected threads.
+	"""
+	if thread_list is not None and search_index["size"] != len(thread_list):
+		search_index = build_search_index(thread_list)
+	texts = search_index["texts"]
+	hits = search_index["hits"]
+	open_threads = set(search_index["open"])
+	candidates = matching_texts(search_index, only) if only is not None else range(len(texts))
+	positions = []
+	for i in candidates:
+		name = texts[i]
+		thread_positions = [hit // 2 for hit in hits[i] if hit % 2 == 0]
+		if name is None or not thread_positions:
+			continue
+		if thread_list is not None and any(position >= len(thread_list) or name not in thread_list[position] for position in thread_positions):
+			# the index of another version of the story
+			return select_threads(thread_list, build_search_index(thread_list), only, open_only, touching)
+		closed = name not in open_threads
+		if open_only and closed:
+			continue
+		if touching is not None:
+			first, last = touching
+			if thread_positions[0] > last or (closed and thread_positions[-1] < first):
+				continue
+		positions.extend(thread_positions)
+	positions.sort()
+	return positions
+
+def line_options(args):
+	"""
+	Get the columns and the width of the lines chosen by the user.
+
+	The width of the terminal is used if the lines are cut or folded
+	but no width is given.
+
+	Args:
+		args: The arguments passed to the program by the user.
+
+	Return:
+		options: A dictionary with the window, width and fold arguments
+			of render_threads.
+
+	Raises:
+		ValueError: If the columns are not given as FIRST-LAST or FIRST-.
+	"""
+	window = None
+	if getattr(args, "columns", None) is not None:
+		match = re.fullmatch(r"(\d+)-(\d*)", args.columns)
+		if match is None or int(match[1]) < 1 or (match[2] and int(match[2]) < int(match[1])):
+			raise ValueError("The columns must be given as FIRST-LAST (e.g. 10-40) or FIRST- (up to the last column), counted from 1")
+		window = (int(match[1]), int(match[2]) if match[2] else None)
+	fold = getattr(args, "fold", False)
+	width = getattr(args, "width", None)
+	if width is None and (getattr(args, "truncate", False) or fold or window is not None):
+		width = shutil.get_terminal_size().columns
+	return {"window": window, "width": width, "fold": fold}
+
+def filters_threads(args):
+	"""
+	Find out if the threads to show are filtered.
+
+	Args:
+		args: The arguments passed to the program by the user.
+
+	Return:
+		filtered (Boolean): True if any filter of select_threads or
+			metadata_positions is given.
+	"""
+	return getattr(args, "only", None) is not None or getattr(args, "open_only", False) or getattr(args, "touching", None) is not None or getattr(args, "chapter", None) is not None or bool(getattr(args, "tag", None))
+
+def filter_threads(args, thread_list, search_index=None):
+	"""
+	Keep the events of the threads selected by the user (see
+	select_threads) that are in the chosen chapter and have the chosen
+	tags (see metadata_positions).
+
+	Args:
+		args: The arguments passed to the program by the user.
+		thread_list: The list of dictionaries that represent story
+			threads.
+		search_index: The search index of the story. The default is to
+			build it if threads are filtered (None).
+
+	Return:
+		thread_list: The events of the selected threads.
+		positions: The indices of the events in the story or None if
+			the threads are not filtered.
+	"""
+	if not filters_threads(args):
+		return thread_list, None
+	if search_index is None:
+		search_index = build_search_index(thread_list)
+	positions = metadata_positions(thread_list, search_index, getattr(args, "chapter", None), getattr(args, "tag", None) or ())
+	if getattr(args, "only", None) is not None or getattr(args, "open_only", False) or getattr(args, "touching", None) is not None:
+		selected = select_threads(thread_list, search_index, args.only, args.open_only, args.touching)
+		if positions is not None:
+			chosen = set(positions)
+			selected = [i for i in selected if i in chosen]
+		positions = selected
+	return [thread_list[i] for i in positions], positions
+
+def show_threads(args):
+	"""
+	Show a story's threads.
+
+	Prints the story threads stored in the json file. If the story is
+	to be watched, it is shown again whenever the file changes (see
+	watch_threads). If a point in the history is given, the story is
+	shown as it was then (see history_storythreads). If threads are
+	filtered, only their events are shown with their indices in the
+	story (see select_threads). Of a sharded story, only the segments
+	with these events are loaded, unless they are filtered by metadata.
+
+	Args:
+		args: The arguments passed to the program by the user.
+	"""
+	if getattr(args, "watch", False):
+		watch_threads(args)
+		return
+	with profile_phase("render"):
+		if getattr(args, "at", None) is not None:
+			thread_list = history_storythreads(args.story, args.path, parse_history_point(args.at))
+			thread_list, positions = filter_threads(args, thread_list)
+			lines = render_threads(args.story, thread_list, args.show_connections, positions=positions, **line_options(args))
+		elif filters_threads(args) and story_file(args.story, args.path).suffix == ".shards" and getattr(args, "chapter", None) is None and not getattr(args, "tag", None):
+			# only the segments with events of the selected threads are
+			# loaded
+			positions = select_threads(None, retrieve_search_index(args.story, args.path), args.only, args.open_only, args.touching)
+			thread_list = retrieve_story_events(args.story, args.path, positions)
+			lines = render_threads(args.story, thread_list, args.show_connections, positions=positions, **line_options(args))
+		elif filters_threads(args):
+			thread_list = retrieve_storythreads(args.story, args.path)
+			thread_list, positions = filter_threads(args, thread_list, retrieve_search_index(args.story, args.path, thread_list))
+			lines = render_threads(args.story, thread_list, args.show_connections, positions=positions, **line_options(args))
+		elif streams_story(args.story, args.path):
+			# start printing before the whole story is parsed
+			size, closed_threads = scan_storythreads(args.story, args.path)
+			lines = render_threads(args.story, iter_storythreads(args.story, args.path), args.show_connections, size, closed_threads, **line_options(args))
+		else:
+			lines = render_threads(args.story, retrieve_storythreads(args.story, args.path), args.show_connections, **line_options(args))
+		for line in lines:
+			print(line)
+
+def thread_timeline(thread_list, search_index, thread_id):
+	"""
+	List the events of a thread with what happens around them (see
+	events_timeline).
+
+	The events of the thread are looked up in the search index, so the
+	story is not laid out. An index that does not fit the story is
+	built again (see indexed_thread_positions).
+
+	Args:
+		thread_list: The list of dictionaries that represent story
+			threads.
+		search_index: The search index of the story.
+		thread_id: The id/name of the thread.
+
+	Return:
+		timeline: The events of the thread (see events_timeline).
+
+	Raises:
+		ValueError: If there is no thread with the given name.
+	"""
+	thread_positions = indexed_thread_positions(thread_list, search_index, thread_id)
+	if thread_positions is None or search_index["size"] != len(thread_list):
+		# the index of another version of the story
+		search_index = build_search_index(thread_list)
+		thread_positions = indexed_thread_positions(thread_list, search_index, thread_id)
+	return events_timeline([(i, thread_list[i][thread_id]) for i in thread_positions], search_index, thread_id)
+
+def events_timeline(events, search_index, thread_id):
+	"""
+	List the events of a thread with what happens around them.
+
+	The other threads open at each event are looked up in the interval
+	tree of the search index.
+
+	Args:
+		events: A list of (index, event) tuples of the events of the
+			thread (see retrieve_story_thread).
+		search_index: The search index of the story.
+		thread_id: The id/name of the thread.
+
+	Return:
+		timeline: A list of dictionaries with the "index", "event" and
+			"description" of every event of the thread, the number of
+			events of other threads since its previous event (or the
+			start of the story) as "before" and the names of the other
+			threads open at the event as "open". The last event also
+			has the number of events after it as "after".
+
+	Raises:
+		ValueError: If there is no thread with the given name.
+	"""
+	if not events:
+		raise ValueError("The story thread with the given name does not exist")
+	timeline = []
+	previous = -1
+	for i, event in events:
+		timeline.append({
+			"index": i,
+			"event": event["event"],
+			"description": event.get("description", ""),
+			"before": i - previous - 1,
+			"open": sorted(name for name in stab_interval_tree(search_index["intervals"], i) if name != thread_id),
+		})
+		previous = i
+	timeline[-1]["after"] = search_index["size"] - previous - 1
+	return timeline
+
+def show_thread(args):
+	"""
+	Show the events of a single thread (see events_timeline).
+
+	The events are loaded by retrieve_story_thread, so of a sharded
+	story only the segments with events of the thread are loaded.
+
+	Args:
+		args: The arguments passed to the program by the user.
+
+	Return:
+		timeline: The events of the thread (see events_timeline).
+	"""
+	events = retrieve_story_thread(args.story, args.path, args.name)
+	timeline = events_timeline(events, retrieve_search_index(args.story, args.path), args.name)
+	spacing = len(str(timeline[-1]["index"]))
+	print(args.name)
+	for event in timeline:
+		print(f"{(spacing - len(str(event['index']))) * ' '}{event['index']} {event['event']}" + (f": {event['description']}" if event["description"] else ""))
+		counts = [f"{event['before']} events before"]
+		if "after" in event:
+			counts.append(f"{event['after']} after")
+		print(f"{spacing * ' '}   {', '.join(counts)}, {len(event['open'])} other threads open" + (": " + ", ".join(event["open"]) if event["open"] else ""))
+	return timeline
+
+def redraw_lines(previous, lines, size):
+	"""
+	Build the terminal output that turns the previous lines into the
+	new ones.
+
+	Only the lines from the first changed line on are redrawn: the
+	cursor moves up to that line and everything below it is cleared.
+	If that line has already scrolled out of the terminal, the whole
+	screen is redrawn instead.
+
+	Args:
+		previous: The lines that are currently shown (as printed by the
+			last redraw).
+		lines: The lines to show.
+		size: The terminal size (see shutil.get_terminal_size).
+
+	Return:
+		output: The text (with terminal control sequences) to write or
+			"" if nothing changed.
+	"""
+	first = 0
+	while first < min(len(previous), len(lines)) and previous[first] == lines[first]:
+		first += 1
+	if first == len(previous) == len(lines):
+		return ""
+	# long lines wrap to several rows of the terminal
+	rows = sum(max(1, -(-len(ANSI_SEQUENCE.sub("", line)) // size.columns)) for line in previous[first:])
+	if rows >= size.lines:
+		return "\033[H\033[2J" + "".join(line + "\n" for line in lines)
+	return (f"\033[{rows}F" if rows else "") + "\033[J" + "".join(line + "\n" for line in lines[first:])
+
+def watch_threads(args):
+	"""
+	Show a story's threads and update them whenever the story changes.
+
+	The story file (or the manifest of a sharded story, see
+	story_version_file) is polled every `args.interval` seconds (default
+	0.5). It is only parsed and rendered again if its modification time
+	or size changed, and only the changed lines are redrawn (see
+	redraw_lines). Stops on Ctrl+C.
+
+	Args:
+		args: The arguments passed to the program by the user.
+	"""
+	interval = getattr(args, "interval", None) or 0.5
+	lines = []
+	# no version of the file has been shown yet
+	version = ()
+	try:
+		while True:
+			# the story may be converted to another format meanwhile
+			version_file = story_version_file(args.story, args.path)
 			try:
-				current_indices[-1] = int(el)
-			except ValueError:
-				current_descriptions[-1] = el
-		#current_descriptions.insert(0, args.name)
-		if not all(current_indices[-1] >= i for i in current_indices[:-1]):
+				stat = version_file.stat()
+				current_version = (version_file, stat.st_mtime_ns, stat.st_size)
+			except FileNotFoundError:
+				current_version = None
+			if current_version != version:
+				version = current_version
+				thread_list, positions = filter_threads(args, retrieve_storythreads(args.story, args.path))
+				new_lines = list(render_threads(args.story, thread_list, args.show_connections, positions=positions, **line_options(args)))
+				sys.stdout.write(redraw_lines(lines, new_lines, shutil.get_terminal_size()))
+				sys.stdout.flush()
+				lines = new_lines
+			time.sleep(interval)
+	except KeyboardInterrupt:
+		pass
+
+# more sophisticated sample (with new threads claiming empty columns):
+#
+#story (main thread)
+#│
+#├─ thread a (e.g. main thread first book)
+#│  ├─ thread b
+#│  │  ├─ thread c
+#│  │  │  ├─ thread d
+#│  ├──┘  │  │
+#│  ├─ thread b2
+#│  │  ├──┘  │
+#├──┴──┘     │   (probably don't allow two to end at the same time)
+#┊           ┊
+
+
+def convert_story(args):
+	"""
+	Convert a story between the json, the jsonl and the sharded format.
+
+	The story is stored in the format given by `args.to` and the file in
+	the other format is removed, along with the undo caches in the other
+	formats and the parsed caches that are not used anymore.
+
+	Args:
+		args: The arguments passed to the program by the user.
+	"""
+	storythread_file = story_file(args.story, args.path)
+	if storythread_file.suffix == f".{args.to}":
+		print(f"The story is already stored as {args.to}.")
+		return
+	if not storythread_file.exists():
+		raise ValueError("There is no story to convert")
+	thread_list = retrieve_storythreads(args.story, args.path)
+
+	def remove(storythread_file):
+		if storythread_file.is_dir():
+			shutil.rmtree(storythread_file)
+			shutil.rmtree(segment_cache_path(storythread_file), ignore_errors=True)
+		else:
+			storythread_file.unlink()
+
+	# the story is stored in the format of the existing file with the
+	# highest precedence (see story_file)
+	formats = ["json", "jsonl", "shards"]
+	if formats.index(args.to) > formats.index(storythread_file.suffix[1:]):
+		if args.to == "shards":
+			Path(args.path, args.story + ".shards").mkdir()
+		else:
+			Path(args.path, args.story + ".jsonl").touch()
+		store_storythreads(args.story, args.path, thread_list, operation="convert", previous_list=thread_list)
+		remove(storythread_file)
+	else:
+		remove(storythread_file)
+		if args.to == "jsonl":
+			Path(args.path, args.story + ".jsonl").touch()
+		store_storythreads(args.story, args.path, thread_list, operation="convert", previous_list=thread_list)
+	# the undo cache is stored in the format of the story, undo caches in
+	# the other formats are stale (and may be used before it, see
+	# story_file)
+	for other in formats:
+		cache_file = Path(args.path, f".{args.story}.{other}")
+		if other != args.to and cache_file.exists():
+			remove(cache_file)
+			# the parsed cache of the undo cache
+			Path(args.path, f"..{args.story}.parsed").unlink(missing_ok=True)
+	if args.to == "shards":
+		# a sharded story is only cached segment by segment
+		Path(args.path, f".{args.story}.parsed").unlink(missing_ok=True)
+	print(f"Converted {args.story} to {args.to}.")
+
+def undo(args):
+	"""
+	Undo the last action
+
+	This is done by loading the cached thread_list from file (see
+	StoryThreads.undo).
+
+	Args:
+		args: The arguments passed to the program by the user.
+	"""
+	edit_story(args, "undo", lambda threads: threads.undo())
+
+def story_stats(thread_list):
+	"""
+	Count the events and threads of a story.
+
+	The events are counted in a single pass, so they can be streamed
+	(see iter_storythreads).
+
+	Args:
+		thread_list: The list of dictionaries that represent story
+			threads (or any iterable of them).
+
+	Return:
+		stats: A dictionary with the number of events, developments,
+			threads, open threads and the name and number of events of
+			the longest thread (None if there is no thread).
+	"""
+	events = 0
+	developments = 0
+	thread_events = {}
+	last_events = {}
+	for el in thread_list:
+		name = next(iter(el.keys()))
+		event = el[name]["event"]
+		events += 1
+		if event == EVENT.DEVELOPMENT:
+			developments += 1
+		thread_events[name] = thread_events.get(name, 0) + 1
+		last_events[name] = event
+	longest = max(thread_events, key=thread_events.get, default=None)
+	return {
+		"events": events,
+		"developments": developments,
+		"threads": len(thread_events),
+		"open": sum(1 for event in last_events.values() if event != EVENT.CLOSING),
+		"longest": longest,
+		"longest events": thread_events[longest] if longest is not None else 0,
+	}
+
+def group_stats(thread_list, search_index, field, positions=None):
+	"""
+	Count the events and threads of a story per chapter or tag.
+
+	The events of every group are looked up in the chapter or tag index
+	of the search index (see build_search_index). An index that does not
+	fit the story is built again.
+
+	Args:
+		thread_list: The list of dictionaries that represent story
+			threads.
+		search_index: The search index of the story.
+		field: "chapter" or "tag".
+		positions: The indices of the events to count. The default is
+			all events (None).
+
+	Return:
+		groups: A list of (chapter or tag, stats) tuples (see
+			story_stats) in the order of the chapters or tags.
+	"""
+	index = search_index["chapters" if field == "chapter" else "tags"]
+
+	def fits(group, i):
+		event = next(iter(thread_list[i].values()))
+		return str(event.get("chapter")) == group if field == "chapter" else group in event.get("tags", ())
+	if search_index["size"] != len(thread_list) or not all(i < len(thread_list) and fits(group, i) for group in index for i in index[group]):
+		# the index of another version of the story
+		return group_stats(thread_list, build_search_index(thread_list), field, positions)
+	groups = []
+	for group in sorted(index, key=int if field == "chapter" else str):
+		group_positions = index[group]
+		if positions is not None:
+			group_positions = sorted(set(group_positions).intersection(positions))
+		if group_positions:
+			groups.append((int(group) if field == "chapter" else group, story_stats(thread_list[i] for i in group_positions)))
+	return groups
+
+def show_stats(args):
+	"""
+	Show the numbers of events and threads of a story.
+
+	If a chapter or tags are given, only their events are counted. If a
+	field to group by is given, the numbers of every chapter or tag are
+	shown (see group_stats).
+
+	Args:
+		args: The arguments passed to the program by the user.
+
+	Return:
+		stats: The numbers of the story (see story_stats) or the numbers
+			per group (see group_stats).
+	"""
+	chapter = getattr(args, "chapter", None)
+	tags = getattr(args, "tag", None) or ()
+	by = getattr(args, "by", None)
+	if chapter is None and not tags and by is None:
+		stats = story_stats(iter_storythreads(args.story, args.path))
+	else:
+		thread_list = retrieve_storythreads(args.story, args.path)
+		search_index = retrieve_search_index(args.story, args.path, thread_list)
+		positions = metadata_positions(thread_list, search_index, chapter, tags)
+		if by is not None:
+			groups = group_stats(thread_list, search_index, by, positions)
+			for group, stats in groups:
+				print(f"{'Chapter ' if by == 'chapter' else '#'}{group}: {stats['events']} events ({stats['developments']} developments) of {stats['threads']} threads")
+			if by == "chapter":
+				print(f"Without chapter: {(len(thread_list) if positions is None else len(positions)) - sum(stats['events'] for group, stats in groups)} events")
+			return groups
+		stats = story_stats(thread_list[i] for i in positions)
+	print(f"Number of events: {stats['events']} ({stats['developments']} developments)")
+	print(f"Number of threads: {stats['threads']} ({stats['open']} open)")
+	if stats["longest"] is not None:
+		print(f"Longest thread: {stats['longest']} ({stats['longest events']} events)")
+	return stats
+
+
+### story threads model ###
+
+class FileStore:
+	"""
+	Store a story in its file in a path (see story_file).
+
+	The story is stored with its undo cache, history, parsed cache and
+	search index like by the commands of the program.
+
+	Args:
+		story: The name of the story that corresponds to the file name.
+		path: The path to the story file. The default is the current
+			directory ("").
+		jsonl (Boolean): A flag to create a new story as jsonl file.
+			An existing story keeps its format. The default is json
+			(False).
+	"""
+	def __init__(self, story, path="", jsonl=False):
+		self.story = story
+		self.path = path
+		self.jsonl = jsonl
+		# the stored story, so that the history does not load it again
+		self.stored_list = None
+
+	def load(self):
+		thread_list = retrieve_storythreads(self.story, self.path)
+		self.stored_list = list(thread_list)
+		return thread_list
+
+	def load_undo(self):
+		return retrieve_storythreads(f".{self.story}", self.path)
+
+	def load_search_index(self, thread_list):
+		return retrieve_search_index(self.story, self.path, thread_list)
+
+	def save(self, thread_list, operation="store", appended_from=None):
+		if self.jsonl and not story_file(self.story, self.path).exists():
+			Path(self.path).mkdir(parents=True, exist_ok=True)
+			Path(self.path, self.story + ".jsonl").touch()
+		store_storythreads(self.story, self.path, thread_list, appended_from=appended_from, operation=operation, warn=False, previous_list=self.stored_list)
+		self.stored_list = list(thread_list)
+
+	def save_undo(self, thread_list):
+		stored = self.stored_list is not None and len(thread_list) == len(self.stored_list) and all(a is b for a, b in zip(thread_list, self.stored_list))
+		cache_storythreads(self.story, self.path, thread_list, stored)
+
+class MemoryStore:
+	"""
+	Store a story in memory, e.g. for tests or to work on a copy of a
+	story.
+
+	Args:
+		thread_list: The list of dictionaries that represent story
+			threads to start with. The default is an empty story (None).
+	"""
+	def __init__(self, thread_list=None):
+		self.thread_list = list(thread_list or [])
+		self.undo_list = []
+		# the operations that were saved
+		self.operations = []
+
+	def load(self):
+		return list(self.thread_list)
+
+	def load_undo(self):
+		return list(self.undo_list)
+
+	def load_search_index(self, thread_list):
+		return build_search_index(thread_list)
+
+	def save(self, thread_list, operation="store", appended_from=None):
+		self.thread_list = list(thread_list)
+		self.operations.append(operation)
+
+	def save_undo(self, thread_list):
+		self.undo_list = list(thread_list)
+
+class StoryThreads:
+	"""
+	Work on a story in memory.
+
+	The story is loaded from its store once and every operation only
+	changes the list of events in memory, so any number of operations
+	can be chained. Like the commands of the program, every change can
+	be undone once. Nothing is stored until save is called.
+
+	Args:
+		story: The name of the story.
+		store: Where the story is loaded from and saved to (e.g. a
+			FileStore or a MemoryStore). The default is a new empty
+			MemoryStore (None).
+
+	Attributes:
+		thread_list: The list of dictionaries that represent story
+			threads.
+		undo_list: The story before the last change or None if it has
+			not been loaded from the store yet.
+	"""
+	def __init__(self, story, store=None):
+		self.story = story
+		self.store = store if store is not None else MemoryStore()
+		self.thread_list = self.store.load()
+		self.undo_list = None
+		# the number of changes, e.g. to update the search index
+		self.version = 0
+		self.changed = False
+		self.undo_changed = False
+		# the stored events are the first ones of the list (unless it
+		# changed in front of them), so that new ones can be appended
+		self.stored_size = len(self.thread_list)
+		self.unchanged = len(self.thread_list)
+		self.search_index_version = None
+		self.search_index = None
+
+	def remember(self):
+		"""
+		Remember the current story to be able to undo the next change.
+		"""
+		self.undo_list = list(self.thread_list)
+		self.undo_changed = True
+
+	def changed_from(self, index):
+		"""
+		Note a change of the story.
+
+		Args:
+			index: The first index at which the story changed.
+		"""
+		self.version += 1
+		self.changed = True
+		self.unchanged = min(self.unchanged, index)
+
+	def save(self, operation="store"):
+		"""
+		Store the changes of the story and its undo cache.
+
+		Args:
+			operation: The name of the operation for the history. The
+				default is "store".
+
+		Return:
+			changed (Boolean): True if the story was stored, False if it
+				did not change.
+		"""
+		if self.undo_changed:
+			self.store.save_undo(self.undo_list)
+			self.undo_changed = False
+		if not self.changed:
+			return False
+		appended_from = self.stored_size if self.stored_size and self.unchanged >= self.stored_size else None
+		self.store.save(self.thread_list, operation, appended_from)
+		self.changed = False
+		self.stored_size = self.unchanged = len(self.thread_list)
+		return True
+
+	def current_search_index(self):
+		"""
+		Get the search index of the story.
+
+		The stored index is loaded as long as the story did not change,
+		afterwards it is updated (see build_search_index) when it is
+		needed.
+
+		Return:
+			search_index: The search index of the story.
+		"""
+		if self.search_index_version != self.version:
+			if self.search_index is None and self.version == 0:
+				self.search_index = self.store.load_search_index(self.thread_list)
+			else:
+				self.search_index = build_search_index(self.thread_list, self.search_index)
+			self.search_index_version = self.version
+		return self.search_index
+
+	def add(self, names, indices, close=False, metadata=None):
+		"""
+		Add a story thread or parts of a story thread.
+
+		If the name of the story thread does not exist yet: Add the story
+		thread at the given index.
+		The first of the names acts as id and opening descriptions, if one
+		less index than name is given.
+		If only the opening or the opening and a development (or
+		developments) are given, the story thread is left open. If the
+		close flag is set and the thread is open, the last event closes
+		the thread.
+		If the name of the story thread exists and the close flag is not
+		set: Develop the respective story thread.
+		If the name of the story thread exists and the close flag is set:
+		Develop the respective story thread if more than one event is
+		given and close the story thread with the last event.
+
+		Args:
+			names: The id/name of the thread and the descriptions of the
+				events.
+			indices: The indices of the events.
+			close (Boolean): A flag to close the thread with the last
+				event. The default is to leave it open (False).
+			metadata: A dictionary with the metadata of all events (see
+				METADATA_FIELDS). The default is no metadata (None).
+
+		Raises:
+			ValueError: If
+				- no name is given for the thread
+				- no indices are given for the thread
+				- the thread contains events with the given descriptions
+				- descriptions are missing for opening or developments
+				- the order of opening, developments, closing is wrong
+				- the metadata is malformed
+		"""
+		events = self.new_events(names, indices, close)
+		if metadata:
+			problem = metadata_problem(metadata)
+			if problem is not None:
+				raise ValueError(f"The event {problem[1]}")
+		self.remember()
+		self.insert_events(names[0], events, indices, close, [metadata] * len(indices) if metadata else None)
+
+	def new_events(self, names, indices, close, thread_list=None):
+		"""
+		Validate the events to add (see add).
+
+		The events are validated against the story of the model unless
+		another story is given (e.g. the story without a thread that is
+		changed).
+
+		Return:
+			events: The descriptions of the new events.
+		"""
+		if not names:
+			raise ValueError("You need to pass at least one event name to act as identifier for the story thread")
+		if not indices:
+			raise ValueError("You need to pass indices to add something")
+		if close and not all(indices[-1] >= indices[i+1] for i in range(len(indices) - 1)):
 			raise ValueError("The story thread must close after it opens or develops")
 
-	# adjust indices for removed elements
-	for i in range(len(current_indices)):
-		current_indices[i] -= i
-
-	# add the id
-	current_descriptions.insert(0, args.name)
-
-	params = argparse.Namespace(
-		story = args.story,
-		path = args.path,
-		show_connections = args.show_connections,
-		names = current_descriptions,
-		indices = current_indices,
-		close = current_close
-	)
-
-	# remove old thread, create and store changed thread
-	remove_thread(argparse.Namespace(story=args.story, path=args.path, show_connections=args.show_connections, name=args.name, ending=False, development=""), noshow=True, nocache=True)
-	add_thread(params, nocache=True)
+		if thread_list is None:
+			thread_list = self.thread_list
+		events = list(names)
+		thread_id = names[0]
+		with profile_phase("validate"):
+			thread_is_new = thread_id not in [next(iter(el.keys())) for el in thread_list]
+
+			# remove id if the first name may be the id
+			if thread_is_new:
+				if len(names) + 1 == len(indices) and close:
+					pass
+				elif len(names) == len(indices) + 1:
+					events.pop(0)
+				elif len(names) == len(indices) and not close:
+					pass
+				elif len(names) == len(indices) and close:
+					# only unclear state, first could be id or ending could have
+					# no description
+					pass
+					#events.pop(0)
+				else:
+					raise ValueError("Missing description. Every event except of the closing of a story thread needs a description")
+			else:
+				events.pop(0)
+
+			#assert len(events) <= len(indices)
+
+			if thread_is_new and not all(indices[0] <= indices[i+1] for i in range(len(indices) - 1)):
+				raise ValueError("The story thread must open before it can develop or close")
+			if not thread_events_are_new(thread_list, thread_id, events):
+				raise ValueError("The story thread already contains events with these descriptions")
+			if close and thread_is_closed(thread_list, thread_id):
+				raise ValueError("Cannot close a closed thread")
+		return events
+
+	@profile_phase("edit")
+	def insert_events(self, thread_id, events, indices, close, metadata=None):
+		"""
+		Insert validated events of a thread (see add).
+
+		The metadata is a list of dictionaries, one per index, or None.
+		"""
+		thread_list = self.thread_list
+		events = list(events)
+		self.changed_from(min(int(index) for index in indices))
+		# create a new thread
+		shift_indices = 0
+		for i, index in enumerate(indices):
+			description = ""
+			# closings can be without description
+			try:
+				description = events.pop(0)
+			except IndexError:
+				pass
+			current_event = EVENT.DEVELOPMENT
+			# if the thread is new, add an opening
+			if thread_id not in [next(iter(el.keys())) for el in thread_list]:
+				current_event = EVENT.OPENING
+			# if the thread is to be closed, close it
+			elif i == len(indices)-1 and close and not thread_is_closed(thread_list, thread_id):
+				current_event = EVENT.CLOSING
+			# add the thread event
+			thread_list.insert(int(index)+shift_indices, {thread_id: {"event": current_event.value, "description": description, **(metadata[i] if metadata else {})}})
+			# because a thread has been added, in order to keep the
+			# indices correct, increment the index
+			shift_indices += 1
+
+	def remove(self, names, developments=None, ending=False):
+		"""
+		Remove story threads or parts of a story thread.
+
+		If only the names of the story threads are given: Remove the whole
+		story threads. If the ending or the developments are given,
+		remove the respective parts from the story threads.
+		All events to remove are looked up in a per-thread position index
+		(and developments of other threads with a given description in
+		the search index) and the remaining events are collected in a
+		single pass, so the indices given by the user always refer to the
+		story before the removal.
+
+		Args:
+			names: The id/name of a thread or a list of them.
+			developments: The indices and (partial) descriptions of the
+				developments to remove. The default is to remove no
+				development (None).
+			ending (Boolean): A flag to only remove the closing of the
+				threads (i.e. open them again). The default is False.
+
+		Return:
+			notices: The list of developments that were not removed and
+				why.
+
+		Raises:
+			ValueError: If
+				- the given story thread does not exist
+				- the thread is to be opened but is already open
+		"""
+		thread_list = self.thread_list
+		with profile_phase("validate"):
+			names = [names] if isinstance(names, str) else list(names)
+			thread_index = index_thread_positions(thread_list)
+
+			for name in names:
+				if name not in thread_index:
+					raise ValueError("The story thread with the given name does not exist and cannot be removed")
+				if ending and not thread_list[thread_index[name][-1]][name]["event"] == EVENT.CLOSING:
+					raise ValueError("The story thread is already open")
+			# complete partial descriptions of the developments to remove
+			if developments:
+				developments = resolve_descriptions(thread_list, self.current_search_index, names, developments)
+
+		self.remember()
+
+		notices = []
+		with profile_phase("edit"):
+			positions = set()
+			if ending:
+				# remove only closing (i.e. open again)
+				positions.update(thread_index[name][-1] for name in names)
+			if developments:
+				# remove only specified developments
+				indices = set()
+				descriptions = set()
+				for el in developments:
+					try:
+						indices.add(int(el))
+					except ValueError:
+						descriptions.add(el)
+				if descriptions:
+					for name in names:
+						indices.update(i for i in thread_index[name] if thread_list[i][name]["event"] == EVENT.DEVELOPMENT and thread_list[i][name]["description"] in descriptions)
+					# the developments of other threads are looked up to
+					# tell that they are not removed
+					for description in descriptions:
+						for i in search_events(thread_list, self.current_search_index(), description, descriptions_only=True):
+							key = next(iter(thread_list[i].keys()))
+							if key not in names and thread_list[i][key]["event"] == EVENT.DEVELOPMENT and thread_list[i][key]["description"] == description:
+								indices.add(i)
+				removed = 0
+				for i in sorted(indices):
+					if not 0 <= i < len(thread_list):
+						notices.append(f"Did not remove thread development at index {i} as it does not exist.")
+						continue
+					key = next(iter(thread_list[i].keys()))
+					if key in names:
+						if thread_list[i][key]["event"] == EVENT.DEVELOPMENT:
+							positions.add(i)
+							removed += 1
+						else:
+							notices.append(f"Did not remove thread development at index {i} as it is not a development.")
+					else:
+						notices.append(f"Did not remove thread development at index {i} as it belongs to a different thread.")
+				if removed == 0:
+					notices.append(f"There was nothing to remove.")
+			if not ending and not developments:
+				# remove whole threads
+				for name in names:
+					positions.update(thread_index[name])
+			self.thread_list = [el for i, el in enumerate(thread_list) if i not in positions]
+			self.changed_from(min(positions, default=len(thread_list)))
+		return notices
+
+	def change(self, name, opening="", development="", ending=""):
+		"""
+		Change a story thread's opening, development and/or closing indices.
+
+		Move the indices of the story thread events by removing and adding
+		them to the given indices.
+		Note: Currently, only one event can be changed at a time.
+
+		Args:
+			name: The id/name of the thread.
+			opening: The new index and/or description of the opening.
+			development: The index or (partial) description of the
+				development to change followed by its new index and/or
+				description.
+			ending: The new index and/or description of the closing.
+
+		Raises:
+			ValueError: If
+				- the given story thread does not exist
+				- no thread event to change is given
+				- more than one index or description is given per event
+				- the development to be changed does not exist
+				- the order of opening, developments, closing is wrong
+		"""
+		if not opening and not ending and not development:
+			ValueError("No thread event specified for change")
+		if len(opening) > 2 or len(ending) > 2 or len(development) > 3:
+			ValueError("You can only change one index and description per event")
+
+		thread_list = self.thread_list
+		with profile_phase("validate"):
+			thread_ids = [next(iter(el.keys())) for el in thread_list]
+
+			if name not in thread_ids:
+				raise ValueError("The story thread with the given name does not exist and cannot be changed")
+			if ending and not thread_is_closed(thread_list, name):
+				raise ValueError("The story thread is not closed. The ending cannot be changed.")
+
+		# complete a partial description of the development to change
+		if development:
+			development = resolve_descriptions(thread_list, self.current_search_index, {name}, development[:1]) + list(development[1:])
+
+		# get the current thread
+		dev_index = -1
+		current_indices = []
+		current_descriptions = []
+		current_metadata = []
+		current_close = False
+		for i,el in enumerate(thread_list):
+			thread_id = next(iter(el.keys()))
+			if thread_id == name:
+				current_indices.append(i)
+				try:
+					current_descriptions.append(el[thread_id]["description"])
+				except IndexError:
+					pass
+				current_metadata.append(event_metadata(el[thread_id]))
+				if development and el[thread_id]["event"] == EVENT.DEVELOPMENT and (str(i) == development[0] or el[thread_id]["description"] == development[0]):
+					dev_index = len(current_indices) - 1
+				if el[thread_id]["event"] == EVENT.CLOSING:
+					current_close = True
+
+		# apply changes
+		if opening:
+			for el in opening:
+				try:
+					current_indices[0] = int(el)
+				except ValueError:
+					current_descriptions[0] = el
+			if not all(current_indices[0] <= i for i in current_indices[1:]):
+				raise ValueError("The story thread must open before it can develop or close")
+		if development:
+			if dev_index < 0:
+				raise ValueError(f"The given development index or description does not match a known development.")
+			for el in development:
+				try:
+					current_indices[dev_index] = int(el)
+				except ValueError:
+					current_descriptions[dev_index] = el
+			if current_indices[0] > current_indices[dev_index]:
+				raise ValueError(f"The story thread cannot develop before it opens.")
+		if ending:
+			for el in ending:
+				try:
+					current_indices[-1] = int(el)
+				except ValueError:
+					current_descriptions[-1] = el
+			if not all(current_indices[-1] >= i for i in current_indices[:-1]):
+				raise ValueError("The story thread must close after it opens or develops")
+
+		# adjust indices for removed elements
+		for i in range(len(current_indices)):
+			current_indices[i] -= i
+
+		# add the id
+		current_descriptions.insert(0, name)
+
+		# the changed thread is validated against the story without the
+		# old thread, which is only removed if the changed thread can be
+		# added
+		remaining = [el for el in thread_list if next(iter(el.keys())) != name]
+		events = self.new_events(current_descriptions, current_indices, current_close, remaining)
+		self.remember()
+		self.thread_list = remaining
+		self.changed_from(min(i for i, thread_id in enumerate(thread_ids) if thread_id == name))
+		self.insert_events(name, events, current_indices, current_close, current_metadata)
+
+	def move(self, first, last, to):
+		"""
+		Move a range of events of any threads to another position.
+
+		Args:
+			first: The index of the first event to move.
+			last: The index of the last event to move.
+			to: The index of the event in front of which the events are
+				inserted.
+
+		Raises:
+			ValueError: If the move is not possible (see splice_events).
+		"""
+		moved_list = splice_events(self.thread_list, first, last, to)
+		self.remember()
+		self.thread_list = moved_list
+		self.changed_from(min(first, to))
+
+	def rename(self, old_name, new_name, opening=False):
+		"""
+		Rename a story thread on all of its events.
+
+		Args:
+			old_name: The current id/name of the thread.
+			new_name: The new id/name of the thread.
+			opening (Boolean): A flag to also rename the opening
+				description if it equals the current name. The default
+				is to keep the description (False).
+
+		Raises:
+			ValueError: If the thread cannot be renamed (see
+				rename_events).
+		"""
+		renamed_list = rename_events(self.thread_list, old_name, new_name, opening)
+		self.remember()
+		self.thread_list = renamed_list
+		self.changed_from(0)
+
+	def annotate(self, indices, chapter=None, offset=None, tags=(), untags=(), clear=False):
+		"""
+		Set the metadata of events.
+
+		Args:
+			indices: The indices of the events.
+			chapter: The new chapter of the events. The default is to
+				keep their chapter (None).
+			offset: The new (word) offset of the events. The default is
+				to keep their offset (None).
+			tags: The tags to add to the events. The default is none (()).
+			untags: The tags to remove from the events. The default is
+				none (()).
+			clear (Boolean): A flag to remove all metadata of the events
+				before the new metadata is set. The default is False.
+
+		Raises:
+			ValueError: If
+				- nothing to set is given
+				- an index lies outside of the story
+				- the metadata is malformed
+		"""
+		if chapter is None and offset is None and not tags and not untags and not clear:
+			raise ValueError("You need to pass a chapter, an offset or tags to set")
+		if not all(0 <= i < len(self.thread_list) for i in indices):
+			raise ValueError("The events to annotate must lie within the story")
+		metadata = {field: value for field, value in [("chapter", chapter), ("offset", offset), ("tags", list(tags) + list(untags))] if value is not None}
+		problem = metadata_problem(metadata)
+		if problem is not None:
+			raise ValueError(f"The event {problem[1]}")
+
+		self.remember()
+		for i in sorted(set(indices)):
+			name = next(iter(self.thread_list[i].keys()))
+			# a new event, so that the undo cache keeps the old one
+			event = dict(self.thread_list[i][name])
+			if clear:
+				for field in METADATA_FIELDS:
+					event.pop(field, None)
+			for field, value in [("chapter", chapter), ("offset", offset)]:
+				if value is not None:
+					event[field] = value
+			event_tags = (set(event.get("tags", ())) | set(tags)) - set(untags)
+			if event_tags:
+				event["tags"] = sorted(event_tags)
+			else:
+				event.pop("tags", None)
+			self.thread_list[i] = {name: event}
+		self.changed_from(min(indices, default=len(self.thread_list)))
+
+	def repair(self):
+		"""
+		Repair the problems of the story that can be repaired (see
+		repair_storythreads).
+
+		Return:
+			repairs: A list of (index, thread id, repair) tuples.
+		"""
+		repaired_list, repairs = repair_storythreads(self.thread_list)
+		self.remember()
+		self.thread_list = repaired_list
+		self.changed_from(0)
+		return repairs
+
+	def splice(self, start, end, events):
+		"""
+		Replace a range of events with other events.
+
+		The events are not validated and the story before the change is
+		not remembered (see remember), so that several splices can make
+		up one change, e.g. of an import.
+
+		Args:
+			start: The index of the first event to replace.
+			end: The index behind the last event to replace.
+			events: The list of dictionaries that represent the new
+				story thread events.
+		"""
+		self.thread_list[start:end] = events
+		self.changed_from(start)
+
+	def undo(self):
+		"""
+		Undo the last change.
+
+		The story before the last change is kept, so undoing again does
+		not change the story anymore.
+		"""
+		if self.undo_list is None:
+			self.undo_list = self.store.load_undo()
+		self.thread_list = list(self.undo_list)
+		self.changed_from(0)
+
+	def render(self, show_connections=False):
+		"""
+		Render the story threads (see render_threads).
+
+		Args:
+			show_connections (Boolean): A flag to show all connections to
+				the main story thread. The default is False.
+
+		Return:
+			lines: The list of lines that represent the story threads.
+		"""
+		return list(render_threads(self.story, self.thread_list, show_connections))
+
+	def query(self, query, fuzzy=False, chapter=None, tags=()):
+		"""
+		Find the events whose thread name or description contains a query
+		(see search_events) and/or that have the given metadata (see
+		metadata_positions).
+
+		Args:
+			query: The (case insensitive) text to search for or "" to
+				find the events by their metadata only.
+			fuzzy (Boolean): A flag to also match similar texts if no
+				text contains the query. The default is False.
+			chapter: The chapter of the events. The default is any
+				chapter (None).
+			tags: The tags that the events must all have. The default is
+				any tags (()).
+
+		Return:
+			events: A list of (index, thread id, event type, description)
+				tuples of the matching events.
+		"""
+		positions = metadata_positions(self.thread_list, self.current_search_index(), chapter, tags)
+		if query or positions is None:
+			matches = search_events(self.thread_list, self.current_search_index(), query, fuzzy=fuzzy)
+			if positions is not None:
+				selected = set(positions)
+				matches = [i for i in matches if i in selected]
+			positions = matches
+		events = []
+		for i in positions:
+			name = next(iter(self.thread_list[i].keys()))
+			events.append((i, name, self.thread_list[i][name]["event"], self.thread_list[i][name].get("description", "")))
+		return events
+
+	def timeline(self, thread_id):
+		"""
+		List the events of a thread with what happens around them (see
+		thread_timeline).
+
+		Args:
+			thread_id: The id/name of the thread.
+
+		Return:
+			timeline: A list of dictionaries, one per event of the
+				thread.
+		"""
+		return thread_timeline(self.thread_list, self.current_search_index(), thread_id)
+
+	def problems(self):
+		"""
+		Find the problems of the story (see story_problems).
+
+		Return:
+			problems: A list of (index, thread id, problem) tuples.
+		"""
+		return story_problems(self.thread_list)
+
+	def stats(self):
+		"""
+		Count the events and threads of the story (see story_stats).
+
+		Return:
+			stats: A dictionary with the numbers of the story.
+		"""
+		return story_stats(self.thread_list)
+
+
+### manipulate threads (add, remove and change) ###
+
+def edit_story(args, operation, edit):
+	"""
+	Change a story, store it and show it.
+
+	The story is loaded into a StoryThreads model that is changed in
+	memory and stored once. The operations of the model validate a
+	change before they apply it, so a rejected change leaves the story
+	and its undo cache as they were.
+
+	Args:
+		args: The arguments passed to the program by the user.
+		operation: The name of the operation for the history.
+		edit: A function that changes a StoryThreads model.
+
+	Return:
+		result: What the edit function returned.
+	"""
+	threads = StoryThreads(args.story, FileStore(args.story, args.path))
+	try:
+		result = edit(threads)
+	finally:
+		stored = threads.save(operation)
+	if stored:
+		for problem in threads.problems():
+			print("Warning: " + format_problem(*problem))
+
+	# show changes
+	with profile_phase("render"):
+		for line in render_threads(args.story, threads.thread_list, args.show_connections):
+			print(line)
+	return result
+
+def add_thread(args):
+	"""
+	Add a story thread or parts of a story thread (see
+	StoryThreads.add).
+
+	Args:
+		args: The arguments passed to the program by the user.
+
+	Raises:
+		ValueError: If the events cannot be added.
+	"""
+	edit_story(args, "add", lambda threads: threads.add(args.names, args.indices, args.close, metadata_arguments(args)))
+
+def metadata_arguments(args):
+	"""
+	Get the metadata of events given by the user.
+
+	Args:
+		args: The arguments passed to the program by the user.
+
+	Return:
+		metadata: A dictionary with the given metadata fields (see
+			METADATA_FIELDS).
+	"""
+	metadata = {}
+	for field in ["chapter", "offset"]:
+		if getattr(args, field, None) is not None:
+			metadata[field] = getattr(args, field)
+	if getattr(args, "tag", None):
+		metadata["tags"] = sorted(set(args.tag))
+	return metadata
+
+def annotate_events(args):
+	"""
+	Set the chapter, offset or tags of events (see
+	StoryThreads.annotate).
+
+	Args:
+		args: The arguments passed to the program by the user.
+
+	Raises:
+		ValueError: If the metadata cannot be set.
+	"""
+	edit_story(args, "meta", lambda threads: threads.annotate(args.indices, args.chapter, args.offset, args.tag or (), args.untag or (), args.clear))
+
+def remove_thread(args):
+	"""
+	Remove story threads or parts of a story thread (see
+	StoryThreads.remove).
+
+	Args:
+		args: The arguments passed to the program by the user.
+
+	Raises:
+		ValueError: If the events cannot be removed.
+	"""
+	def remove(threads):
+		for notice in threads.remove(args.name, args.development, args.ending):
+			print(notice)
+	edit_story(args, "remove", remove)
+
+def change_thread(args):
+	"""
+	Change a story thread's opening, development and/or closing indices
+	(see StoryThreads.change).
+
+	Args:
+		args: The arguments passed to the program by the user.
+
+	Raises:
+		ValueError: If the thread cannot be changed.
+	"""
+	edit_story(args, "change", lambda threads: threads.change(args.name, args.opening, args.development, args.ending))
+
+@profile_phase("edit")
+def splice_events(thread_list, first, last, to):
+	"""
+	Move a block of consecutive events to another position.
+
+	The block is cut out and inserted in front of the event that is
+	currently at the target index, which builds the new list in a
+	single pass. Only threads with events inside the block can change
+	their order, so only these are checked.
+
+	Args:
+		thread_list: The list of dictionaries that represent story
+			threads.
+		first: The index of the first event of the block.
+		last: The index of the last event of the block.
+		to: The index of the event in front of which the block is
+			inserted (the length of the list to move it to the end).
+
+	Return:
+		thread_list: The new list of dictionaries that represent story
+			threads.
+
+	Raises:
+		ValueError: If
+			- the block does not lie within the story
+			- the target index does not lie within the story or inside
+			  the block
+			- the move breaks the order of opening, developments and
+			  closing of any thread
+	"""
+	if not 0 <= first <= last < len(thread_list):
+		raise ValueError("The events to move must lie within the story")
+	if not 0 <= to <= len(thread_list):
+		raise ValueError("The events must be moved to an index within the story")
+	if first < to <= last:
+		raise ValueError("The events cannot be moved inside of their own range")
+
+	block = thread_list[first:last+1]
+	if to <= first:
+		moved_list = thread_list[:to] + block + thread_list[to:first] + thread_list[last+1:]
+	else:
+		moved_list = thread_list[:first] + thread_list[last+1:to] + block + thread_list[to:]
+
+	# report the first violation of every thread that would be broken
+	violated = {}
+	for i, name, problem in thread_order_violations(moved_list, {next(iter(el.keys())) for el in block}):
+		violated.setdefault(name, f"{name}: {problem} (index {i})")
+	if violated:
+		raise ValueError("The move would break the order of the story threads:\n" + "\n".join(violated.values()))
+	return moved_list
+
+def move_events(args):
+	"""
+	Move a range of events of any threads to another position.
+
+	The events are moved as a block, so all threads are validated and
+	the story is stored and shown only once.
+
+	Args:
+		args: The arguments passed to the program by the user.
+
+	Raises:
+		ValueError: If the move is not possible (see splice_events).
+	"""
+	edit_story(args, "move", lambda threads: threads.move(args.range[0], args.range[1], args.to))
+
+@profile_phase("edit")
+def rename_events(thread_list, old_name, new_name, opening=False):
+	"""
+	Rename a story thread on all of its events.
+
+	Args:
+		thread_list: The list of dictionaries that represent story
+			threads.
+		old_name: The current id/name of the thread.
+		new_name: The new id/name of the thread.
+		opening (Boolean): A flag to also rename the opening
+			description if it equals the current name. The default is
+			to keep the description (False).
+
+	Return:
+		thread_list: The new list of dictionaries that represent story
+			threads.
+
+	Raises:
+		ValueError: If
+			- the thread to rename does not exist
+			- a thread with the new name already exists
+	"""
+	thread_index = index_thread_positions(thread_list)
+	if old_name not in thread_index:
+		raise ValueError("The story thread with the given name does not exist and cannot be renamed")
+	if new_name in thread_index:
+		raise ValueError("A story thread with the new name already exists")
+
+	renamed_list = []
+	for el in thread_list:
+		name = next(iter(el.keys()))
+		if name == old_name:
+			event = el[name].copy()
+			if opening and event["event"] == EVENT.OPENING and event["description"] == old_name:
+				event["description"] = new_name
+			el = {new_name: event}
+		renamed_list.append(el)
+	return renamed_list
+
+def rename_thread(args):
+	"""
+	Rename a story thread.
+
+	All events of the thread are renamed at once, so the story is
+	stored and shown once and the renaming can be undone in one step.
+
+	Args:
+		args: The arguments passed to the program by the user.
+
+	Raises:
+		ValueError: If the thread cannot be renamed (see rename_events).
+	"""
+	edit_story(args, "rename", lambda threads: threads.rename(args.old, args.new, args.opening))
+
+def check_story(args):
+	"""
+	Check a story for problems and optionally repair them.
+
+	Prints every problem of the story (see story_problems) with the
+	index of the event. If the story is to be repaired, the repairs
+	(see repair_storythreads) and the remaining problems are printed
+	and the repaired story is stored. Otherwise, a large story is
+	checked while it is streamed (see iter_storythreads).
+
+	Args:
+		args: The arguments passed to the program by the user.
+
+	Return:
+		problems: The list of (index, thread id, problem) tuples that
+			remain.
+	"""
+	if not args.repair:
+		problems = story_problems(iter_storythreads(args.story, args.path))
+	else:
+		threads = StoryThreads(args.story, FileStore(args.story, args.path))
+		problems = threads.problems()
+	if problems and args.repair:
+		for index, thread_id, repair in threads.repair():
+			print(f"Repaired {index}" + (f" ({thread_id})" if thread_id is not None else "") + f": {repair}")
+		threads.save("repair")
+		problems = threads.problems()
+		for problem in problems:
+			print("Warning: " + format_problem(*problem))
+		return problems
+	for problem in problems:
+		print(format_problem(*problem))
+	if not problems:
+		print("No problems found.")
+	return problems
+
+
+### import stories ###
+
+# the markers of thread events in a manuscript, e.g.
+# [[develop: antagonist in disguise | fake-ally knows]]
+MANUSCRIPT_MARKER = re.compile(rb"\[\[\s*(open|develop|close)\s*:\s*([^\]|]*?)\s*(?:\|\s*([^\]]*?)\s*)?\]\]")
+
+def manuscript_digest(manuscript):
+	"""
+	Hash the content of a manuscript.
+
+	Args:
+		manuscript: The path of the manuscript.
+
+	Return:
+		digest: The blake2b hash of the content as hex string.
+	"""
+	digest = hashlib.blake2b(digest_size=16)
+	with open(manuscript, "rb") as f:
+		for block in iter(lambda: f.read(2**20), b""):
+			digest.update(block)
+	return digest.hexdigest()
+
+def scan_manuscript(manuscript):
+	"""
+	Find the thread events marked in a manuscript.
+
+	The manuscript is mapped into memory and searched for markers like
+	`[[open: thread | description]]`, `[[develop: thread | description]]`
+	and `[[close: thread]]` in document order. An opening without
+	description is described by the thread name (like by add_thread),
+	a closing may have no description.
+
+	Args:
+		manuscript: The path of the manuscript.
+
+	Return:
+		events: The list of dictionaries that represent the story thread
+			events of the manuscript.
+		lines: The line number of the marker of every event.
+
+	Raises:
+		ValueError: If a marker has no thread name or a development has
+			no description.
+	"""
+	import mmap
+	events = []
+	lines = []
+	with open(manuscript, "rb") as f:
+		try:
+			content = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+		except ValueError:
+			# an empty file cannot be mapped
+			return events, lines
+		with content:
+			line = 1
+			position = 0
+			for match in MANUSCRIPT_MARKER.finditer(content):
+				line += content[position:match.start()].count(b"\n")
+				position = match.start()
+				event = match.group(1).decode()
+				name = match.group(2).decode("utf-8")
+				description = match.group(3).decode("utf-8") if match.group(3) is not None else ""
+				if not name:
+					raise ValueError(f"{manuscript}:{line}: The marker needs a thread name")
+				if not description:
+					if event == EVENT.OPENING:
+						description = name
+					elif event == EVENT.DEVELOPMENT:
+						raise ValueError(f"{manuscript}:{line}: The development of '{name}' needs a description")
+				events.append({name: {"event": event, "description": description}})
+				lines.append(line)
+	return events, lines
+
+def manuscripts_path(story, path):
+	"""
+	Get the hidden file that records the imported manuscripts of a story.
+
+	Args:
+		story: The name of the story that corresponds to the file name.
+		path: The path to the story file.
+
+	Return:
+		manuscripts_file: The path of the json file.
+	"""
+	return Path(path, f".{story}.manuscripts.json")
+
+def import_manuscripts(threads, manuscripts, imported=None):
+	"""
+	Make a story consist of the events marked in manuscripts.
+
+	The events of the manuscripts follow each other in the given order
+	of the manuscripts. If the story was imported from manuscripts
+	before and was not changed since, only the manuscripts whose hash
+	changed are scanned again and their events are spliced into the
+	story. Otherwise, all manuscripts are scanned and replace the story.
+	Whether the story was changed since the last import (e.g. by a move
+	that keeps its size) is up to the caller, which passes no record
+	then (see import_manuscript).
+	The imported story is checked like a story that was built with
+	add_thread (see story_problems).
+
+	Args:
+		threads: The StoryThreads model of the story.
+		manuscripts: The paths of the manuscripts.
+		imported: The record of the last import (as returned) or None
+			if there is none or the story changed since.
+
+	Return:
+		imported: The record of this import with the hash and number of
+			events of every manuscript and the size of the story.
+		scanned: The number of manuscripts that were scanned.
+
+	Raises:
+		ValueError: If
+			- a marker is malformed (see scan_manuscript)
+			- the imported story breaks the rules for story threads
+	"""
+	previous = {}
+	if imported is not None and imported["size"] == len(threads.thread_list):
+		start = 0
+		for record in imported["manuscripts"]:
+			previous[record["file"]] = (record["digest"], start, record["size"])
+			start += record["size"]
+
+	records = []
+	segments = []
+	origins = []
+	scanned = 0
+	for manuscript in manuscripts:
+		file = str(Path(manuscript).resolve())
+		digest = manuscript_digest(manuscript)
+		if file in previous and previous[file][0] == digest:
+			_, start, size = previous[file]
+			segments.append((start, start + size, None))
+			origins.extend((manuscript, None) for _ in range(size))
+		else:
+			events, lines = scan_manuscript(manuscript)
+			scanned += 1
+			origins.extend((manuscript, line) for line in lines)
+			size = len(events)
+			if file in previous and threads.thread_list[previous[file][1]:previous[file][1] + previous[file][2]] == events:
+				# only the text around the markers changed
+				segments.append((previous[file][1], previous[file][1] + size, None))
+			else:
+				segments.append((None, None, events))
+		records.append({"file": file, "digest": digest, "size": size})
+
+	# splice the scanned manuscripts into the story if the others stay
+	# where they are, else build the story anew
+	with profile_phase("edit"):
+		thread_list = threads.thread_list
+		new_list = []
+		for start, end, events in segments:
+			new_list.extend(thread_list[start:end] if events is None else events)
+		problems = story_problems(new_list)
+		if problems:
+			message = []
+			for index, thread_id, problem in problems[:10]:
+				manuscript, line = origins[index]
+				message.append(f"{manuscript}" + (f":{line}" if line is not None else "") + ": " + format_problem(index, thread_id, problem))
+			if len(problems) > 10:
+				message.append(f"... and {len(problems) - 10} more")
+			raise ValueError("The manuscripts break the rules for story threads:\n" + "\n".join(message))
+
+		# the manuscripts in front of the first changed (or moved) one
+		# are in place already
+		position = 0
+		for start, end, events in segments:
+			if events is not None or start != position:
+				break
+			position = end
+		if position < len(new_list) or position < len(thread_list):
+			threads.remember()
+			threads.splice(position, len(thread_list), new_list[position:])
+	return {"size": len(new_list), "manuscripts": records}, scanned
+
+def import_manuscript(args):
+	"""
+	Import the thread events marked in manuscripts into a story (see
+	import_manuscripts).
+
+	The record of the import is kept in a hidden file next to the story
+	to only scan the changed manuscripts next time. It holds the
+	version of the story after the import (see history_version), so
+	that the record is only used as long as the story did not change.
+
+	Args:
+		args: The arguments passed to the program by the user.
+
+	Return:
+		imported: The record of the import.
+
+	Raises:
+		ValueError: If the manuscripts cannot be imported.
+	"""
+	manuscripts_file = manuscripts_path(args.story, args.path)
+	imported = None
+	try:
+		with open(manuscripts_file, "r") as f:
+			imported = json.load(f)
+	except (FileNotFoundError, json.decoder.JSONDecodeError):
+		pass
+	if imported is not None and (imported.get("story") is None or imported["story"] != history_version(args.story, args.path)):
+		imported = None
+	threads = StoryThreads(args.story, FileStore(args.story, args.path))
+	imported, scanned = import_manuscripts(threads, args.manuscripts, imported)
+	threads.save("import-manuscript")
+	imported["story"] = history_version(args.story, args.path)
+	with open(manuscripts_file, "w") as f:
+		f.write(json.dumps(imported, ensure_ascii=False))
+	print(f"Imported {imported['size']} events from {len(args.manuscripts)} manuscripts ({scanned} scanned).")
+	return imported
+
+# a thread event of an outline, e.g.
+# - develop: antagonist in disguise | fake-ally knows
+OUTLINE_EVENT = re.compile(r"^\s*(?:[-*+]|\d+[.)])?\s*(open|develop|close)\s*:\s*([^|]*?)\s*(?:\|\s*(.*?)\s*)?$")
+# how many rows are read between two progress reports
+IMPORT_PROGRESS_ROWS = 10000
+
+def read_outline_rows(outline):
+	"""
+	Read the thread events of a csv file or a Markdown outline.
+
+	A csv file has the columns thread, event, description and position
+	(an optional header row is skipped). In an outline, every line like
+	`- develop: thread | description` (at any indentation) is an event
+	without position and all other lines (headings, scenes, notes) are
+	skipped.
+
+	Args:
+		outline: The path of the csv file (with the suffix .csv) or of
+			the outline.
+
+	Yield:
+		row: A tuple of the row (line) number, thread id, event type (or
+			"" if it is to be inferred), description and position (or
+			"" to add the event at the end).
+	"""
+	import csv
+	with open(outline, "r", encoding="utf-8", newline="") as f:
+		if Path(outline).suffix.lower() == ".csv":
+			for number, row in enumerate(csv.reader(f), start=1):
+				if number == 1 and row and row[0].strip().lower() == "thread":
+					continue
+				if not any(cell.strip() for cell in row):
+					continue
+				row = [cell.strip() for cell in row] + [""] * (4 - len(row))
+				yield (number, *row[:4])
+		else:
+			for number, line in enumerate(f, start=1):
+				match = OUTLINE_EVENT.match(line)
+				if match:
+					yield number, match.group(2), match.group(1), match.group(3) or "", ""
+
+def import_rows(threads, rows, progress=None):
+	"""
+	Add the thread events of rows (see read_outline_rows) to a story.
+
+	The rows are placed in a single pass: every row is inserted in front
+	of the event at its position in the story as it was before the
+	import (rows with the same position in their order) and rows
+	without position are added at the end. Rows without event type open
+	a thread that has no event yet and develop it otherwise. An opening
+	without description is described by the thread name. The imported
+	story is checked once (see story_problems) and the rows that break
+	the rules (or an event of their thread) are rejected.
+
+	Args:
+		threads: The StoryThreads model of the story.
+		rows: An iterable of rows. The first element of a row tells
+			where it is from (e.g. a file and line number) and is only
+			used to report rejected rows.
+		progress: A function that is called with the number of read rows
+			every IMPORT_PROGRESS_ROWS rows. The default is to not report
+			the progress (None).
+
+	Return:
+		imported: The number of imported events.
+		rejected: A list of (row, reason) tuples of the rejected rows in
+			the order of the rows. The row is None if an event of the
+			story is broken by the import. If any row is rejected, the
+			story is not changed.
+	"""
+	thread_list = threads.thread_list
+	placed = {}
+	rejected = []
+	count = 0
+	for number, thread_id, event, description, position in rows:
+		count += 1
+		if progress is not None and count % IMPORT_PROGRESS_ROWS == 0:
+			progress(count)
+		if not thread_id:
+			rejected.append((number, "The row needs a thread name"))
+			continue
+		if event and not is_event_type(event):
+			rejected.append((number, f"Unknown event type '{event}'"))
+			continue
+		if not description and event == EVENT.DEVELOPMENT:
+			rejected.append((number, f"The development of '{thread_id}' needs a description"))
+			continue
+		try:
+			position = int(position) if position else len(thread_list)
+		except ValueError:
+			rejected.append((number, f"The position '{position}' is no index"))
+			continue
+		if not 0 <= position <= len(thread_list):
+			rejected.append((number, f"The position {position} does not lie within the story"))
+			continue
+		placed.setdefault(position, []).append((number, thread_id, event, description))
+	if progress is not None and count % IMPORT_PROGRESS_ROWS:
+		progress(count)
+
+	with profile_phase("edit"):
+		# merge the rows into the story and infer the missing event types
+		new_list = []
+		rows_of_events = []
+		touched = set()
+		known_threads = set()
+		first = None
+		for position in range(len(thread_list) + 1):
+			for number, thread_id, event, description in placed.get(position, ()):
+				if not event:
+					event = EVENT.DEVELOPMENT.value if thread_id in known_threads else EVENT.OPENING.value
+				if not description and event == EVENT.OPENING:
+					description = thread_id
+				if first is None:
+					first = len(new_list)
+				new_list.append({thread_id: {"event": event, "description": description}})
+				rows_of_events.append(number)
+				touched.add(thread_id)
+				known_threads.add(thread_id)
+			if position < len(thread_list):
+				el = thread_list[position]
+				new_list.append(el)
+				rows_of_events.append(None)
+				if isinstance(el, dict) and len(el) == 1:
+					known_threads.add(next(iter(el)))
+
+	for index, thread_id, problem in story_problems(new_list):
+		if rows_of_events[index] is not None:
+			rejected.append((rows_of_events[index], format_problem(index, thread_id, problem)))
+		elif thread_id in touched:
+			rejected.append((None, format_problem(index, thread_id, problem)))
+	if rejected or first is None:
+		return 0, sorted(rejected, key=lambda rejection: (rejection[0] is None, rejection[0] or ()))
+	imported = len(new_list) - len(thread_list)
+	threads.remember()
+	threads.splice(first, len(thread_list), new_list[first:])
+	return imported, []
+
+def import_outline(args):
+	"""
+	Import the thread events of csv files or Markdown outlines into a
+	story (see import_rows).
+
+	The progress is printed to stderr. If any row is rejected, the
+	rejected rows are printed and nothing is imported. On a dry run,
+	every rejected row is printed and nothing is stored.
+
+	Args:
+		args: The arguments passed to the program by the user.
+
+	Return:
+		rejected: The list of (row number, reason) tuples of the
+			rejected rows.
+
+	Raises:
+		ValueError: If rows are rejected (unless it is a dry run).
+	"""
+	def rows():
+		for outline in args.outlines:
+			for number, *row in read_outline_rows(outline):
+				yield ((outline, number), *row)
+
+	def progress(count):
+		print(f"Read {count} rows", file=sys.stderr)
+
+	threads = StoryThreads(args.story, FileStore(args.story, args.path))
+	imported, rejected = import_rows(threads, rows(), progress)
+	messages = [f"{row[0]}:{row[1]}: {reason}" if row is not None else f"{args.story}: {reason}" for row, reason in rejected]
+	if args.dry_run:
+		for message in messages:
+			print(message)
+		print(f"Would import {imported} events ({len(rejected)} rejected).")
+		return rejected
+	if rejected:
+		raise ValueError(f"{len(rejected)} rows were rejected (see --dry-run), nothing was imported:\n" + "\n".join(messages[:10]))
+	threads.save("import")
+	print(f"Imported {imported} events.")
+	return rejected
+
+
+### compare and merge stories ###
+
+def read_story_file(storythread_file):
+	"""
+	Load the story threads from a json or jsonl file.
+
+	Unlike retrieve_storythreads, the file is given by its full path
+	and may have any name (e.g. the temporary files of git), so the
+	format is found out from the content. A directory is read as a
+	sharded story.
+
+	Args:
+		storythread_file: The path to the story file.
+
+	Return:
+		thread_list: The list of dictionaries that represent story
+			threads.
+		jsonl (Boolean): True if the file is a jsonl file, else False.
+	"""
+	if Path(storythread_file).is_dir():
+		return retrieve_shards(storythread_file, retrieve_manifest(storythread_file)), False
+	with open(storythread_file, "rb") as f:
+		content = f.read()
+	if Path(storythread_file).suffix != ".jsonl":
+		try:
+			return parse_story(content), False
+		except (ValueError, AttributeError):
+			# several lines of jsonl are no valid json, a single line
+			# has no indices as keys
+			pass
+	return parse_story(content, jsonl=True), True
+
+def write_story_file(storythread_file, thread_list, jsonl=False):
+	"""
+	Store the story threads in a json or jsonl file.
+
+	Args:
+		storythread_file: The path to the story file.
+		thread_list: The list of dictionaries that represent story
+			threads.
+		jsonl (Boolean): A flag to store the story as jsonl. The default
+			is json (False).
+	"""
+	if jsonl:
+		content = encode_jsonl(thread_list)
+	else:
+		content = json.dumps({i: el for i, el in enumerate(thread_list)}, ensure_ascii=False).encode("utf-8")
+	with open(storythread_file, "wb") as f:
+		f.write(content)
+
+def event_key(el):
+	"""
+	Identify an event by its thread, type and description.
+
+	Args:
+		el: The dictionary that represents a story thread event.
+
+	Return:
+		key: A (thread id, event, description) tuple.
+	"""
+	name = next(iter(el.keys()))
+	return (name, el[name].get("event"), el[name].get("description", ""))
+
+def match_sequences(a, b):
+	"""
+	Find the longest common subsequence of two sequences.
+
+	This is the linear space variant of Myers' diff algorithm, which
+	takes O((n+m)d) time for n and m elements and d differences. Common
+	prefixes and suffixes are matched first, the rest is split at the
+	middle snake of the shortest edit script until it is trivial.
+
+	Args:
+		a: The first sequence of hashable elements.
+		b: The second sequence of hashable elements.
+
+	Return:
+		matches: The ascending list of (index in a, index in b) pairs
+			of the matched elements.
+	"""
+	matches = []
+	# ranges of a and b to diff or matched ranges (with a negative
+	# marker) in the order they are to be reported
+	stack = [(0, len(a), 0, len(b))]
+	while stack:
+		a_lo, a_hi, b_lo, b_hi = stack.pop()
+		if a_lo < 0:
+			# a matched range: (-1 - start in a, length, start in b, 0)
+			matches.extend((-1 - a_lo + i, b_lo + i) for i in range(a_hi))
+			continue
+		# common prefix
+		prefix = 0
+		while a_lo + prefix < a_hi and b_lo + prefix < b_hi and a[a_lo + prefix] == b[b_lo + prefix]:
+			prefix += 1
+		matches.extend((a_lo + i, b_lo + i) for i in range(prefix))
+		a_lo += prefix
+		b_lo += prefix
+		# common suffix
+		suffix = 0
+		while a_lo < a_hi - suffix and b_lo < b_hi - suffix and a[a_hi - suffix - 1] == b[b_hi - suffix - 1]:
+			suffix += 1
+		a_hi -= suffix
+		b_hi -= suffix
+		if suffix:
+			stack.append((-1 - a_hi, suffix, b_hi, 0))
+		if a_lo == a_hi or b_lo == b_hi:
+			continue
+		x, y = middle_snake(a, a_lo, a_hi, b, b_lo, b_hi)
+		# the second half is reported after the first one
+		stack.append((a_lo + x, a_hi, b_lo + y, b_hi))
+		stack.append((a_lo, a_lo + x, b_lo, b_lo + y))
+	return matches
+
+def middle_snake(a, a_lo, a_hi, b, b_lo, b_hi):
+	"""
+	Find where to split two ranges for Myers' diff algorithm.
+
+	The shortest edit script is searched from both ends at once until
+	the two searches overlap (see match_sequences).
+
+	Args:
+		a: The first sequence.
+		a_lo: The start of the range of the first sequence.
+		a_hi: The end of the range of the first sequence.
+		b: The second sequence.
+		b_lo: The start of the range of the second sequence.
+		b_hi: The end of the range of the second sequence.
+
+	Return:
+		x: The offset in the range of a to split at.
+		y: The offset in the range of b to split at.
+	"""
+	n = a_hi - a_lo
+	m = b_hi - b_lo
+	max_d = (n + m + 1) // 2
+	offset = max_d
+	# the furthest reaching x on every diagonal k of the forward (v1)
+	# and the backward (v2) search
+	v1 = [-1] * (2 * max_d + 2)
+	v1[offset + 1] = 0
+	v2 = v1[:]
+	delta = n - m
+	# the forward search finds the overlap if delta is odd
+	front = delta % 2 != 0
+	k1start = k1end = k2start = k2end = 0
+	for d in range(max_d):
+		for k1 in range(-d + k1start, d + 1 - k1end, 2):
+			k1_offset = offset + k1
+			if k1 == -d or (k1 != d and v1[k1_offset - 1] < v1[k1_offset + 1]):
+				x1 = v1[k1_offset + 1]
+			else:
+				x1 = v1[k1_offset - 1] + 1
+			y1 = x1 - k1
+			while x1 < n and y1 < m and a[a_lo + x1] == b[b_lo + y1]:
+				x1 += 1
+				y1 += 1
+			v1[k1_offset] = x1
+			if x1 > n:
+				k1end += 2
+			elif y1 > m:
+				k1start += 2
+			elif front:
+				k2_offset = offset + delta - k1
+				if 0 <= k2_offset < len(v2) and v2[k2_offset] != -1 and x1 >= n - v2[k2_offset]:
+					return x1, y1
+		for k2 in range(-d + k2start, d + 1 - k2end, 2):
+			k2_offset = offset + k2
+			if k2 == -d or (k2 != d and v2[k2_offset - 1] < v2[k2_offset + 1]):
+				x2 = v2[k2_offset + 1]
+			else:
+				x2 = v2[k2_offset - 1] + 1
+			y2 = x2 - k2
+			while x2 < n and y2 < m and a[a_hi - x2 - 1] == b[b_hi - y2 - 1]:
+				x2 += 1
+				y2 += 1
+			v2[k2_offset] = x2
+			if x2 > n:
+				k2end += 2
+			elif y2 > m:
+				k2start += 2
+			elif not front:
+				k1_offset = offset + delta - k2
+				if 0 <= k1_offset < len(v1) and v1[k1_offset] != -1:
+					x1 = v1[k1_offset]
+					y1 = offset + x1 - k1_offset
+					if x1 >= n - x2:
+						return x1, y1
+	# nothing in common, split anywhere
+	return n, 0
+
+def story_changes(old_list, new_list):
+	"""
+	Find the structural changes between two versions of a story.
+
+	The events are aligned by their thread, type and description (see
+	match_sequences). Events of the old version that are not aligned
+	are removed, those of the new version are inserted, and an event
+	that is removed and inserted elsewhere is moved.
+
+	Args:
+		old_list: The old list of dictionaries that represent story
+			threads.
+		new_list: The new list of dictionaries that represent story
+			threads.
+
+	Return:
+		changes: A dictionary with the changed thread ids as keys and
+			dictionaries with the "status" ("added", "removed",
+			"closed", "reopened" or "changed") and the "events" as
+			values. The events are ("+" or "-" or "~", old index or
+			None, new index or None, event, description) tuples in the
+			order of the new version.
+	"""
+	old_keys = [event_key(el) for el in old_list]
+	new_keys = [event_key(el) for el in new_list]
+	# compare small integers instead of tuples
+	ids = {}
+	matches = match_sequences([ids.setdefault(key, len(ids)) for key in old_keys], [ids.setdefault(key, len(ids)) for key in new_keys])
+	old_matched = {i for i, j in matches}
+	new_matched = {j for i, j in matches}
+	removed = {}
+	for i, key in enumerate(old_keys):
+		if i not in old_matched:
+			removed.setdefault(key, []).append(i)
+	events = {}
+	for j, key in enumerate(new_keys):
+		if j in new_matched:
+			continue
+		if removed.get(key):
+			events.setdefault(key[0], []).append(("~", removed[key].pop(0), j, key[1], key[2]))
+		else:
+			events.setdefault(key[0], []).append(("+", None, j, key[1], key[2]))
+	for key, positions in removed.items():
+		for i in positions:
+			events.setdefault(key[0], []).append(("-", i, None, key[1], key[2]))
+
+	old_closed = {key[0] for key in old_keys if key[1] == EVENT.CLOSING}
+	new_closed = {key[0] for key in new_keys if key[1] == EVENT.CLOSING}
+	old_threads = {key[0] for key in old_keys}
+	new_threads = {key[0] for key in new_keys}
+	changes = {}
+	for name, thread_events in events.items():
+		if name not in old_threads:
+			status = "added"
+		elif name not in new_threads:
+			status = "removed"
+		elif name in new_closed and name not in old_closed:
+			status = "closed"
+		elif name in old_closed and name not in new_closed:
+			status = "reopened"
+		else:
+			status = "changed"
+		thread_events.sort(key=lambda event: (event[2] if event[2] is not None else event[1], event[0] != "-"))
+		changes[name] = {"status": status, "events": thread_events}
+	return changes
+
+def diff_stories(args):
+	"""
+	Show the structural changes between two story files.
+
+	Prints the changed threads with their status and the inserted (+),
+	removed (-) and moved (~) events with their indices.
+
+	Args:
+		args: The arguments passed to the program by the user.
+
+	Return:
+		changes: The changes of the threads (see story_changes).
+	"""
+	old_list = read_story_file(args.old)[0]
+	new_list = read_story_file(args.new)[0]
+	changes = story_changes(old_list, new_list)
+	if not changes:
+		print("No structural changes.")
+		return changes
+	for name, change in changes.items():
+		print(f"{name} ({change['status']})")
+		for kind, old_index, new_index, event, description in change["events"]:
+			position = {"+": f"{new_index}", "-": f"{old_index}", "~": f"{old_index} -> {new_index}"}[kind]
+			print(f"  {kind} {position} {event}: {description}")
+	counts = [sum(1 for change in changes.values() for event in change["events"] if event[0] == kind) for kind in "+-~"]
+	print(f"Events: {counts[0]} inserted, {counts[1]} removed, {counts[2]} moved.")
+	return changes
+
+
+def side_changes(base, side, base_positions):
+	"""
+	Find the changes of one side of a merge as anchored operations.
+
+	Every event of the side that is not aligned with the base (see
+	match_sequences) is anchored to the event in front of it. It is a
+	move if the base has an unaligned event with the same key, else an
+	insertion. The unaligned events of the base without counterpart are
+	removed.
+
+	Args:
+		base: The keys of the base events (see event_key).
+		side: The keys of the events of the side.
+		base_positions: A dictionary with the keys of the base as keys
+			and the ascending lists of their indices as values.
+
+	Return:
+		operations: A list of (node, index in the side, anchor) tuples
+			in the order of the side. The node is the index of the moved
+			base event or None for an insertion. The anchor is the node
+			in front of it, either ("base", index) or ("new", index in
+			the side), or None at the start of the story.
+		removed: The set of indices of the removed base events.
+	"""
+	matches = match_sequences(base, side)
+	aligned = {j: i for i, j in matches}
+	unaligned = {}
+	matched_base = set(aligned.values())
+	for key, positions in base_positions.items():
+		for i in positions:
+			if i not in matched_base:
+				unaligned.setdefault(key, []).append(i)
+	operations = []
+	anchor = None
+	for j, key in enumerate(side):
+		if j in aligned:
+			anchor = ("base", aligned[j])
+			continue
+		if unaligned.get(key):
+			node = unaligned[key].pop(0)
+			operations.append((node, j, anchor))
+			anchor = ("base", node)
+		else:
+			operations.append((None, j, anchor))
+			anchor = ("new", j)
+	removed = {i for positions in unaligned.values() for i in positions}
+	return operations, removed
+
+def merge_story_lists(base_list, ours_list, theirs_list):
+	"""
+	Merge two versions of a story that were changed from the same base.
+
+	The changes of both sides are found as insertions, moves and
+	removals of events, each anchored to the event in front of it (see
+	side_changes). Starting from the base, their changes are applied
+	first, then ours, so that our events come first where both sides
+	added events at the same place. Removed events stay as anchors for
+	the events after them.
+	Conflicts are events that both sides moved or added to different
+	places (ours are kept), events that one side moved and the other
+	removed (the moved event is kept) and any broken thread order of
+	the result.
+
+	Args:
+		base_list: The list of dictionaries that represent the story
+			threads of the common base.
+		ours_list: The list of dictionaries that represent our story
+			threads.
+		theirs_list: The list of dictionaries that represent their
+			story threads.
+
+	Return:
+		merged_list: The merged list of dictionaries that represent
+			story threads.
+		conflicts: A list of descriptions of the conflicts.
+	"""
+	# compare small integers instead of tuples
+	ids = {}
+	base = [ids.setdefault(event_key(el), len(ids)) for el in base_list]
+	ours = [ids.setdefault(event_key(el), len(ids)) for el in ours_list]
+	theirs = [ids.setdefault(event_key(el), len(ids)) for el in theirs_list]
+	base_positions = {}
+	for i, key in enumerate(base):
+		base_positions.setdefault(key, []).append(i)
+	ours_operations, ours_removed = side_changes(base, ours, base_positions)
+	theirs_operations, theirs_removed = side_changes(base, theirs, base_positions)
+
+	# the story as doubly linked list of nodes, starting with None
+	following = {None: None}
+	preceding = {}
+	events = {}
+	def unlink(node):
+		following[preceding[node]] = following[node]
+		if following[node] is not None:
+			preceding[following[node]] = preceding[node]
+	def insert(node, anchor):
+		following[node] = following[anchor]
+		if following[anchor] is not None:
+			preceding[following[anchor]] = node
+		following[anchor] = node
+		preceding[node] = anchor
+	previous = None
+	for i, el in enumerate(base_list):
+		events[("base", i)] = el
+		insert(("base", i), previous)
+		previous = ("base", i)
+
+	conflicts = []
+	def describe(node):
+		name, event, description = event_key(events[node])
+		return f"the {event} of {name} ({description})"
+	def anchor_key(anchor):
+		return None if anchor is None else event_key(events[anchor])
+	# the nodes of the new events of each side
+	new_nodes = {"theirs": {}, "ours": {}}
+	# where the moved and new events of their side are anchored
+	theirs_moves = {}
+	theirs_new = {}
+	for side, side_list, operations in [("theirs", theirs_list, theirs_operations), ("ours", ours_list, ours_operations)]:
+		for node, j, anchor in operations:
+			if anchor is not None and anchor[0] == "new":
+				anchor = new_nodes[side][anchor[1]]
+			if node is not None:
+				node = ("base", node)
+				if side == "theirs":
+					theirs_moves[node] = anchor_key(anchor)
+				elif node in theirs_moves and theirs_moves[node] != anchor_key(anchor):
+					conflicts.append(f"Both sides moved {describe(node)} to different places, kept ours")
+				unlink(node)
+				insert(node, anchor)
+				continue
+			key = ids[event_key(side_list[j])]
+			if side == "ours" and key in theirs_new:
+				theirs_node, theirs_anchor = theirs_new.pop(key)
+				new_nodes[side][j] = theirs_node
+				if theirs_anchor == anchor_key(anchor):
+					# both sides added the same event at the same place
+					continue
+				conflicts.append(f"Both sides added {describe(theirs_node)} in different places, kept ours")
+				unlink(theirs_node)
+				insert(theirs_node, anchor)
+				continue
+			node = (side, j)
+			events[node] = side_list[j]
+			new_nodes[side][j] = node
+			if side == "theirs":
+				theirs_new[key] = (node, anchor_key(anchor))
+			insert(node, anchor)
+
+	removed = set()
+	for side, side_removed, other_operations in [("ours", ours_removed, theirs_operations), ("theirs", theirs_removed, ours_operations)]:
+		other_moved = {node for node, j, anchor in other_operations if node is not None}
+		for i in side_removed:
+			if i in other_moved:
+				conflicts.append(f"{'We' if side == 'ours' else 'They'} removed {describe(('base', i))} that {'they' if side == 'ours' else 'we'} moved, kept it")
+			else:
+				removed.add(("base", i))
+
+	merged_list = []
+	node = following[None]
+	while node is not None:
+		if node not in removed:
+			merged_list.append(events[node])
+		node = following[node]
+	for index, name, problem in thread_order_violations(merged_list):
+		conflicts.append(f"The merged story is broken: {format_problem(index, name, problem)}")
+	return merged_list, conflicts
+
+def merge_stories(args):
+	"""
+	Merge two story files that were changed from the same base file.
+
+	The merged story is stored in the given output file or in place of
+	our file (like git expects from a merge driver) in the format of
+	our file. The conflicts are printed (see merge_story_lists).
+
+	Args:
+		args: The arguments passed to the program by the user.
+
+	Return:
+		conflicts: A list of descriptions of the conflicts.
+	"""
+	base_list = read_story_file(args.base)[0]
+	ours_list, jsonl = read_story_file(args.ours)
+	theirs_list = read_story_file(args.theirs)[0]
+	merged_list, conflicts = merge_story_lists(base_list, ours_list, theirs_list)
+	write_story_file(getattr(args, "output", None) or args.ours, merged_list, jsonl)
+	for conflict in conflicts:
+		print(f"Conflict: {conflict}")
+	if not conflicts:
+		print(f"Merged {len(merged_list)} events without conflicts.")
+	return conflicts
+
+
+### work on all stories of a path ###
+
+def discover_stories(path):
+	"""
+	Find all stories in a path and its subdirectories.
+
+	Hidden files and directories (like the undo caches and search
+	indices of the stories) are skipped. The directories of sharded
+	stories are stories themselves.
+
+	Args:
+		path: The path to search for story files.
+
+	Return:
+		stories: The sorted story names relative to the path (without
+			the file extension).
+	"""
+	stories = []
+	root = Path(path or ".")
+	for directory, directories, files in os.walk(root):
+		directories[:] = [d for d in directories if not d.startswith(".")]
+		for d in directories:
+			if d.endswith(".shards"):
+				stories.append(Path(directory, d).relative_to(root).with_suffix("").as_posix())
+		directories[:] = [d for d in directories if not d.endswith(".shards")]
+		for file in files:
+			if file.endswith((".json", ".jsonl")) and not file.startswith("."):
+				stories.append(Path(directory, file).relative_to(root).with_suffix("").as_posix())
+	# a story may be stored in both formats
+	return sorted(set(stories))
+
+def run_story_command(function, args, story):
+	"""
+	Run a command on a single story and capture what it prints.
+
+	Any exception of the command is caught, so that a broken story
+	does not abort the work on the other stories. A story in a
+	subdirectory is run in its own directory, so that its hidden files
+	(like its undo cache and search index) are kept next to it.
+
+	Args:
+		function: The command (e.g. show_threads).
+		args: The arguments passed to the program by the user.
+		story: The name of the story relative to the path (see
+			discover_stories).
+
+	Return:
+		story: The name of the story.
+		output: What the command printed.
+		result: What the command returned (None if it failed).
+		error: The error message or None if the command succeeded.
+	"""
+	story_args = argparse.Namespace(**vars(args))
+	story_args.path = Path(args.path or ".", Path(story).parent)
+	story_args.story = Path(story).name
+	output = io.StringIO()
+	result = None
+	error = None
+	try:
+		with contextlib.redirect_stdout(output):
+			result = function(story_args)
+	except Exception as e:
+		error = f"{type(e).__name__}: {e}"
+	return story, output.getvalue(), result, error
+
+def run_workspace(args, function, quiet=False, failing_results=False):
+	"""
+	Run a command on all stories of a path in parallel.
+
+	The stories are processed by a pool of processes, but the output is
+	printed in the order of the story names as soon as it is available.
+	Failing stories are reported and do not stop the other stories.
+
+	Args:
+		args: The arguments passed to the program by the user.
+		function: The command to run on every story (e.g.
+			show_threads).
+		quiet (Boolean): A flag to skip the output of stories for which
+			the command returns nothing (e.g. no search result). The
+			default is to print the output of all stories (False).
+		failing_results (Boolean): A flag to count the stories for
+			which the command returns something (e.g. problems) as
+			failed. The default is to only count the stories the
+			command raised an error for (False).
+
+	Return:
+		failures: A list of (story, error) tuples of the stories the
+			command failed on.
+	"""
+	import concurrent.futures
+	stories = discover_stories(args.path)
+	if not stories:
+		print("There is no story in this path.")
+		return []
+	jobs = min(getattr(args, "jobs", None) or os.cpu_count() or 1, len(stories))
+	if jobs == 1:
+		results = (run_story_command(function, args, story) for story in stories)
+	else:
+		executor = concurrent.futures.ProcessPoolExecutor(max_workers=jobs)
+		chunksize = max(1, len(stories) // (jobs * 4))
+		results = executor.map(run_story_command, [function] * len(stories), [args] * len(stories), stories, chunksize=chunksize)
+	failures = []
+	try:
+		for story, output, result, error in results:
+			if error is not None:
+				failures.append((story, error))
+				print(f"=== {story} ===\n{output}Error: {error}")
+			else:
+				if not quiet or result:
+					print(f"=== {story} ===\n{output}", end="")
+				if failing_results and result:
+					failures.append((story, f"{len(result)} problem(s)"))
+	finally:
+		if jobs > 1:
+			executor.shutdown()
+	print(f"Processed {len(stories)} stories" + (f", {len(failures)} failed: {', '.join(story for story, error in failures)}" if failures else "") + ".")
+	return failures
+
+def show_all(args):
+	"""
+	Show the threads of all stories of a path (see show_threads).
+
+	Args:
+		args: The arguments passed to the program by the user.
+	"""
+	return run_workspace(args, show_threads)
+
+def stats_all(args):
+	"""
+	Show the numbers of all stories of a path (see show_stats).
+
+	Args:
+		args: The arguments passed to the program by the user.
+	"""
+	return run_workspace(args, show_stats)
+
+def check_all(args):
+	"""
+	Check all stories of a path and show those with problems (see
+	check_story).
+
+	Args:
+		args: The arguments passed to the program by the user.
+
+	Return:
+		failures: A list of (story, error) tuples of the stories that
+			have problems (after the repair if they are repaired) or
+			could not be checked.
+	"""
+	return run_workspace(args, check_story, quiet=not getattr(args, "repair", False), failing_results=True)
+
+def search_all(args):
+	"""
+	Search all stories of a path and show those with matching events
+	(see search_threads).
+
+	Args:
+		args: The arguments passed to the program by the user.
+	"""
+	return run_workspace(args, search_threads, quiet=True)
@@ -0,0 +1,65 @@
+import pytest
+
+import benchmark
+import story_threads
+
+
+### test generate ###
+
+@pytest.mark.parametrize("events, threads, depth, open_ratio", [(10, 3, 2, 0), (500, 20, 4, 0.25), (1000, 1000, 8, 0.5)])
+def test_generate_valid_story(events, threads, depth, open_ratio):
+	thread_list = benchmark.generate_story(events, threads, depth, open_ratio)
+
+	assert len(thread_list) == events
+	assert story_threads.story_problems(thread_list) == []
+
+def test_generate_open_ratio():
+	thread_list = benchmark.generate_story(1000, 40, 5, 0.25)
+	thread_index = story_threads.index_thread_positions(thread_list)
+	open_threads = [name for name, positions in thread_index.items() if thread_list[positions[-1]][name]["event"] != "close"]
+
+	assert len(thread_index) == 40
+	assert len(open_threads) == 10
+
+def test_generate_depth():
+	thread_list = benchmark.generate_story(1000, 40, 3, 0)
+	open_threads = set()
+	for el in thread_list:
+		name = next(iter(el.keys()))
+		open_threads.add(name)
+		assert len(open_threads) <= 3
+		if el[name]["event"] == "close":
+			open_threads.remove(name)
+
+
+### test compare ###
+
+def test_compare_results():
+	baseline = {"show": {"100": 1.0, "1000": 2.0}, "add": {"100": 1.0}}
+	results = {"show": {"100": 1.1, "1000": 3.0}, "add": {"100": 0.5}, "undo": {"100": 9.0}}
+
+	assert benchmark.compare_results(results, baseline, 0.25) == [("show", "1000", 2.0, 3.0)]
+
+def test_run_benchmarks():
+	results = benchmark.run_benchmarks([50], repeat=1, operations=["show", "add"], log=lambda message: None)
+
+	assert set(results) == {"show", "add"}
+	assert set(results["show"]) == {"50"}
+
+
+### test operations ###
+
+@pytest.mark.parametrize("open_ratio", [0, 0.1, 0.5, 0.9, 1])
+@pytest.mark.parametrize("threads", [1, 5])
+def test_benchmark_operations(tmp_path, open_ratio, threads):
+	# a single thread can end with a development as last event
+	thread_list = benchmark.generate_story(100, threads, 3, open_ratio)
+	operations = benchmark.benchmark_operations(thread_list)
+
+	assert ("change" in operations) == (threads > 1)
+
+	story_threads.store_storythreads("runtests", tmp_path, thread_list)
+	for name in ["add", "change"]:
+		if name in operations:
+			operations[name]("runtests", tmp_path, thread_list)
+	assert story_threads.story_problems(story_threads.retrieve_storythreads("runtests", tmp_path)) == []
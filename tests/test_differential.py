@@ -0,0 +1,44 @@
+import types
+
+import pytest
+
+import differential
+import story_threads
+
+
+### test differential ###
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_no_difference(seed):
+	operations = differential.random_operations(seed, 20)
+
+	assert len(operations) > 0
+	assert differential.find_difference(operations) is None
+
+def test_random_connections():
+	operations = differential.random_operations(0, 20)
+
+	assert {operation["show_connections"] for operation in operations} == {False, True}
+
+def test_no_difference_jsonl():
+	assert differential.find_difference(differential.random_operations(3, 20), jsonl=True) is None
+
+def test_find_and_shrink_difference():
+	def broken_undo(args):
+		# forgets to restore the story
+		pass
+	broken = types.SimpleNamespace(**{name: getattr(story_threads, name) for name in ["add_thread", "remove_thread", "change_thread", "show_threads", "retrieve_storythreads"]}, undo=broken_undo)
+	operations = [
+		{"op": "add", "names": ["A", "a"], "indices": [0], "close": False},
+		{"op": "add", "names": ["B", "b"], "indices": [1], "close": False},
+		{"op": "add", "names": ["C", "c"], "indices": [2], "close": False},
+		{"op": "undo"},
+	]
+
+	difference = differential.find_difference(operations, optimized=broken)
+	assert difference["step"] == 3
+	assert difference["aspect"] == "thread_list"
+
+	shrunk = differential.shrink(operations, lambda candidate: differential.find_difference(candidate, optimized=broken) is not None)
+	assert len(shrunk) == 2
+	assert shrunk[0]["op"] == "add" and shrunk[1]["op"] == "undo"
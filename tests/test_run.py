@@ -2,7 +2,11 @@ import pytest
 from unittest.mock import patch, mock_open
 
 import json
+import os
+import shutil
+import subprocess
 import sys
+import time
 import argparse
 from pathlib import Path
 
@@ -84,6 +88,58 @@ C_ARGS = argparse.Namespace(
 	ending = []
 )
 
+MV_ARGS = argparse.Namespace(
+	story = "runtests",
+	path = "",
+	show_connections = False,
+	range = [],
+	to = 0
+)
+
+RN_ARGS = argparse.Namespace(
+	story = "runtests",
+	path = "",
+	show_connections = False,
+	old = "",
+	new = "",
+	opening = False
+)
+
+S_ARGS = argparse.Namespace(
+	story = "runtests",
+	path = "",
+	show_connections = False,
+	query = [],
+	fuzzy = False
+)
+
+CHECK_ARGS = argparse.Namespace(
+	story = "runtests",
+	path = "",
+	show_connections = False,
+	repair = False
+)
+
+ALL_ARGS = argparse.Namespace(
+	story = None,
+	path = "",
+	show_connections = False,
+	repair = False,
+	query = [],
+	fuzzy = False,
+	jobs = 1
+)
+
+BROKEN_THREADS = {
+	"0": {"a": {"event": "develop", "description": "a starts"}},
+	"1": {"a": {"event": "open", "description": "a"}},
+	"2": {"a": {"event": "close", "description": ""}},
+	"3": {"a": {"event": "close", "description": "a ends"}},
+	"4": {"b": {"event": "open", "description": "b"}},
+	"5": {"b": {"event": "close", "description": "b ends"}},
+	"6": {"b": {"event": "develop", "description": "b continues"}},
+	"7": "garbage"}
+
 
 def get_descriptions(thread):
 	"""
@@ -605,6 +661,99 @@ def test_remove_multiple_devs(monkeypatch, tmp_path):
 		result = json.load(f)
 		assert result == expected
 
+def test_remove_multiple_threads(monkeypatch, tmp_path):
+	with open(Path(tmp_path, "runtests.json"), "w") as f:
+		json.dump(WHOLE_THREAD_FIRST, f, ensure_ascii=False)
+
+	RM_ARGS.path = tmp_path
+	monkeypatch.setattr(RM_ARGS, "name", ["antagonist in disguise", "protagonist feels lonely"])
+
+	story_threads.remove_thread(RM_ARGS)
+
+	with open(Path(tmp_path, "runtests.json"), "r") as f:
+		result = json.load(f)
+		assert result == {}
+
+def test_remove_dev_of_other_thread(monkeypatch, tmp_path, capsys):
+	with open(Path(tmp_path, "runtests.json"), "w") as f:
+		json.dump(WHOLE_THREAD_FIRST, f, ensure_ascii=False)
+
+	expected = WHOLE_THREAD_FIRST.copy()
+	monkeypatch.setitem(expected, "2", expected["3"])
+	monkeypatch.setitem(expected, "3", expected["4"])
+	monkeypatch.delitem(expected, "4")
+
+	RM_ARGS.path = tmp_path
+	monkeypatch.setattr(RM_ARGS, "name", "antagonist in disguise")
+	monkeypatch.setattr(RM_ARGS, "development", ["protagonist gains a friend", "0", "2", "9"])
+
+	story_threads.remove_thread(RM_ARGS)
+
+	output = capsys.readouterr().out
+	assert "index 0 as it belongs to a different thread" in output
+	assert "index 3 as it belongs to a different thread" in output
+	assert "index 9 as it does not exist" in output
+	with open(Path(tmp_path, "runtests.json"), "r") as f:
+		result = json.load(f)
+		assert result == expected
+
+def test_remove_dev_by_partial_description(monkeypatch, tmp_path):
+	expected = TWO_DEVS_THREAD
+	monkeypatch.setitem(expected, "3", {"hero searches artifact":
+		{"event": "close", "description": ""}})
+
+	with open(Path(tmp_path, "runtests.json"), "w") as f:
+		json.dump(TWO_DEVS_THREAD, f, ensure_ascii=False)
+
+	monkeypatch.setitem(expected, "2", expected["3"])
+	monkeypatch.delitem(expected, "3")
+
+	RM_ARGS.path = tmp_path
+	monkeypatch.setattr(RM_ARGS, "name", "hero searches artifact")
+	monkeypatch.setattr(RM_ARGS, "development", ["Final clue"])
+
+	story_threads.remove_thread(RM_ARGS)
+
+	with open(Path(tmp_path, "runtests.json"), "r") as f:
+		result = json.load(f)
+		assert result == expected
+
+def test_remove_dev_by_ambiguous_description(monkeypatch, tmp_path):
+	with open(Path(tmp_path, "runtests.json"), "w") as f:
+		json.dump(TWO_DEVS_THREAD, f, ensure_ascii=False)
+
+	RM_ARGS.path = tmp_path
+	monkeypatch.setattr(RM_ARGS, "name", "hero searches artifact")
+	monkeypatch.setattr(RM_ARGS, "development", ["clue"])
+
+	with pytest.raises(ValueError) as e:
+		story_threads.remove_thread(RM_ARGS)
+
+def test_rejected_description_keeps_undo(monkeypatch, tmp_path):
+	thread_list = [
+		{"hero searches artifact": {"event": "open", "description": "hero searches artifact"}},
+		{"hero searches artifact": {"event": "develop", "description": "hero finds the first clue"}},
+		{"hero searches artifact": {"event": "develop", "description": "hero finds the final clue"}}]
+	story_threads.store_storythreads("runtests", tmp_path, thread_list)
+	ADD_ARGS.path = RM_ARGS.path = C_ARGS.path = tmp_path
+	monkeypatch.setattr(ADD_ARGS, "names", ["villain", "villain appears"])
+	monkeypatch.setattr(ADD_ARGS, "indices", [1])
+	story_threads.add_thread(ADD_ARGS)
+
+	# an ambiguous description is rejected before anything is stored
+	monkeypatch.setattr(RM_ARGS, "name", "hero searches artifact")
+	monkeypatch.setattr(RM_ARGS, "development", ["clue"])
+	with pytest.raises(ValueError):
+		story_threads.remove_thread(RM_ARGS)
+	monkeypatch.setattr(C_ARGS, "name", "hero searches artifact")
+	monkeypatch.setattr(C_ARGS, "development", ["clue", "4"])
+	with pytest.raises(ValueError):
+		story_threads.change_thread(C_ARGS)
+
+	story_threads.undo(argparse.Namespace(story="runtests", path=tmp_path, show_connections=False))
+
+	assert story_threads.retrieve_storythreads("runtests", tmp_path) == thread_list
+
 def test_remove_non_existing_ending(monkeypatch, tmp_path):
 	RM_ARGS.path = tmp_path
 	monkeypatch.setattr(RM_ARGS, "name", "protagonist feels lonely")
@@ -707,6 +856,26 @@ def test_rename_ending(monkeypatch, tmp_path):
 		result = json.load(f)
 		assert result == expected
 
+def test_rename_dev_by_partial_description(monkeypatch, tmp_path):
+	with open(Path(tmp_path, "runtests.json"), "w") as f:
+		json.dump(WHOLE_THREAD, f, ensure_ascii=False)
+
+	new_description = "fake-ally learns about disguise"
+
+	expected = WHOLE_THREAD
+	monkeypatch.setitem(expected, "1", {"antagonist in disguise":
+		{"event": "develop", "description": new_description}})
+
+	C_ARGS.path = tmp_path
+	monkeypatch.setattr(C_ARGS, "name", "antagonist in disguise")
+	monkeypatch.setattr(C_ARGS, "development", ["ally kn", new_description])
+
+	story_threads.change_thread(C_ARGS)
+
+	with open(Path(tmp_path, "runtests.json"), "r") as f:
+		result = json.load(f)
+		assert result == expected
+
 def test_change_pos_ending(monkeypatch, tmp_path):
 	with open(Path(tmp_path, "runtests.json"), "w") as f:
 		json.dump(WHOLE_THREAD_FIRST, f, ensure_ascii=False)
@@ -858,6 +1027,1363 @@ def test_change_non_existent_dev(monkeypatch, tmp_path):
 		story_threads.change_thread(C_ARGS)
 
 
+### test rename ###
+
+def test_rename_thread(monkeypatch, tmp_path):
+	with open(Path(tmp_path, "runtests.json"), "w") as f:
+		json.dump(WHOLE_THREAD_FIRST, f, ensure_ascii=False)
+
+	new_name = "villain in disguise"
+	expected = {}
+	for k, el in WHOLE_THREAD_FIRST.items():
+		name = next(iter(el.keys()))
+		expected[k] = {new_name: el[name]} if name == "antagonist in disguise" else el
+
+	RN_ARGS.path = tmp_path
+	monkeypatch.setattr(RN_ARGS, "old", "antagonist in disguise")
+	monkeypatch.setattr(RN_ARGS, "new", new_name)
+
+	story_threads.rename_thread(RN_ARGS)
+
+	with open(Path(tmp_path, "runtests.json"), "r") as f:
+		result = json.load(f)
+		assert result == expected
+	with open(Path(tmp_path, ".runtests.json"), "r") as f:
+		assert json.load(f) == WHOLE_THREAD_FIRST
+
+def test_rename_thread_and_opening(monkeypatch, tmp_path):
+	with open(Path(tmp_path, "runtests.json"), "w") as f:
+		json.dump(WHOLE_THREAD, f, ensure_ascii=False)
+
+	new_name = "villain in disguise"
+	expected = {k: {new_name: el["antagonist in disguise"]} for k, el in WHOLE_THREAD.items()}
+	expected["0"] = {new_name: {"event": "open", "description": new_name}}
+
+	RN_ARGS.path = tmp_path
+	monkeypatch.setattr(RN_ARGS, "old", "antagonist in disguise")
+	monkeypatch.setattr(RN_ARGS, "new", new_name)
+	monkeypatch.setattr(RN_ARGS, "opening", True)
+
+	story_threads.rename_thread(RN_ARGS)
+
+	with open(Path(tmp_path, "runtests.json"), "r") as f:
+		result = json.load(f)
+		assert result == expected
+
+def test_rename_to_existing_thread(monkeypatch, tmp_path):
+	with open(Path(tmp_path, "runtests.json"), "w") as f:
+		json.dump(WHOLE_THREAD_FIRST, f, ensure_ascii=False)
+
+	RN_ARGS.path = tmp_path
+	monkeypatch.setattr(RN_ARGS, "old", "antagonist in disguise")
+	monkeypatch.setattr(RN_ARGS, "new", "protagonist feels lonely")
+
+	with pytest.raises(ValueError) as e:
+		story_threads.rename_thread(RN_ARGS)
+
+
+### test search ###
+
+def test_search(monkeypatch, tmp_path, capsys):
+	with open(Path(tmp_path, "runtests.json"), "w") as f:
+		json.dump(WHOLE_THREAD_FIRST, f, ensure_ascii=False)
+
+	S_ARGS.path = tmp_path
+	monkeypatch.setattr(S_ARGS, "query", ["Disguise"])
+
+	story_threads.search_threads(S_ARGS)
+
+	lines = capsys.readouterr().out.splitlines()
+	assert [line.split()[0] for line in lines] == ["1", "2", "4"]
+
+def test_search_fuzzy(monkeypatch, tmp_path, capsys):
+	with open(Path(tmp_path, "runtests.json"), "w") as f:
+		json.dump(WHOLE_THREAD_FIRST, f, ensure_ascii=False)
+
+	S_ARGS.path = tmp_path
+	monkeypatch.setattr(S_ARGS, "query", ["protagonist gains friends"])
+
+	story_threads.search_threads(S_ARGS)
+	assert capsys.readouterr().out.startswith("No story thread event")
+
+	monkeypatch.setattr(S_ARGS, "fuzzy", True)
+	story_threads.search_threads(S_ARGS)
+	assert [line.split()[0] for line in capsys.readouterr().out.splitlines()] == ["3"]
+
+def test_search_index_is_updated(monkeypatch, tmp_path):
+	thread_list = [WHOLE_THREAD_FIRST[k] for k in sorted(WHOLE_THREAD_FIRST)]
+	story_threads.store_storythreads("runtests", tmp_path, thread_list)
+	search_index = story_threads.retrieve_search_index("runtests", tmp_path)
+	texts = search_index["texts"].copy()
+
+	story_threads.store_storythreads("runtests", tmp_path, thread_list[:3] + thread_list[4:])
+	search_index = story_threads.retrieve_search_index("runtests", tmp_path)
+
+	# the unused description is forgotten without renumbering the others
+	removed = texts.index("protagonist gains a friend")
+	assert search_index["texts"] == texts[:removed] + [None] + texts[removed+1:]
+	assert story_threads.search_events(thread_list[:3] + thread_list[4:], search_index, "friend") == []
+	assert story_threads.search_events(thread_list[:3] + thread_list[4:], search_index, "fails") == [3]
+
+def test_search_index_follows_hand_edits(monkeypatch, tmp_path, capsys):
+	thread_list = [WHOLE_THREAD_FIRST[k] for k in sorted(WHOLE_THREAD_FIRST)]
+	story_threads.store_storythreads("runtests", tmp_path, thread_list)
+	# rename a thread without changing the number of events
+	with open(Path(tmp_path, "runtests.json"), "w") as f:
+		json.dump(WHOLE_THREAD_FIRST, f, ensure_ascii=False)
+	with open(Path(tmp_path, "runtests.json"), "r") as f:
+		content = f.read().replace("antagonist in disguise", "villain in disguise")
+	with open(Path(tmp_path, "runtests.json"), "w") as f:
+		f.write(content)
+	S_ARGS.path = tmp_path
+	monkeypatch.setattr(S_ARGS, "query", ["villain"])
+
+	story_threads.search_threads(S_ARGS)
+
+	assert [line.split()[0] for line in capsys.readouterr().out.splitlines()] == ["1", "2", "4"]
+	assert story_threads.read_search_index("runtests", tmp_path)["story"]["size"] == Path(tmp_path, "runtests.json").stat().st_size
+
+
+### test check ###
+
+def test_check_consistent_story(monkeypatch, tmp_path, capsys):
+	with open(Path(tmp_path, "runtests.json"), "w") as f:
+		json.dump(WHOLE_THREAD_FIRST, f, ensure_ascii=False)
+
+	CHECK_ARGS.path = tmp_path
+
+	assert story_threads.check_story(CHECK_ARGS) == []
+	assert capsys.readouterr().out == "No problems found.\n"
+
+def test_check_broken_story(monkeypatch, tmp_path):
+	with open(Path(tmp_path, "runtests.json"), "w") as f:
+		json.dump(BROKEN_THREADS, f, ensure_ascii=False)
+
+	CHECK_ARGS.path = tmp_path
+
+	assert story_threads.check_story(CHECK_ARGS) == [
+		(0, "a", "develops before it opens"),
+		(1, "a", "opens after it develops or closes"),
+		(3, "a", "closes twice"),
+		(6, "b", "develops after it closes"),
+		(7, None, "is not a single story thread event")]
+	with open(Path(tmp_path, "runtests.json"), "r") as f:
+		assert json.load(f) == BROKEN_THREADS
+
+def test_check_repair(monkeypatch, tmp_path):
+	with open(Path(tmp_path, "runtests.json"), "w") as f:
+		json.dump(BROKEN_THREADS, f, ensure_ascii=False)
+
+	expected = {
+		"0": {"a": {"event": "open", "description": "a starts"}},
+		"1": {"a": {"event": "develop", "description": "a"}},
+		"2": {"a": {"event": "close", "description": "a ends"}},
+		"3": {"b": {"event": "open", "description": "b"}},
+		"4": {"b": {"event": "develop", "description": "b continues"}},
+		"5": {"b": {"event": "close", "description": "b ends"}}}
+
+	CHECK_ARGS.path = tmp_path
+	monkeypatch.setattr(CHECK_ARGS, "repair", True)
+
+	assert story_threads.check_story(CHECK_ARGS) == []
+	with open(Path(tmp_path, "runtests.json"), "r") as f:
+		assert json.load(f) == expected
+	with open(Path(tmp_path, ".runtests.json"), "r") as f:
+		assert json.load(f) == BROKEN_THREADS
+
+
+### test profile ###
+
+def test_profile_phases_add_up(monkeypatch):
+	monkeypatch.setattr(story_threads, "PHASE_TIMES", {})
+
+	with story_threads.profile_phase("outer"):
+		with story_threads.profile_phase("inner"):
+			pass
+		with story_threads.profile_phase("inner"):
+			pass
+
+	assert set(story_threads.PHASE_TIMES) == {"outer", "inner"}
+	assert story_threads.format_phase_times(1.0).endswith("total 1000.00 ms")
+
+def test_profile_add(monkeypatch, tmp_path):
+	monkeypatch.setattr(story_threads, "PHASE_TIMES", {})
+
+	ADD_ARGS.path = tmp_path
+	monkeypatch.setattr(ADD_ARGS, "names", ["hero searches artifact", "hero finds the first clue"])
+	monkeypatch.setattr(ADD_ARGS, "indices", [0, 1])
+	monkeypatch.setattr(ADD_ARGS, "close", False)
+
+	story_threads.add_thread(ADD_ARGS)
+
+	assert set(story_threads.PHASE_TIMES) == {"load", "validate", "cache", "edit", "history", "store", "index", "render"}
+	assert story_threads.PHASE_STACK == []
+
+
+### test move ###
+
+def test_move_block_to_front(monkeypatch, tmp_path):
+	with open(Path(tmp_path, "runtests.json"), "w") as f:
+		json.dump(WHOLE_THREAD_FIRST, f, ensure_ascii=False)
+
+	expected = {str(i): WHOLE_THREAD_FIRST[k] for i, k in enumerate(["1", "2", "0", "3", "4"])}
+
+	MV_ARGS.path = tmp_path
+	monkeypatch.setattr(MV_ARGS, "range", [1, 2])
+	monkeypatch.setattr(MV_ARGS, "to", 0)
+
+	story_threads.move_events(MV_ARGS)
+
+	with open(Path(tmp_path, "runtests.json"), "r") as f:
+		result = json.load(f)
+		assert result == expected
+
+def test_move_block_to_end(monkeypatch, tmp_path):
+	with open(Path(tmp_path, "runtests.json"), "w") as f:
+		json.dump(WHOLE_THREAD_FIRST, f, ensure_ascii=False)
+
+	expected ={str(i): WHOLE_THREAD_FIRST[k] for i, k in enumerate(["0", "3", "1", "2", "4"])}
+
+	MV_ARGS.path = tmp_path
+	monkeypatch.setattr(MV_ARGS, "range", [1, 2])
+	monkeypatch.setattr(MV_ARGS, "to", 4)
+
+	story_threads.move_events(MV_ARGS)
+
+	with open(Path(tmp_path, "runtests.json"), "r") as f:
+		result = json.load(f)
+		assert result == expected
+
+def test_move_breaks_every_thread(monkeypatch, tmp_path):
+	with open(Path(tmp_path, "runtests.json"), "w") as f:
+		json.dump(WHOLE_THREAD_FIRST, f, ensure_ascii=False)
+
+	MV_ARGS.path = tmp_path
+	monkeypatch.setattr(MV_ARGS, "range", [3, 4])
+	monkeypatch.setattr(MV_ARGS, "to", 0)
+
+	with pytest.raises(ValueError) as e:
+		story_threads.move_events(MV_ARGS)
+	assert "protagonist feels lonely: develops before it opens" in str(e.value)
+	assert "antagonist in disguise: closes before it opens" in str(e.value)
+	with open(Path(tmp_path, "runtests.json"), "r") as f:
+		assert json.load(f) == WHOLE_THREAD_FIRST
+
+def test_move_into_own_range(monkeypatch, tmp_path):
+	with open(Path(tmp_path, "runtests.json"), "w") as f:
+		json.dump(WHOLE_THREAD_FIRST, f, ensure_ascii=False)
+
+	MV_ARGS.path = tmp_path
+	monkeypatch.setattr(MV_ARGS, "range", [1, 3])
+	monkeypatch.setattr(MV_ARGS, "to", 2)
+
+	with pytest.raises(ValueError) as e:
+		story_threads.move_events(MV_ARGS)
+
+
+### test parsed story cache ###
+
+def test_retrieve_from_parsed_cache(monkeypatch, tmp_path):
+	thread_list = [{"a": {"event": "open", "description": "a"}}, {"a": {"event": "close", "description": "a ends"}}]
+	story_threads.store_storythreads("runtests", tmp_path, thread_list)
+
+	assert Path(tmp_path, ".runtests.parsed").exists()
+	def no_parsing(content):
+		raise AssertionError("the story was parsed")
+	monkeypatch.setattr(story_threads.json, "loads", no_parsing)
+	assert story_threads.retrieve_storythreads("runtests", tmp_path) == thread_list
+
+def test_retrieve_changed_story_with_same_size_and_time(tmp_path):
+	with open(Path(tmp_path, "runtests.json"), "w") as f:
+		json.dump({"0": {"a": {"event": "open", "description": "a"}}}, f)
+	assert story_threads.retrieve_storythreads("runtests", tmp_path)[0] == {"a": {"event": "open", "description": "a"}}
+
+	stat = Path(tmp_path, "runtests.json").stat()
+	with open(Path(tmp_path, "runtests.json"), "w") as f:
+		json.dump({"0": {"b": {"event": "open", "description": "b"}}}, f)
+	os.utime(Path(tmp_path, "runtests.json"), ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+	assert story_threads.retrieve_storythreads("runtests", tmp_path)[0] == {"b": {"event": "open", "description": "b"}}
+
+def test_retrieve_old_story_without_hashing(monkeypatch, tmp_path):
+	thread_list = [{"a": {"event": "open", "description": "a"}}, {"a": {"event": "close", "description": "a ends"}}]
+	story_threads.store_storythreads("runtests", tmp_path, thread_list)
+	# the story was last written an hour ago
+	old = time.time_ns() - 3600 * 10**9
+	os.utime(Path(tmp_path, "runtests.json"), ns=(old, old))
+
+	# the first load hashes the story and refreshes the fingerprint
+	assert story_threads.retrieve_storythreads("runtests", tmp_path) == thread_list
+	assert story_threads.retrieve_search_index("runtests", tmp_path)["size"] == 2
+	def no_hashing(version_file, start=0):
+		raise AssertionError("the story was hashed")
+	monkeypatch.setattr(story_threads, "file_block_digests", no_hashing)
+	assert story_threads.retrieve_storythreads("runtests", tmp_path) == thread_list
+	assert story_threads.retrieve_search_index("runtests", tmp_path)["size"] == 2
+
+
+### test watch ###
+
+def test_redraw_lines():
+	size = os.terminal_size((10, 24))
+
+	assert story_threads.redraw_lines(["a", "b"], ["a", "b"], size) == ""
+	assert story_threads.redraw_lines([], ["a", "b"], size) == "\033[Ja\nb\n"
+	# two rows to redraw, the second line wraps (bold markup takes no space)
+	assert story_threads.redraw_lines(["a", "b", "\033[1m" + 11 * "c" + "\033[0m"], ["a", "x"], size) == "\033[3F\033[Jx\n"
+	assert story_threads.redraw_lines(30 * ["a"], 30 * ["b"], size) == "\033[H\033[2J" + 30 * "b\n"
+
+@pytest.mark.parametrize("sharded", [False, True])
+def test_watch(monkeypatch, tmp_path, capsys, sharded):
+	if sharded:
+		Path(tmp_path, "runtests.shards").mkdir()
+	story_threads.store_storythreads("runtests", tmp_path, [{"a": {"event": "open", "description": "a"}}])
+	monkeypatch.setattr(story_threads.shutil, "get_terminal_size", lambda: os.terminal_size((80, 24)))
+	updates = []
+	def sleep(seconds):
+		updates.append(seconds)
+		if len(updates) == 1:
+			directory = Path(tmp_path, "runtests.shards")
+			stat = directory.stat() if sharded else None
+			story_threads.store_storythreads("runtests", tmp_path, [{"a": {"event": "open", "description": "a"}}, {"a": {"event": "close", "description": "a ends"}}])
+			if sharded:
+				# as if the manifest was written in place, only the
+				# manifest tells that the story changed
+				os.utime(directory, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+		elif len(updates) == 3:
+			raise KeyboardInterrupt
+	monkeypatch.setattr(story_threads.time, "sleep", sleep)
+	capsys.readouterr()
+
+	story_threads.show_threads(argparse.Namespace(story="runtests", path=tmp_path, show_connections=False, watch=True, interval=0.1))
+
+	output = capsys.readouterr().out
+	assert updates == [0.1, 0.1, 0.1]
+	# the first update redraws from the closing, the second finds
+	# no change
+	assert output.count("\033[J") == 2
+	assert output.split("\033[J")[2].startswith("1 ├──┘a ends\n")
+
+
+### test jsonl ###
+
+def test_convert_to_jsonl_and_back(tmp_path, capsys):
+	with open(Path(tmp_path, "runtests.json"), "w") as f:
+		json.dump(WHOLE_THREAD_FIRST, f, ensure_ascii=False)
+	args = argparse.Namespace(story="runtests", path=tmp_path, show_connections=False, to="jsonl")
+	thread_list = story_threads.retrieve_storythreads("runtests", tmp_path)
+	story_threads.show_threads(args)
+	shown = capsys.readouterr().out
+
+	story_threads.convert_story(args)
+
+	assert not Path(tmp_path, "runtests.json").exists()
+	with open(Path(tmp_path, "runtests.jsonl"), "r") as f:
+		assert [json.loads(line) for line in f] == thread_list
+	assert story_threads.retrieve_storythreads("runtests", tmp_path) == thread_list
+	capsys.readouterr()
+	story_threads.show_threads(args)
+	assert capsys.readouterr().out == shown
+
+	args.to = "json"
+	story_threads.convert_story(args)
+
+	assert not Path(tmp_path, "runtests.jsonl").exists()
+	with open(Path(tmp_path, "runtests.json"), "r") as f:
+		assert json.load(f) == WHOLE_THREAD_FIRST
+
+def test_convert_removes_stale_caches(tmp_path):
+	args = argparse.Namespace(story="runtests", path=tmp_path, show_connections=False, names=["hero searches artifact"], indices=[0], close=False, to="jsonl")
+	story_threads.add_thread(args)
+	args.names = ["villain appears"]
+	story_threads.add_thread(args)
+	# the undo cache is parsed and cached like a story
+	story_threads.retrieve_storythreads(".runtests", tmp_path)
+	assert Path(tmp_path, ".runtests.json").exists()
+	assert Path(tmp_path, "..runtests.parsed").exists()
+
+	story_threads.convert_story(args)
+
+	assert not Path(tmp_path, ".runtests.json").exists()
+	assert not Path(tmp_path, "..runtests.parsed").exists()
+	story_threads.add_thread(args)
+	assert Path(tmp_path, ".runtests.jsonl").exists()
+
+	args.to = "shards"
+	story_threads.convert_story(args)
+
+	assert not Path(tmp_path, ".runtests.jsonl").exists()
+	assert not Path(tmp_path, ".runtests.parsed").exists()
+	args.names = ["mentor appears"]
+	story_threads.add_thread(args)
+	assert Path(tmp_path, ".runtests.shards").is_dir()
+
+	args.to = "json"
+	story_threads.convert_story(args)
+
+	assert not Path(tmp_path, ".runtests.shards").exists()
+	assert not Path(tmp_path, "..runtests.segments").exists()
+	thread_list = story_threads.retrieve_storythreads("runtests", tmp_path)
+	story_threads.add_thread(args)
+	story_threads.undo(args)
+	assert story_threads.retrieve_storythreads("runtests", tmp_path) == thread_list
+
+def test_jsonl_append(tmp_path):
+	with open(Path(tmp_path, "runtests.jsonl"), "w") as f:
+		f.write('{"a": {"description": "a", "event": "open"}}\n')
+	args = argparse.Namespace(story="runtests", path=tmp_path, show_connections=False, names=["a", "a continues"], indices=[5], close=False)
+
+	story_threads.add_thread(args)
+
+	# the first line is kept as it was
+	with open(Path(tmp_path, "runtests.jsonl"), "r") as f:
+		assert f.read() == '{"a": {"description": "a", "event": "open"}}\n{"a": {"event": "develop", "description": "a continues"}}\n'
+
+def test_scan_jsonl(tmp_path):
+	with open(Path(tmp_path, "runtests.jsonl"), "w") as f:
+		f.write('{"a \\"b\\"": {"event": "open", "description": "a"}}\n{"c": {"event": "open", "description": "c"}}\n\n{"a \\"b\\"": {"event": "close", "description": ""}}\n')
+
+	assert story_threads.scan_storythreads("runtests", tmp_path) == (3, {'a "b"'})
+
+	# not the format the events are stored in
+	with open(Path(tmp_path, "runtests.jsonl"), "a") as f:
+		f.write('{"c": {"description": "c ends", "event": "close"}}\n')
+
+	assert story_threads.scan_storythreads("runtests", tmp_path) == (4, {'a "b"', "c"})
+
+	# the same name may be escaped differently
+	with open(Path(tmp_path, "runtests.jsonl"), "a") as f:
+		f.write('{"\\u00e9": {"event": "open", "description": ""}}\n{"\u00e9": {"event": "close", "description": ""}}\n')
+
+	assert story_threads.scan_storythreads("runtests", tmp_path) == (6, {'a "b"', "c", "\u00e9"})
+
+def test_jsonl_append_without_new_line(tmp_path):
+	with open(Path(tmp_path, "runtests.jsonl"), "w") as f:
+		f.write('{"a": {"event": "open", "description": "a"}}')
+	args = argparse.Namespace(story="runtests", path=tmp_path, show_connections=False, names=["a", "a continues"], indices=[5], close=False)
+
+	story_threads.add_thread(args)
+
+	assert story_threads.retrieve_storythreads("runtests", tmp_path) == [{"a": {"event": "open", "description": "a"}}, {"a": {"event": "develop", "description": "a continues"}}]
+
+def test_jsonl_append_is_cached_and_indexed(monkeypatch, tmp_path):
+	Path(tmp_path, "runtests.jsonl").touch()
+	story_threads.store_storythreads("runtests", tmp_path, [{"a": {"event": "open", "description": "a"}}, {"b": {"event": "open", "description": "b"}}])
+	for names in [["a", "a continues"], ["c", "c begins"]]:
+		threads = story_threads.StoryThreads("runtests", story_threads.FileStore("runtests", tmp_path))
+		threads.add(names, [len(threads.thread_list)])
+		threads.save("add")
+	thread_list = [{"a": {"event": "open", "description": "a"}}, {"b": {"event": "open", "description": "b"}}, {"a": {"event": "develop", "description": "a continues"}}, {"c": {"event": "open", "description": "c begins"}}]
+	with open(Path(tmp_path, "runtests.jsonl"), "rb") as f:
+		assert story_threads.parse_story(f.read(), jsonl=True) == thread_list
+	firsts = []
+	build_search_index = story_threads.build_search_index
+	def record_first(thread_list, search_index=None, first=0):
+		firsts.append(first)
+		return build_search_index(thread_list, search_index, first)
+	monkeypatch.setattr(story_threads, "build_search_index", record_first)
+	def no_parsing(content, jsonl=False):
+		raise AssertionError("the story was parsed")
+	monkeypatch.setattr(story_threads, "parse_story", no_parsing)
+
+	# the appended events are added to the parsed story and the index
+	assert story_threads.retrieve_storythreads("runtests", tmp_path) == thread_list
+	search_index = story_threads.retrieve_search_index("runtests", tmp_path)
+
+	assert firsts == [2]
+	assert story_threads.search_events(thread_list, search_index, "begins") == [3]
+	assert search_index["open"] == build_search_index(thread_list)["open"]
+
+
+### test diff ###
+
+@pytest.mark.parametrize("a, b, length", [("abcabba", "cbabac", 4), ("", "abc", 0), ("abc", "abc", 3), ("abcd", "xyz", 0), ("xaxbx", "ab", 2)])
+def test_match_sequences(a, b, length):
+	matches = story_threads.match_sequences(a, b)
+
+	assert len(matches) == length
+	assert all(a[i] == b[j] for i, j in matches)
+	assert matches == sorted(matches) and len({j for i, j in matches}) == length
+
+def test_story_changes():
+	old_list = [
+		{"a": {"event": "open", "description": "a"}},
+		{"b": {"event": "open", "description": "b"}},
+		{"a": {"event": "develop", "description": "a grows"}},
+		{"b": {"event": "close", "description": "b ends"}},
+		{"c": {"event": "open", "description": "c"}}]
+	new_list = [
+		{"a": {"event": "open", "description": "a"}},
+		{"a": {"event": "develop", "description": "a grows"}},
+		{"b": {"event": "open", "description": "b"}},
+		{"d": {"event": "open", "description": "d"}},
+		{"a": {"event": "close", "description": "a ends"}},
+		{"c": {"event": "open", "description": "c"}}]
+
+	changes = story_threads.story_changes(old_list, new_list)
+
+	assert changes == {
+		"a": {"status": "closed", "events": [("~", 2, 1, "develop", "a grows"), ("+", None, 4, "close", "a ends")]},
+		"b": {"status": "reopened", "events": [("-", 3, None, "close", "b ends")]},
+		"d": {"status": "added", "events": [("+", None, 3, "open", "d")]}}
+
+def test_diff_stories(tmp_path, capsys):
+	with open(Path(tmp_path, "old.json"), "w") as f:
+		json.dump(WHOLE_THREAD_FIRST, f, ensure_ascii=False)
+	with open(Path(tmp_path, "new.jsonl"), "w") as f:
+		for k in ["0", "1", "3", "4"]:
+			f.write(json.dumps(WHOLE_THREAD_FIRST[k]) + "\n")
+
+	story_threads.diff_stories(argparse.Namespace(old=Path(tmp_path, "old.json"), new=Path(tmp_path, "new.jsonl")))
+
+	output = capsys.readouterr().out
+	assert output.startswith("antagonist in disguise (changed)\n  - 2 develop: ")
+	assert output.endswith("Events: 0 inserted, 1 removed, 0 moved.\n")
+
+
+### test merge ###
+
+MERGE_BASE = [
+	{"a": {"event": "open", "description": "a"}},
+	{"a": {"event": "develop", "description": "a grows"}},
+	{"b": {"event": "open", "description": "b"}},
+	{"b": {"event": "develop", "description": "b grows"}},
+	{"b": {"event": "develop", "description": "b grows more"}},
+	{"a": {"event": "close", "description": "a ends"}}]
+
+A_GROWS_LATE = {"a": {"event": "develop", "description": "a grows late"}}
+B_ENDS = {"b": {"event": "close", "description": "b ends"}}
+
+def test_merge_without_conflicts():
+	ours = MERGE_BASE[:2] + [A_GROWS_LATE] + MERGE_BASE[2:]
+	theirs = MERGE_BASE + [B_ENDS]
+
+	merged, conflicts = story_threads.merge_story_lists(MERGE_BASE, ours, theirs)
+
+	assert conflicts == []
+	assert merged == ours + [B_ENDS]
+
+def test_merge_move_on_one_side():
+	ours = [MERGE_BASE[i] for i in [0, 1, 5, 2, 3, 4]]
+	theirs = MERGE_BASE + [B_ENDS]
+
+	merged, conflicts = story_threads.merge_story_lists(MERGE_BASE, ours, theirs)
+
+	assert conflicts == []
+	assert merged == ours + [B_ENDS]
+
+def test_merge_closing_moved_on_both_sides():
+	ours = [MERGE_BASE[i] for i in [0, 1, 5, 2, 3, 4]]
+	theirs = [MERGE_BASE[i] for i in [0, 1, 2, 5, 3, 4]]
+
+	merged, conflicts = story_threads.merge_story_lists(MERGE_BASE, ours, theirs)
+
+	assert merged == ours
+	assert conflicts == ["Both sides moved the close of a (a ends) to different places, kept ours"]
+
+def test_merge_moved_and_removed():
+	ours = [MERGE_BASE[i] for i in [0, 1, 2, 4, 3, 5]]
+	theirs = [MERGE_BASE[i] for i in [0, 1, 2, 4, 5]]
+
+	merged, conflicts = story_threads.merge_story_lists(MERGE_BASE, ours, theirs)
+
+	assert merged == ours
+	assert conflicts == ["They removed the develop of b (b grows) that we moved, kept it"]
+
+@pytest.mark.parametrize("order", [[0, 1, 5, 2, 3, 4], [2, 3, 0, 1, 4], [5, 4, 3, 2, 1, 0], []])
+def test_merge_one_sided(order):
+	changed = [MERGE_BASE[i] for i in order] + [B_ENDS]
+
+	assert story_threads.merge_story_lists(MERGE_BASE, changed, MERGE_BASE)[0] == changed
+	assert story_threads.merge_story_lists(MERGE_BASE, MERGE_BASE, changed)[0] == changed
+
+def test_merge_broken_order(tmp_path, capsys):
+	# we close a earlier, they develop it later
+	ours = [MERGE_BASE[i] for i in [0, 1, 5, 2, 3, 4]]
+	theirs = MERGE_BASE[:5] + [A_GROWS_LATE] + MERGE_BASE[5:]
+	for name, thread_list in [("base", MERGE_BASE), ("ours", ours), ("theirs", theirs)]:
+		with open(Path(tmp_path, f"{name}.json"), "w") as f:
+			json.dump({i: el for i, el in enumerate(thread_list)}, f)
+
+	conflicts = story_threads.merge_stories(argparse.Namespace(base=Path(tmp_path, "base.json"), ours=Path(tmp_path, "ours.json"), theirs=Path(tmp_path, "theirs.json"), output=None))
+
+	assert conflicts == ["The merged story is broken: 6: a develops after it closes"]
+	assert "Conflict: The merged story is broken" in capsys.readouterr().out
+	with open(Path(tmp_path, "ours.json"), "r") as f:
+		assert len(json.load(f)) == 7
+
+
+### test history ###
+
+def test_story_delta():
+	old_list = [{"a": {"event": "open", "description": str(i)}} for i in range(10)]
+	new_list = old_list[:3] + [{"b": {"event": "open", "description": "b"}}] + old_list[5:8] + old_list[3:5] + old_list[8:]
+
+	delta = story_threads.story_delta(old_list, new_list)
+
+	assert story_threads.apply_delta(old_list, delta) == new_list
+	assert delta[1] == ["insert", [{"b": {"event": "open", "description": "b"}}]]
+	assert story_threads.story_delta(old_list, old_list) == [["copy", 0, 10]]
+
+def test_show_at(monkeypatch, tmp_path, capsys):
+	monkeypatch.setattr(story_threads, "HISTORY_SNAPSHOT_INTERVAL", 3)
+	args = argparse.Namespace(story="runtests", path=tmp_path, show_connections=False)
+	versions = [[]]
+	for i in range(7):
+		versions.append(versions[-1] + [{f"thread {i}": {"event": "open", "description": f"thread {i}"}}])
+		story_threads.store_storythreads("runtests", tmp_path, versions[-1], operation="add")
+	capsys.readouterr()
+
+	entries = story_threads.show_history(args)
+
+	assert [entry["operation"] for entry in entries] == ["initial"] + 7 * ["add"]
+	assert ["snapshot" in entry for entry in entries] == [True, False, False, True, False, False, True, False]
+	assert capsys.readouterr().out.splitlines()[1].endswith("add (1 events)")
+	for n in range(8):
+		assert story_threads.history_storythreads("runtests", tmp_path, n) == versions[n]
+	assert story_threads.history_storythreads("runtests", tmp_path, -2) == versions[5]
+	assert story_threads.history_storythreads("runtests", tmp_path, story_threads.datetime.datetime.now()) == versions[7]
+	with pytest.raises(ValueError):
+		story_threads.history_storythreads("runtests", tmp_path, 8)
+
+	args.at = "2"
+	story_threads.show_threads(args)
+	assert capsys.readouterr().out.endswith("Number of threads: 2 + 1 (main thread)\nNumber of open threads: 2 + 1 (main thread)\n")
+
+def test_history_after_hand_edit(tmp_path):
+	thread_list = [{"a": {"event": "open", "description": "a"}}, {"a": {"event": "develop", "description": "b"}}]
+	story_threads.store_storythreads("runtests", tmp_path, thread_list, operation="add")
+	# add two events by hand
+	edited = thread_list + [{"a": {"event": "develop", "description": "c"}}, {"a": {"event": "develop", "description": "d"}}]
+	with open(Path(tmp_path, "runtests.json"), "w") as f:
+		json.dump({i: el for i, el in enumerate(edited)}, f)
+
+	story_threads.store_storythreads("runtests", tmp_path, edited + [{"a": {"event": "close", "description": "e"}}], operation="add")
+	story_threads.store_storythreads("runtests", tmp_path, edited, operation="rm")
+
+	entries = story_threads.retrieve_history("runtests", tmp_path)
+	assert [(entry["operation"], entry["size"], "snapshot" in entry) for entry in entries] == [("initial", 0, True), ("add", 2, False), ("add", 5, True), ("rm", 4, False)]
+	assert story_threads.history_storythreads("runtests", tmp_path, 2) == edited + [{"a": {"event": "close", "description": "e"}}]
+	assert story_threads.history_storythreads("runtests", tmp_path, 3) == edited
+
+def test_delta_of_another_version():
+	with pytest.raises(ValueError, match="history of the story is broken"):
+		story_threads.apply_delta([{"a": {"event": "open"}}], [["copy", 0, 3]])
+
+def test_snapshots_share_chunks(tmp_path):
+	thread_list = [{"a": {"event": "develop", "description": str(i)}} for i in range(1000)]
+	history = Path(tmp_path, "history")
+	story_threads.store_snapshot(history, thread_list)
+	objects = sum(1 for object_file in Path(history, "objects").rglob("*") if object_file.is_file())
+
+	thread_list.insert(500, {"b": {"event": "open", "description": "b"}})
+	digest = story_threads.store_snapshot(history, thread_list)
+
+	# the changed chunk (split in two at most) and the list of chunks
+	# are new
+	assert sum(1 for object_file in Path(history, "objects").rglob("*") if object_file.is_file()) - objects <= 3
+	assert story_threads.retrieve_snapshot(history, digest) == thread_list
+
+
+### test shards ###
+
+def test_shards_store_only_changed_segments(monkeypatch, tmp_path):
+	monkeypatch.setattr(story_threads, "SHARD_MIN_EVENTS", 8)
+	monkeypatch.setattr(story_threads, "SHARD_CHUNK_MASK", 0x7)
+	monkeypatch.setattr(story_threads, "SHARD_MAX_EVENTS", 32)
+	thread_list = [{f"thread {i % 5}": {"event": "open" if i < 5 else "develop", "description": str(i)}} for i in range(500)]
+	story_threads.store_storythreads("runtests", tmp_path, thread_list)
+	story_threads.convert_story(argparse.Namespace(story="runtests", path=tmp_path, to="shards"))
+	directory = Path(tmp_path, "runtests.shards")
+	segments = {segment_file.name for segment_file in directory.glob("*.jsonl")}
+
+	assert not Path(tmp_path, "runtests.json").exists()
+	assert 500 // 32 <= len(segments) <= 500 // 8
+	assert all(8 <= segment["size"] <= 32 for segment in story_threads.retrieve_manifest(directory)["segments"][:-1])
+
+	thread_list.insert(250, {"new thread": {"event": "open", "description": "new thread"}})
+	story_threads.store_storythreads("runtests", tmp_path, thread_list)
+
+	changed = {segment_file.name for segment_file in directory.glob("*.jsonl")} ^ segments
+	# one replaced segment, or two if the boundary moved
+	assert 2 <= len(changed) <= 4
+	# the kept segments are those of the whole story
+	story_threads.store_shards(Path(tmp_path, "whole"), thread_list)
+	assert story_threads.retrieve_manifest(directory) == story_threads.retrieve_manifest(Path(tmp_path, "whole"))
+	shutil.rmtree(Path(tmp_path, "whole"))
+	assert story_threads.retrieve_storythreads("runtests", tmp_path) == thread_list
+	assert story_threads.retrieve_story_range("runtests", tmp_path, 249, 251) == thread_list[249:252]
+	assert story_threads.retrieve_story_thread("runtests", tmp_path, "new thread") == [(250, thread_list[250]["new thread"])]
+	assert story_threads.discover_stories(tmp_path) == ["runtests"]
+
+	story_threads.convert_story(argparse.Namespace(story="runtests", path=tmp_path, to="json"))
+	assert not directory.exists()
+	assert story_threads.retrieve_storythreads("runtests", tmp_path) == thread_list
+
+def test_shards_undo(tmp_path):
+	Path(tmp_path, "runtests.shards").mkdir()
+	args = argparse.Namespace(story="runtests", path=tmp_path, show_connections=False, names=["hero searches artifact"], indices=[0], close=False)
+	story_threads.add_thread(args)
+	args.names = ["villain appears"]
+	story_threads.add_thread(args)
+
+	story_threads.undo(args)
+
+	assert Path(tmp_path, ".runtests.shards", story_threads.SHARD_MANIFEST).exists()
+	assert story_threads.retrieve_storythreads("runtests", tmp_path) == [{"hero searches artifact": {"event": "open", "description": "hero searches artifact"}}]
+
+def store_sharded_story(monkeypatch, tmp_path):
+	monkeypatch.setattr(story_threads, "SHARD_MIN_EVENTS", 8)
+	monkeypatch.setattr(story_threads, "SHARD_CHUNK_MASK", 0x7)
+	monkeypatch.setattr(story_threads, "SHARD_MAX_EVENTS", 32)
+	thread_list = [{f"thread {i % 5}": {"event": "open" if i < 5 else "develop", "description": str(i)}} for i in range(200)]
+	thread_list.append({"thread 0": {"event": "close", "description": "thread 0 ends"}})
+	Path(tmp_path, "runtests.shards").mkdir()
+	story_threads.store_storythreads("runtests", tmp_path, thread_list)
+	return thread_list
+
+def test_shards_are_cached_by_segment(monkeypatch, tmp_path):
+	thread_list = store_sharded_story(monkeypatch, tmp_path)
+	threads = story_threads.StoryThreads("runtests", story_threads.FileStore("runtests", tmp_path))
+	threads.add(["new thread"], [100])
+	def no_parsing(content, jsonl=False):
+		raise AssertionError("the story was parsed")
+	monkeypatch.setattr(story_threads, "parse_story", no_parsing)
+	# the history gets the stored story from the store
+	monkeypatch.setattr(story_threads, "retrieve_storythreads", no_parsing)
+
+	threads.save("add")
+
+	assert not Path(tmp_path, ".runtests.index.json").exists()
+	assert not Path(tmp_path, ".runtests.parsed").exists()
+	story_threads.store_shards(Path(tmp_path, "whole"), threads.thread_list)
+	assert story_threads.retrieve_manifest(Path(tmp_path, "runtests.shards")) == story_threads.retrieve_manifest(Path(tmp_path, "whole"))
+	monkeypatch.undo()
+	assert story_threads.retrieve_storythreads("runtests", tmp_path) == threads.thread_list
+	assert story_threads.history_storythreads("runtests", tmp_path, story_threads.retrieve_history("runtests", tmp_path)[-1]["n"]) == threads.thread_list
+	# the index is updated when it is needed
+	assert story_threads.search_events(threads.thread_list, story_threads.retrieve_search_index("runtests", tmp_path), "new thread") == [100]
+	assert story_threads.read_search_index("runtests", tmp_path)["size"] == 202
+
+def test_shards_show_thread_and_touching(monkeypatch, tmp_path, capsys):
+	thread_list = store_sharded_story(monkeypatch, tmp_path)
+	thread_list += [{"late thread": {"event": "open", "description": "late thread"}}, {"late thread": {"event": "close", "description": "late thread ends"}}]
+	story_threads.store_storythreads("runtests", tmp_path, thread_list)
+	manifest = story_threads.retrieve_manifest(Path(tmp_path, "runtests.shards"))
+	story_threads.retrieve_search_index("runtests", tmp_path)
+	loaded = []
+	retrieve_segment = story_threads.retrieve_segment
+	monkeypatch.setattr(story_threads, "retrieve_segment", lambda directory, name: loaded.append(name) or retrieve_segment(directory, name))
+	args = argparse.Namespace(story="runtests", path=tmp_path, show_connections=False, name="late thread", only="late", open_only=False, touching=None)
+	capsys.readouterr()
+
+	story_threads.show_thread(args)
+	story_threads.show_threads(args)
+	args.only = None
+	args.touching = [0, 3]
+	story_threads.show_threads(args)
+
+	# the late thread is only in the last segment, the touching threads
+	# are in all of them
+	assert loaded[:2] == 2 * [manifest["segments"][-1]["file"]]
+	shown = capsys.readouterr().out
+	story_threads.convert_story(argparse.Namespace(story="runtests", path=tmp_path, to="json"))
+	capsys.readouterr()
+	args.only = "late"
+	args.touching = None
+	story_threads.show_thread(args)
+	story_threads.show_threads(args)
+	args.only = None
+	args.touching = [0, 3]
+	story_threads.show_threads(args)
+	assert capsys.readouterr().out == shown
+
+
+### test streaming ###
+
+@pytest.mark.parametrize("content", [
+	json.dumps({i: {f"thread {i % 3}": {"event": "develop", "description": f"event {i} „{'x' * i}“"}} for i in range(50)}, ensure_ascii=False),
+	json.dumps(WHOLE_THREAD_FIRST, indent="\t"),
+	json.dumps({"3": 3, "0": 0, "10": 10, "1": 1, "2": {"b": []}}),
+	"{}",
+	" { } ",
+])
+def test_stream_json_story(monkeypatch, tmp_path, content):
+	monkeypatch.setattr(story_threads, "STREAM_CHUNK_SIZE", 7)
+	with open(Path(tmp_path, "runtests.json"), "w") as f:
+		f.write(content)
+
+	assert list(story_threads.stream_json_story(Path(tmp_path, "runtests.json"))) == story_threads.parse_story(content.encode("utf-8"))
+
+@pytest.mark.parametrize("content", ['{"0": {"a": 1}', '{"0": {"a": 1}} {', '{"0" {"a": 1}}', "[]"])
+def test_stream_broken_json_story(tmp_path, content):
+	with open(Path(tmp_path, "runtests.json"), "w") as f:
+		f.write(content)
+
+	with pytest.raises(json.decoder.JSONDecodeError):
+		list(story_threads.stream_json_story(Path(tmp_path, "runtests.json")))
+
+def test_streamed_commands(monkeypatch, tmp_path, capsys):
+	with open(Path(tmp_path, "runtests.json"), "w") as f:
+		json.dump(WHOLE_THREAD_FIRST, f)
+	args = argparse.Namespace(story="runtests", path=tmp_path, show_connections=False, repair=False)
+	outputs = []
+	for size in [2**26, 0]:
+		monkeypatch.setattr(story_threads, "STREAM_STORY_BYTES", size)
+		story_threads.show_threads(args)
+		story_threads.show_stats(args)
+		story_threads.check_story(args)
+		outputs.append(capsys.readouterr().out)
+
+	assert outputs[0] == outputs[1]
+	# the story is not loaded as a whole
+	monkeypatch.setattr(story_threads, "retrieve_storythreads", None)
+	assert story_threads.show_stats(args)["open"] == 1
+
+
+### test import manuscript ###
+
+def test_import_manuscript(tmp_path, capsys):
+	chapters = [Path(tmp_path, "chapter1.md"), Path(tmp_path, "chapter2.md"), Path(tmp_path, "empty.md")]
+	chapters[0].write_text("# Chapter 1\nThe hero leaves. [[open: hero searches artifact]]\n\n[[open: antagonist in disguise | a friendly stranger]] appears.\n")
+	chapters[1].write_text("[[develop: hero searches artifact | hero finds the first clue]]\nThe stranger [[ close : antagonist in disguise | is unmasked ]].\n")
+	chapters[2].write_text("")
+	args = argparse.Namespace(story="runtests", path=tmp_path, manuscripts=[str(chapter) for chapter in chapters])
+
+	story_threads.import_manuscript(args)
+
+	assert story_threads.retrieve_storythreads("runtests", tmp_path) == [
+		{"hero searches artifact": {"event": "open", "description": "hero searches artifact"}},
+		{"antagonist in disguise": {"event": "open", "description": "a friendly stranger"}},
+		{"hero searches artifact": {"event": "develop", "description": "hero finds the first clue"}},
+		{"antagonist in disguise": {"event": "close", "description": "is unmasked"}}]
+	assert capsys.readouterr().out == "Imported 4 events from 3 manuscripts (3 scanned).\n"
+
+	# only the prose changed
+	chapters[0].write_text(chapters[0].read_text() + "More text.\n")
+	story_threads.import_manuscript(args)
+	assert capsys.readouterr().out.endswith("(1 scanned).\n")
+	assert len(story_threads.retrieve_history("runtests", tmp_path)) == 2
+
+	chapters[1].write_text("[[develop: hero searches artifact | hero finds the artifact]]\n" + chapters[1].read_text())
+	story_threads.import_manuscript(args)
+	assert capsys.readouterr().out == "Imported 5 events from 3 manuscripts (1 scanned).\n"
+	assert story_threads.retrieve_storythreads("runtests", tmp_path)[2]["hero searches artifact"]["description"] == "hero finds the artifact"
+
+	story_threads.undo(argparse.Namespace(story="runtests", path=tmp_path, show_connections=False))
+	assert len(story_threads.retrieve_storythreads("runtests", tmp_path)) == 4
+
+def test_import_manuscript_after_move(tmp_path, capsys):
+	chapters = [Path(tmp_path, "chapter1.md"), Path(tmp_path, "chapter2.md")]
+	chapters[0].write_text("[[open: hero searches artifact]]\n[[open: antagonist in disguise | a friendly stranger]]\n")
+	chapters[1].write_text("[[develop: hero searches artifact | hero finds the first clue]]\n[[close: antagonist in disguise | is unmasked]]\n")
+	args = argparse.Namespace(story="runtests", path=tmp_path, manuscripts=[str(chapter) for chapter in chapters])
+	story_threads.import_manuscript(args)
+
+	# the move keeps the size of the story
+	story_threads.move_events(argparse.Namespace(story="runtests", path=tmp_path, show_connections=False, range=[1, 1], to=0))
+	chapters[1].write_text("[[develop: hero searches artifact | hero finds the artifact]]\n" + chapters[1].read_text())
+	story_threads.import_manuscript(args)
+
+	assert capsys.readouterr().out.endswith("(2 scanned).\n")
+	story_threads.import_manuscript(argparse.Namespace(story="fresh", path=tmp_path, manuscripts=args.manuscripts))
+	assert story_threads.retrieve_storythreads("runtests", tmp_path) == story_threads.retrieve_storythreads("fresh", tmp_path)
+
+def test_import_broken_manuscript(tmp_path):
+	manuscript = Path(tmp_path, "chapter1.md")
+	manuscript.write_text("Intro\n[[develop: hero searches artifact | hero finds the first clue]]\n")
+	args = argparse.Namespace(story="runtests", path=tmp_path, manuscripts=[str(manuscript)])
+
+	with pytest.raises(ValueError, match="chapter1.md:2: "):
+		story_threads.import_manuscript(args)
+	manuscript.write_text("[[develop: hero searches artifact]]\n")
+	with pytest.raises(ValueError, match="needs a description"):
+		story_threads.import_manuscript(args)
+	assert not Path(tmp_path, "runtests.json").exists()
+
+
+### test import ###
+
+def test_import_csv_and_outline(tmp_path, capsys):
+	with open(Path(tmp_path, "runtests.json"), "w") as f:
+		json.dump(WHOLE_THREAD, f)
+	Path(tmp_path, "rows.csv").write_text("thread,event,description,position\nhero searches artifact,,,1\nhero searches artifact,develop,hero finds the first clue,2\nantagonist in disguise,develop,\"fake-ally warns, too late\",2\n")
+	Path(tmp_path, "outline.md").write_text("# Chapter 3\n- The showdown\n  - develop: hero searches artifact | hero finds the artifact\n  - close: hero searches artifact\n")
+	args = argparse.Namespace(story="runtests", path=tmp_path, outlines=[str(Path(tmp_path, "rows.csv")), str(Path(tmp_path, "outline.md"))], dry_run=False)
+
+	story_threads.import_outline(args)
+
+	thread_list = story_threads.retrieve_storythreads("runtests", tmp_path)
+	assert [(next(iter(el)), next(iter(el.values()))["event"]) for el in thread_list] == [
+		("antagonist in disguise", "open"),
+		("hero searches artifact", "open"),
+		("antagonist in disguise", "develop"),
+		("hero searches artifact", "develop"),
+		("antagonist in disguise", "develop"),
+		("antagonist in disguise", "close"),
+		("hero searches artifact", "develop"),
+		("hero searches artifact", "close")]
+	assert thread_list[4]["antagonist in disguise"]["description"] == "fake-ally warns, too late"
+	assert capsys.readouterr().out.endswith("Imported 5 events.\n")
+	assert [entry["operation"] for entry in story_threads.retrieve_history("runtests", tmp_path)] == ["initial", "import"]
+
+def test_import_rejected_rows(tmp_path, capsys):
+	with open(Path(tmp_path, "runtests.json"), "w") as f:
+		json.dump(WHOLE_THREAD, f)
+	rows = Path(tmp_path, "rows.csv")
+	rows.write_text("hero searches artifact,open,,0\nhero searches artifact,develop,,1\n,open,nameless,0\nvillain,appear,villain,0\nvillain,open,villain,x\nvillain,open,villain,9\nantagonist in disguise,develop,too late,3\n")
+	args = argparse.Namespace(story="runtests", path=tmp_path, outlines=[str(rows)], dry_run=True)
+
+	rejected = story_threads.import_outline(args)
+
+	assert [row[1] if row is not None else None for row, reason in rejected] == [2, 3, 4, 5, 6, 7]
+	assert capsys.readouterr().out.endswith("Would import 0 events (6 rejected).\n")
+	args.dry_run = False
+	with pytest.raises(ValueError, match="6 rows were rejected"):
+		story_threads.import_outline(args)
+	assert story_threads.retrieve_storythreads("runtests", tmp_path) == story_threads.parse_story(json.dumps(WHOLE_THREAD).encode())
+
+def test_anchor_sequences():
+	a = ["a", "b", "c", "d", "b", "e"]
+	b = ["x", "c", "a", "d", "e", "b"]
+
+	# b occurs twice in a and is not matched
+	assert story_threads.anchor_sequences(a, b) == [(0, 2), (3, 3), (5, 4)]
+
+
+### test export ###
+
+def test_grid_rows():
+	thread_list = story_threads.parse_story(json.dumps(WHOLE_THREAD_FIRST).encode())
+	rows = list(story_threads.ThreadGrid(thread_list).rows())
+
+	assert [(row["column"], row["join"]) for row in rows] == [(1, 0), (2, 1), (2, None), (1, None), (2, 1)]
+	assert [row["bold"] for row in rows] == [False] * 5
+
+def test_export_html(tmp_path):
+	with open(Path(tmp_path, "runtests.json"), "w") as f:
+		json.dump(WHOLE_THREAD_FIRST, f)
+	output = Path(tmp_path, "runtests.html")
+	args = argparse.Namespace(story="runtests", path=tmp_path, show_connections=False, to="html", output=str(output))
+
+	story_threads.export_threads(args)
+
+	page = output.read_text(encoding="utf-8")
+	rows = page[page.index("const rows = [\n") + 15:page.index("];")]
+	lines = ["".join(json.loads(line.rstrip(","))) for line in rows.splitlines()]
+	thread_list = story_threads.retrieve_storythreads("runtests", tmp_path)
+	assert lines == [line.replace("\033[1m", "").replace("\033[0m", "") for line in story_threads.render_threads("runtests", thread_list)]
+
+def test_export_svg(tmp_path):
+	import xml.etree.ElementTree as ElementTree
+	with open(Path(tmp_path, "runtests.json"), "w") as f:
+		json.dump(OPEN_THREAD_FIRST, f)
+	output = Path(tmp_path, "runtests.svg")
+	args = argparse.Namespace(story="runtests", path=tmp_path, show_connections=False, to="svg", output=str(output))
+
+	story_threads.export_threads(args)
+
+	svg = ElementTree.parse(output).getroot()
+	namespace = "{http://www.w3.org/2000/svg}"
+	assert len(svg.findall(f"{namespace}circle")) == len(OPEN_THREAD_FIRST)
+	# the thread that stays open is dashed
+	assert [line.get("stroke-dasharray") is not None for line in svg.findall(f"{namespace}line")].count(True) == 1
+
+
+### test filter ###
+
+@pytest.mark.parametrize("only,open_only,touching,expected", [
+	("lonely", False, None, [0, 3]),
+	("DISGUISE", False, None, [1, 2, 4]),
+	(None, True, None, [0, 3]),
+	(None, False, (0, 0), [0, 3]),
+	(None, False, (3, 4), [0, 1, 2, 3, 4]),
+	("disguise", True, None, []),
+])
+def test_select_threads(only, open_only, touching, expected):
+	thread_list = story_threads.parse_story(json.dumps(WHOLE_THREAD_FIRST).encode())
+	search_index = story_threads.build_search_index(thread_list)
+
+	assert story_threads.select_threads(thread_list, search_index, only, open_only, touching) == expected
+
+def test_show_only(tmp_path, capsys):
+	with open(Path(tmp_path, "runtests.json"), "w") as f:
+		json.dump(WHOLE_THREAD_FIRST, f)
+	args = argparse.Namespace(story="runtests", path=tmp_path, show_connections=False, only="disguise", open_only=False, touching=None)
+
+	story_threads.show_threads(args)
+
+	# the lines keep their indices and the thread takes the first column
+	lines = capsys.readouterr().out.splitlines()
+	assert [line[:7] for line in lines[2:5]] == [" 1 ├──a", " 2 │  │", " 4 ├──┘"]
+	assert lines[-2] == "Number of threads: 1 + 1 (main thread)"
+
+def test_filter_after_hand_edit(tmp_path, capsys):
+	with open(Path(tmp_path, "runtests.json"), "w") as f:
+		json.dump(WHOLE_THREAD_FIRST, f)
+	args = argparse.Namespace(story="runtests", path=tmp_path, show_connections=False, only="disguise", open_only=False, touching=None)
+	story_threads.show_threads(args)
+	capsys.readouterr()
+	# swap the first two events and rename a thread by hand
+	edited = dict(WHOLE_THREAD_FIRST, **{"0": WHOLE_THREAD_FIRST["1"], "1": WHOLE_THREAD_FIRST["0"]})
+	with open(Path(tmp_path, "runtests.json"), "w") as f:
+		f.write(json.dumps(edited).replace("protagonist feels lonely", "hero feels lonely"))
+
+	story_threads.show_threads(args)
+	lines = capsys.readouterr().out.splitlines()
+	assert [line[:7] for line in lines[2:5]] == [" 0 ├──a", " 2 │  │", " 4 ├──┘"]
+
+	args.only = None
+	args.open_only = True
+	story_threads.show_threads(args)
+	lines = capsys.readouterr().out.splitlines()
+	assert [line[:2] for line in lines[2:4]] == ["1 ", "3 "]
+	assert "hero feels lonely" in lines[2]
+
+def test_select_threads_with_outdated_index():
+	thread_list = story_threads.parse_story(json.dumps(WHOLE_THREAD_FIRST).encode())
+	search_index = story_threads.build_search_index(thread_list)
+	thread_list[0], thread_list[1] = thread_list[1], thread_list[0]
+
+	assert story_threads.select_threads(thread_list, search_index, "disguise") == [0, 2, 4]
+	assert story_threads.select_threads(thread_list, search_index, open_only=True) == [1, 3]
+
+
+### test thread timeline ###
+
+def test_interval_tree():
+	intervals = [[0, 4, "a"], [1, 1, "b"], [2, 9, "c"], [5, 7, "d"], [6, 6, "e"], [8, 9, "f"], [3, 3, "g"]]
+	tree = story_threads.build_interval_tree(intervals)
+
+	for position in range(11):
+		assert sorted(story_threads.stab_interval_tree(tree, position)) == [name for first, last, name in intervals if first <= position <= last]
+
+def test_show_thread(tmp_path, capsys):
+	with open(Path(tmp_path, "runtests.json"), "w") as f:
+		json.dump(WHOLE_THREAD_FIRST, f)
+	args = argparse.Namespace(story="runtests", path=tmp_path, name="antagonist in disguise")
+
+	timeline = story_threads.show_thread(args)
+
+	assert [(event["index"], event["event"], event["before"], event["open"]) for event in timeline] == [
+		(1, "open", 1, ["protagonist feels lonely"]),
+		(2, "develop", 0, ["protagonist feels lonely"]),
+		(4, "close", 1, ["protagonist feels lonely"])]
+	assert timeline[-1]["after"] == 0
+	assert capsys.readouterr().out.splitlines()[-2:] == [
+		"4 close: antagonists disguise fails",
+		"    1 events before, 0 after, 1 other threads open: protagonist feels lonely"]
+	args.name = "antagonist"
+	with pytest.raises(ValueError, match="does not exist"):
+		story_threads.show_thread(args)
+
+def test_show_thread_after_hand_edit(tmp_path):
+	with open(Path(tmp_path, "runtests.json"), "w") as f:
+		json.dump(WHOLE_THREAD_FIRST, f)
+	args = argparse.Namespace(story="runtests", path=tmp_path, name="antagonist in disguise")
+	story_threads.show_thread(args)
+	# swap the first two events
+	with open(Path(tmp_path, "runtests.json"), "w") as f:
+		json.dump(dict(WHOLE_THREAD_FIRST, **{"0": WHOLE_THREAD_FIRST["1"], "1": WHOLE_THREAD_FIRST["0"]}), f)
+
+	assert [event["index"] for event in story_threads.show_thread(args)] == [0, 2, 4]
+
+def test_timeline_with_outdated_index():
+	thread_list = story_threads.parse_story(json.dumps(WHOLE_THREAD_FIRST).encode())
+	search_index = story_threads.build_search_index(thread_list)
+	thread_list[0], thread_list[1] = thread_list[1], thread_list[0]
+
+	timeline = story_threads.thread_timeline(thread_list, search_index, "antagonist in disguise")
+
+	assert [(event["index"], event["open"]) for event in timeline] == [(0, []), (2, ["protagonist feels lonely"]), (4, ["protagonist feels lonely"])]
+
+
+### test windows ###
+
+def test_render_window():
+	thread_list = story_threads.parse_story(json.dumps(WHOLE_THREAD_FIRST).encode())
+	lines = list(story_threads.render_threads("runtests", thread_list, window=(2, 2)))
+
+	# the rows keep their index and the main thread
+	assert lines[2:7] == [" 0 ├──tag", " 1 │  ant", " 2 │  │fa", " 3 │  ota", " 4 │  ┘an"]
+	assert list(story_threads.render_threads("runtests", thread_list, width=12))[2:7] == [" 0 ├──protag", " 1 │  ├─ ant", " 2 │  │  │fa", " 3 │  │prota", " 4 │  ├──┘an"]
+
+def test_render_fold():
+	thread_list = story_threads.parse_story(json.dumps(WHOLE_THREAD_FIRST).encode())
+	lines = list(story_threads.render_threads("runtests", thread_list, width=20, fold=True))
+
+	assert lines[6:9] == [" 2 │  │  │fake-ally ", "   │  knows", " 3 │  │protagonist g"]
+	assert all(len(line) <= 20 for line in lines[2:-3])
+
+@pytest.mark.parametrize("columns", ["x", "0-2", "3-2", "1-2-3"])
+def test_show_wrong_columns(tmp_path, columns):
+	with open(Path(tmp_path, "runtests.json"), "w") as f:
+		json.dump(WHOLE_THREAD_FIRST, f)
+	args = argparse.Namespace(story="runtests", path=tmp_path, show_connections=False, columns=columns)
+
+	with pytest.raises(ValueError, match="FIRST-LAST"):
+		story_threads.show_threads(args)
+
+
+### test metadata ###
+
+def test_metadata_indexes():
+	threads = story_threads.StoryThreads("runtests", story_threads.MemoryStore())
+	threads.add(["antagonist in disguise", "fake-ally knows", "antagonists disguise fails"], [0, 1, 2], close=True, metadata={"chapter": 1})
+	threads.add(["protagonist feels lonely", "protagonist gains a friend"], [1, 3], metadata={"chapter": 2, "tags": ["pov-anna"]})
+	threads.annotate([2], tags=["pov-anna", "night"])
+	threads.change("antagonist in disguise", ending=["4"])
+
+	search_index = threads.current_search_index()
+	assert search_index["chapters"] == {"1": [0, 2, 4], "2": [1, 3]}
+	assert search_index["tags"] == {"pov-anna": [1, 2, 3], "night": [2]}
+	assert [event[0] for event in threads.query("", chapter=2, tags=["pov-anna"])] == [1, 3]
+	assert [event[0] for event in threads.query("disguise", tags=["pov-anna"])] == [2]
+	assert threads.thread_list[2] == {"antagonist in disguise": {"event": "develop", "description": "fake-ally knows", "chapter": 1, "tags": ["night", "pov-anna"]}}
+	threads.undo()
+	assert threads.thread_list[3] == {"antagonist in disguise": {"event": "close", "description": "antagonists disguise fails", "chapter": 1}}
+
+def test_malformed_metadata():
+	threads = story_threads.StoryThreads("runtests", story_threads.MemoryStore())
+	with pytest.raises(ValueError, match="no valid chapter"):
+		threads.add(["antagonist in disguise"], [0], metadata={"chapter": -1})
+	thread_list = [{"antagonist in disguise": {"event": "open", "description": "antagonist in disguise", "chapter": "one", "tags": ["pov-anna"]}}]
+
+	assert story_threads.story_problems(thread_list) == [(0, "antagonist in disguise", "has no valid chapter")]
+	repaired_list, repairs = story_threads.repair_storythreads(thread_list)
+	assert repaired_list == [{"antagonist in disguise": {"event": "open", "description": "antagonist in disguise", "tags": ["pov-anna"]}}]
+	assert repairs == [(0, "antagonist in disguise", "removed the invalid chapter")]
+
+def test_stats_by_chapter(tmp_path, capsys):
+	thread_list = story_threads.parse_story(json.dumps(WHOLE_THREAD_FIRST).encode())
+	for i, el in enumerate(thread_list):
+		if i != 2:
+			next(iter(el.values()))["chapter"] = 1 + i // 3
+	story_threads.store_storythreads("runtests", tmp_path, thread_list)
+	capsys.readouterr()
+	args = argparse.Namespace(story="runtests", path=tmp_path, chapter=None, tag=None, by="chapter")
+
+	groups = story_threads.show_stats(args)
+
+	assert [(chapter, stats["events"], stats["threads"]) for chapter, stats in groups] == [(1, 2, 2), (2, 2, 2)]
+	assert capsys.readouterr().out.splitlines() == [
+		"Chapter 1: 2 events (0 developments) of 2 threads",
+		"Chapter 2: 2 events (1 developments) of 2 threads",
+		"Without chapter: 1 events"]
+
+def test_chapters_after_hand_edit(tmp_path, capsys):
+	thread_list = story_threads.parse_story(json.dumps(WHOLE_THREAD_FIRST).encode())
+	for i, el in enumerate(thread_list):
+		next(iter(el.values()))["chapter"] = 1 + i // 3
+	story_threads.store_storythreads("runtests", tmp_path, thread_list)
+	with open(Path(tmp_path, "runtests.json"), "r") as f:
+		content = f.read()
+	with open(Path(tmp_path, "runtests.json"), "w") as f:
+		f.write(content.replace('"chapter": 2', '"chapter": 7'))
+	capsys.readouterr()
+
+	groups = story_threads.show_stats(argparse.Namespace(story="runtests", path=tmp_path, chapter=None, tag=None, by="chapter"))
+	assert [(chapter, stats["events"]) for chapter, stats in groups] == [(1, 3), (7, 2)]
+	capsys.readouterr()
+
+	args = argparse.Namespace(story="runtests", path=tmp_path, show_connections=False, chapter=2, tag=None)
+	story_threads.show_threads(args)
+	assert capsys.readouterr().out.startswith("There is no story thread")
+	args.chapter = 7
+	story_threads.show_threads(args)
+	assert [line.split()[0] for line in capsys.readouterr().out.splitlines()[2:4]] == ["3", "4"]
+
+def test_metadata_with_outdated_index():
+	thread_list = story_threads.parse_story(json.dumps(WHOLE_THREAD_FIRST).encode())
+	thread_list[4] = {"antagonist in disguise": {"event": "close", "description": "antagonists disguise fails", "chapter": 1}}
+	search_index = story_threads.build_search_index(thread_list)
+	thread_list[4] = {"antagonist in disguise": {"event": "close", "description": "antagonists disguise fails", "chapter": 2}}
+
+	assert story_threads.metadata_positions(thread_list, search_index, chapter=1) == []
+	assert [(chapter, stats["events"]) for chapter, stats in story_threads.group_stats(thread_list, search_index, "chapter")] == [(2, 1)]
+
+
+### test story threads model ###
+
+def test_model_chains_operations_in_memory():
+	store = story_threads.MemoryStore()
+	threads = story_threads.StoryThreads("runtests", store)
+
+	threads.add(["hero searches artifact", "hero finds the first clue"], [0, 1])
+	threads.add(["villain", "villain appears"], [1])
+	threads.add(["hero searches artifact", "hero finds the artifact"], [3], close=True)
+	threads.move(1, 1, 3)
+	threads.rename("villain", "rival")
+
+	assert store.operations == []
+	assert [next(iter(el.keys())) for el in threads.thread_list] == ["hero searches artifact", "hero searches artifact", "rival", "hero searches artifact"]
+	assert threads.query("artifact")[-1] == (3, "hero searches artifact", "close", "hero finds the artifact")
+	assert threads.stats()["open"] == 1
+	assert threads.render()[-1] == "Number of open threads: 1 + 1 (main thread)"
+
+	threads.undo()
+	assert "villain" in threads.thread_list[2]
+	assert threads.save("edit")
+	assert store.operations == ["edit"]
+	assert store.thread_list == threads.thread_list
+	assert not threads.save()
+
+def test_model_remove_returns_notices():
+	threads = story_threads.StoryThreads("runtests", story_threads.MemoryStore(story_threads.parse_story(json.dumps(WHOLE_THREAD))))
+
+	notices = threads.remove("antagonist in disguise", ["0", "5", "fake-ally"])
+
+	assert notices == ["Did not remove thread development at index 0 as it is not a development.", "Did not remove thread development at index 5 as it does not exist."]
+	assert len(threads.thread_list) == 2
+
+def test_model_rejected_change_keeps_thread():
+	threads = story_threads.StoryThreads("runtests", story_threads.MemoryStore())
+	threads.add(["a", "a", "a meets b"], [0, 1])
+	threads.add(["b", "b", "b ends"], [2, 3], close=True)
+	threads.add(["a", "a ends"], [4], close=True)
+	threads.save()
+	thread_list = list(threads.thread_list)
+
+	# the development cannot move behind the closing
+	with pytest.raises(ValueError):
+		threads.change("a", development=["a meets b", "5"])
+
+	assert threads.thread_list == thread_list
+	assert not threads.save()
+
+def test_model_remove_by_description():
+	threads = story_threads.StoryThreads("runtests", story_threads.MemoryStore())
+	threads.add(["a", "a meets b", "a meets b"], [0, 1, 2])
+	threads.add(["b", "b", "a meets b", "A meets b"], [3, 4, 5])
+
+	notices = threads.remove("a", ["a meets b"])
+
+	# the same description of another thread is kept, with a notice
+	assert notices == ["Did not remove thread development at index 4 as it belongs to a different thread."]
+	assert [el for el in threads.thread_list if "a" in el] == [{"a": {"event": "open", "description": "a"}}]
+	assert len(threads.thread_list) == 4
+
+def test_model_stores_on_save(tmp_path):
+	store = story_threads.FileStore("runtests", tmp_path, jsonl=True)
+	threads = story_threads.StoryThreads("runtests", store)
+	for i in range(100):
+		threads.add([f"thread {i}", f"event {i}"], [i])
+
+	assert not Path(tmp_path, "runtests.jsonl").exists()
+
+	threads.change("thread 0", opening=["50"])
+	threads.save("import")
+
+	assert story_threads.retrieve_storythreads("runtests", tmp_path) == threads.thread_list
+	assert next(iter(threads.thread_list[50].keys())) == "thread 0"
+	assert [entry["operation"] for entry in story_threads.retrieve_history("runtests", tmp_path)] == ["initial", "import"]
+
+def test_change_is_one_operation(tmp_path):
+	with open(Path(tmp_path, "runtests.json"), "w") as f:
+		json.dump(WHOLE_THREAD_FIRST, f)
+	args = argparse.Namespace(story="runtests", path=tmp_path, show_connections=False, name="antagonist in disguise", opening="", development="", ending=["3"])
+
+	story_threads.change_thread(args)
+
+	assert [entry["operation"] for entry in story_threads.retrieve_history("runtests", tmp_path)] == ["initial", "change"]
+	assert story_threads.retrieve_storythreads("runtests", tmp_path)[3]["antagonist in disguise"]["event"] == "close"
+
+
+### test workspace ###
+
+def write_workspace(path):
+	"""
+	Store two stories, one in a subdirectory, a broken story and an
+	undo cache in the given path
+	"""
+	with open(Path(path, "first.json"), "w") as f:
+		json.dump(WHOLE_THREAD_FIRST, f, ensure_ascii=False)
+	Path(path, "series").mkdir()
+	with open(Path(path, "series", "second.json"), "w") as f:
+		json.dump({"0": {"a": {"event": "open", "description": "a"}}}, f)
+	with open(Path(path, "broken.json"), "w") as f:
+		json.dump(["not a story"], f)
+	with open(Path(path, ".first.json"), "w") as f:
+		json.dump({}, f)
+
+def test_stats(tmp_path, capsys):
+	with open(Path(tmp_path, "runtests.json"), "w") as f:
+		json.dump(WHOLE_THREAD_FIRST, f, ensure_ascii=False)
+
+	stats = story_threads.show_stats(argparse.Namespace(story="runtests", path=tmp_path))
+
+	assert stats == {"events": 5, "developments": 2, "threads": 2, "open": 1, "longest": "antagonist in disguise", "longest events": 3}
+	assert "Number of threads: 2 (1 open)" in capsys.readouterr().out
+
+def test_discover_stories(tmp_path):
+	write_workspace(tmp_path)
+
+	assert story_threads.discover_stories(tmp_path) == ["broken", "first", "series/second"]
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_stats_all(monkeypatch, tmp_path, capsys, jobs):
+	write_workspace(tmp_path)
+
+	monkeypatch.setattr(ALL_ARGS, "path", tmp_path)
+	monkeypatch.setattr(ALL_ARGS, "jobs", jobs)
+
+	failures = story_threads.stats_all(ALL_ARGS)
+
+	assert [story for story, error in failures] == ["broken"]
+	output = capsys.readouterr().out
+	assert output.index("=== broken ===") < output.index("=== first ===") < output.index("=== series/second ===")
+	assert "Number of events: 5 (2 developments)" in output
+	assert "Processed 3 stories, 1 failed: broken." in output
+
+def test_search_all(monkeypatch, tmp_path, capsys):
+	write_workspace(tmp_path)
+
+	monkeypatch.setattr(ALL_ARGS, "path", tmp_path)
+	monkeypatch.setattr(ALL_ARGS, "query", ["lonely"])
+
+	story_threads.search_all(ALL_ARGS)
+
+	output = capsys.readouterr().out
+	assert "=== first ===" in output
+	assert "series/second" not in output
+
+def test_check_all(monkeypatch, tmp_path, capsys):
+	write_workspace(tmp_path)
+	with open(Path(tmp_path, "series", "third.json"), "w") as f:
+		json.dump({"0": {"a": {"event": "close", "description": "a ends"}}, "1": {"a": {"event": "open", "description": "a"}}}, f)
+
+	monkeypatch.setattr(ALL_ARGS, "path", tmp_path)
+
+	failures = story_threads.check_all(ALL_ARGS)
+
+	assert [story for story, error in failures] == ["broken", "series/third"]
+	assert "series/second" not in capsys.readouterr().out
+
+def test_workspace_keeps_hidden_files_next_to_stories(monkeypatch, tmp_path, capsys):
+	write_workspace(tmp_path)
+
+	monkeypatch.setattr(ALL_ARGS, "path", tmp_path)
+	story_threads.check_all(argparse.Namespace(**{**vars(ALL_ARGS), "repair": True}))
+
+	assert Path(tmp_path, "series", ".second.parsed").exists()
+	assert not Path(tmp_path, ".series").exists()
+
+def test_workspace_command_line(tmp_path):
+	run_py = str(Path(__file__).parents[1] / "run.py")
+	def run(*arguments):
+		return subprocess.run([sys.executable, run_py, "-p", str(tmp_path), *arguments], capture_output=True, text=True)
+
+	# a story may be named like a workspace command
+	assert run("diff", "add", "a", "-i", "0").returncode == 0
+	assert "0 ├──a" in run("diff", "show").stdout
+	assert run("--workspace", "check-all").returncode == 0
+
+	with open(Path(tmp_path, "broken.json"), "w") as f:
+		json.dump({"0": {"a": {"event": "close", "description": "a ends"}}}, f)
+
+	assert run("--workspace", "check-all").returncode == 1
+
+
 # error cases (change), also checked by argparse:
 # two events are passed (currently mutually exclusive)
 